@@ -1,14 +1,17 @@
-# scripts/03-install-docker.sh
 #!/bin/bash
+# scripts/03-install-docker.sh
 set -e
 
 echo "安裝 Docker..."
+# 倉庫與套件已由 block-composer.py 合併安裝時略過
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 sudo apt-get install -y ca-certificates curl gnupg lsb-release
 sudo mkdir -m 0755 -p /etc/apt/keyrings
 curl -fsSL https://download.docker.com/linux/ubuntu/gpg | sudo gpg --dearmor -o /etc/apt/keyrings/docker.gpg
 echo "deb [arch=$(dpkg --print-architecture) signed-by=/etc/apt/keyrings/docker.gpg] https://download.docker.com/linux/ubuntu $(lsb_release -cs) stable" | sudo tee /etc/apt/sources.list.d/docker.list > /dev/null
 sudo apt-get update
 sudo apt-get install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin
+fi
 sudo systemctl enable docker
 sudo systemctl start docker
 sudo usermod -aG docker ubuntu
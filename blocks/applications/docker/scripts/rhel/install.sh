@@ -3,6 +3,8 @@ set -e
 
 echo "🐳 開始在 RHEL/CentOS 系統上安裝 Docker..."
 
+# 倉庫與套件已由 block-composer.py 合併安裝時略過
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 # 移除舊版本
 sudo yum remove -y docker \
                   docker-client \
@@ -21,6 +23,7 @@ sudo yum-config-manager --add-repo https://download.docker.com/linux/centos/dock
 
 # 安裝 Docker CE
 sudo yum install -y docker-ce docker-ce-cli containerd.io docker-buildx-plugin docker-compose-plugin
+fi
 
 # 啟動 Docker 服務
 sudo systemctl enable docker
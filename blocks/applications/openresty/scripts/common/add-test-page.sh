@@ -1,5 +1,5 @@
-# scripts/06-add-test-page.sh
 #!/bin/bash
+# scripts/06-add-test-page.sh
 set -e
 
 echo "建立更新的測試網頁..."
@@ -1,5 +1,5 @@
-# scripts/04-setup-nginx.sh
 #!/bin/bash
+# scripts/04-setup-nginx.sh
 set -e
 
 echo "設定 Nginx..."
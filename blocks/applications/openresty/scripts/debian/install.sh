@@ -3,6 +3,8 @@ set -euo pipefail
 
 echo "[$(date +'%Y-%m-%d %H:%M:%S')] Installing OpenResty..."
 
+# Repository and packages are skipped when block-composer.py installs them in one transaction
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 # Install prerequisites
 sudo apt-get update
 sudo apt-get install -y wget gnupg ca-certificates lsb-release
@@ -17,6 +19,7 @@ sudo apt-get update
 
 # Install OpenResty
 sudo apt-get install -y openresty
+fi
 
 # Create necessary directories
 sudo mkdir -p /usr/local/openresty/nginx/conf/sites-available
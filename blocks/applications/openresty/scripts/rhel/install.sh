@@ -3,6 +3,8 @@ set -e
 
 echo "🔧 開始在 RHEL/CentOS 系統上安裝 OpenResty..."
 
+# 倉庫與套件已由 block-composer.py 合併安裝時略過
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 # 安裝必要的套件
 sudo yum install -y yum-utils
 
@@ -14,6 +16,7 @@ sudo yum install -y openresty
 
 # 安裝額外的 Lua 模組
 sudo yum install -y openresty-opm
+fi
 
 # 設定系統服務
 sudo systemctl enable openresty
@@ -1,5 +1,5 @@
-# scripts/99-cleanup.sh
 #!/bin/bash
+# scripts/99-cleanup.sh
 set -e
 
 echo "清理系統..."
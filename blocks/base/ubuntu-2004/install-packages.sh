@@ -1,9 +1,12 @@
-# scripts/02-install-packages.sh
 #!/bin/bash
+# scripts/02-install-packages.sh
 set -e
 
 # 設定非互動模式，避免 debconf 前端錯誤
 export DEBIAN_FRONTEND=noninteractive
 
+# 套件已由 block-composer.py 合併安裝時略過
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 echo "安裝基本套件..."
 sudo apt-get install -y nginx curl wget unzip htop git
+fi
@@ -1,5 +1,5 @@
-# scripts/01-system-update.sh
 #!/bin/bash
+# scripts/01-system-update.sh
 set -e
 
 # 設定非互動模式，避免 debconf 前端錯誤
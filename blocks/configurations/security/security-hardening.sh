@@ -3,9 +3,11 @@ set -euo pipefail
 
 echo "[$(date +'%Y-%m-%d %H:%M:%S')] Applying security hardening..."
 
-# Install fail2ban
+# Install fail2ban (skipped when block-composer.py installs packages in one transaction)
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
 sudo apt-get update
 sudo apt-get install -y fail2ban
+fi
 
 # Configure fail2ban
 sudo tee /etc/fail2ban/jail.local > /dev/null << 'EOF'
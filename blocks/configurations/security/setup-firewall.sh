@@ -1,5 +1,5 @@
-# scripts/07-setup-firewall.sh
 #!/bin/bash
+# scripts/07-setup-firewall.sh
 set -e
 
 echo "設定防火牆..."
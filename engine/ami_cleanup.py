@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+AMI 清理引擎 - 依標籤保留規則挑選過期的 AMI，批次檢查使用中的實例後平行取消註冊並刪除快照
+
+預設只輸出清理計畫（dry-run），加上 --execute 才會實際刪除。
+所有 AWS 呼叫都透過傳入的 EC2 client，可直接對 moto 等本地替身測試。
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List
+
+# 預設只處理由 Packer 建構的 AMI
+DEFAULT_FILTER_TAGS = {"PackerBuild": "true"}
+
+DEFAULT_GROUP_BY = ("EnabledBlocks", "Environment")
+
+# 可重試的 EC2 錯誤碼: API 限流，以及取消註冊後快照短暫仍被佔用
+RETRYABLE_ERRORS = {
+    "RequestLimitExceeded", "Throttling", "ThrottlingException",
+    "InternalError", "ServiceUnavailable", "InvalidSnapshot.InUse"
+}
+
+# 視為使用中的實例狀態
+IN_USE_STATES = ["pending", "running", "shutting-down", "stopping", "stopped"]
+
+# describe_instances 的 image-id 過濾條件一次最多帶入的數量
+IN_USE_CHUNK_SIZE = 200
+
+
+def create_ec2_client(region: str, endpoint_url: str = None):
+    """建立 EC2 client，boto3 只在實際連線 AWS 時才需要"""
+    try:
+        import boto3
+    except ImportError:
+        raise RuntimeError("需要安裝 boto3 才能連線 AWS: pip install boto3")
+    return boto3.client("ec2", region_name=region, endpoint_url=endpoint_url)
+
+
+def _error_code(error: Exception) -> str:
+    """取得 botocore ClientError 的錯誤碼，不直接依賴 botocore"""
+    return getattr(error, 'response', {}).get('Error', {}).get('Code', '')
+
+
+def _tags(image: Dict[str, Any]) -> Dict[str, str]:
+    return {tag['Key']: tag['Value'] for tag in image.get('Tags', [])}
+
+
+def _parse_time(value: str) -> datetime:
+    """解析 EC2 的 CreationDate（例如 2024-01-02T03:04:05.000Z）"""
+    return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S").replace(tzinfo=timezone.utc)
+
+
+def list_images(ec2, filter_tags: Dict[str, str] = None, owners: List[str] = None) -> Iterator[Dict[str, Any]]:
+    """逐頁列出符合標籤條件的 AMI"""
+    filters = [
+        {'Name': f"tag:{key}", 'Values': [value]}
+        for key, value in (DEFAULT_FILTER_TAGS if filter_tags is None else filter_tags).items()
+    ]
+    paginator = ec2.get_paginator('describe_images')
+    for page in paginator.paginate(Owners=owners or ['self'], Filters=filters):
+        yield from page.get('Images', [])
+
+
+class RetentionPolicy:
+    """
+    以標籤分組的保留規則
+
+    每組（預設依 EnabledBlocks 與 Environment）保留最新的 keep_latest 個 AMI；
+    超過 max_age_days 的 AMI 即使在最新的 keep_latest 個之內也會被清理，
+    但每組至少保留 min_keep 個最新的 AMI。
+    """
+
+    def __init__(self, keep_latest: int = 3, max_age_days: float = None,
+                 group_by: Iterable[str] = DEFAULT_GROUP_BY, min_keep: int = 1):
+        self.keep_latest = keep_latest
+        self.max_age_days = max_age_days
+        self.group_by = tuple(group_by)
+        self.min_keep = min_keep
+
+    def group_key(self, image: Dict[str, Any]) -> str:
+        tags = _tags(image)
+        return "|".join(f"{key}={tags.get(key, '')}" for key in self.group_by)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'keep_latest': self.keep_latest,
+            'max_age_days': self.max_age_days,
+            'group_by': list(self.group_by),
+            'min_keep': self.min_keep
+        }
+
+
+def select_candidates(images: Iterable[Dict[str, Any]], policy: RetentionPolicy,
+                      now: datetime = None) -> Dict[str, List[Dict[str, Any]]]:
+    """依保留規則將 AMI 分為保留與刪除兩組，每筆都附上原因"""
+    now = now or datetime.now(timezone.utc)
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for image in images:
+        groups.setdefault(policy.group_key(image), []).append(image)
+
+    keep, delete = [], []
+    for group, members in sorted(groups.items()):
+        members.sort(key=lambda image: image.get('CreationDate', ''), reverse=True)
+        for rank, image in enumerate(members):
+            age_days = (now - _parse_time(image['CreationDate'])).total_seconds() / 86400
+            entry = {
+                'image_id': image['ImageId'],
+                'name': image.get('Name', ''),
+                'group': group,
+                'created_at': image['CreationDate'],
+                'age_days': round(age_days, 1),
+                'rank': rank + 1,
+                'snapshots': [
+                    mapping['Ebs']['SnapshotId'] for mapping in image.get('BlockDeviceMappings', [])
+                    if mapping.get('Ebs', {}).get('SnapshotId')
+                ]
+            }
+            if rank < policy.min_keep:
+                entry['reason'] = f"每組至少保留 {policy.min_keep} 個"
+                keep.append(entry)
+            elif policy.max_age_days is not None and age_days > policy.max_age_days:
+                entry['reason'] = f"超過 {policy.max_age_days} 天"
+                delete.append(entry)
+            elif rank >= policy.keep_latest:
+                entry['reason'] = f"超出最新的 {policy.keep_latest} 個"
+                delete.append(entry)
+            else:
+                entry['reason'] = f"最新的 {policy.keep_latest} 個之一"
+                keep.append(entry)
+    return {'keep': keep, 'delete': delete, 'groups': len(groups)}
+
+
+def find_images_in_use(ec2, image_ids: List[str]) -> Dict[str, List[str]]:
+    """以分批的 describe_instances 查詢仍有實例使用的 AMI，回傳 AMI ID → 實例 ID"""
+    in_use: Dict[str, List[str]] = {}
+    paginator = ec2.get_paginator('describe_instances')
+    for start in range(0, len(image_ids), IN_USE_CHUNK_SIZE):
+        chunk = image_ids[start:start + IN_USE_CHUNK_SIZE]
+        pages = paginator.paginate(Filters=[
+            {'Name': 'image-id', 'Values': chunk},
+            {'Name': 'instance-state-name', 'Values': IN_USE_STATES}
+        ])
+        for page in pages:
+            for reservation in page.get('Reservations', []):
+                for instance in reservation.get('Instances', []):
+                    in_use.setdefault(instance['ImageId'], []).append(instance['InstanceId'])
+    return in_use
+
+
+def build_cleanup_plan(ec2, region: str, policy: RetentionPolicy,
+                       filter_tags: Dict[str, str] = None, now: datetime = None) -> Dict[str, Any]:
+    """列出 AMI、套用保留規則並排除使用中的 AMI，產生完整的清理計畫"""
+    images = list(list_images(ec2, filter_tags))
+    selection = select_candidates(images, policy, now)
+
+    in_use = find_images_in_use(ec2, [entry['image_id'] for entry in selection['delete']])
+    delete, skipped = [], []
+    for entry in selection['delete']:
+        if entry['image_id'] in in_use:
+            skipped.append(dict(entry, reason="仍有實例使用", instances=in_use[entry['image_id']]))
+        else:
+            delete.append(entry)
+
+    return {
+        'region': region,
+        'generated_at': (now or datetime.now(timezone.utc)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'policy': policy.to_dict(),
+        'filter_tags': DEFAULT_FILTER_TAGS if filter_tags is None else filter_tags,
+        'images_scanned': len(images),
+        'groups': selection['groups'],
+        'delete': delete,
+        'in_use': skipped,
+        'keep': selection['keep'],
+        'snapshots': sum(len(entry['snapshots']) for entry in delete)
+    }
+
+
+def call_with_retry(operation, retries: int = 5, backoff: float = 0.5, sleep=time.sleep, **kwargs):
+    """呼叫 EC2 API，遇到可重試的錯誤時以指數退避加上隨機抖動重試"""
+    for attempt in range(retries + 1):
+        try:
+            return operation(**kwargs)
+        except Exception as e:
+            if _error_code(e) not in RETRYABLE_ERRORS or attempt == retries:
+                raise
+            sleep(backoff * (2 ** attempt) * (0.5 + random.random()))
+
+
+class CleanupExecutor:
+    """以有上限的執行緒池平行取消註冊 AMI 並刪除其快照"""
+
+    def __init__(self, ec2, max_workers: int = 8, retries: int = 5, backoff: float = 0.5,
+                 sleep=time.sleep):
+        self.ec2 = ec2
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self.sleep = sleep
+
+    def _call(self, operation, **kwargs):
+        return call_with_retry(operation, self.retries, self.backoff, self.sleep, **kwargs)
+
+    def _delete_image(self, entry: Dict[str, Any], delete_snapshots: bool) -> Dict[str, Any]:
+        """取消註冊單一 AMI，成功後刪除其快照"""
+        result = {
+            'image_id': entry['image_id'],
+            'status': 'success',
+            'deleted_snapshots': [],
+            'failed_snapshots': []
+        }
+        try:
+            self._call(self.ec2.deregister_image, ImageId=entry['image_id'])
+        except Exception as e:
+            result.update(status='failed', error=_error_code(e) or str(e))
+            return result
+
+        if delete_snapshots:
+            for snapshot_id in entry['snapshots']:
+                try:
+                    self._call(self.ec2.delete_snapshot, SnapshotId=snapshot_id)
+                    result['deleted_snapshots'].append(snapshot_id)
+                except Exception as e:
+                    result['failed_snapshots'].append({'snapshot_id': snapshot_id, 'error': _error_code(e) or str(e)})
+            if result['failed_snapshots']:
+                result['status'] = 'partial_success'
+        return result
+
+    def run(self, plan: Dict[str, Any], delete_snapshots: bool = True,
+            on_result=None) -> List[Dict[str, Any]]:
+        """執行清理計畫，回傳依完成順序排列的結果"""
+        results = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._delete_image, entry, delete_snapshots) for entry in plan['delete']]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        return results
+
+
+def _parse_tags(values: List[str]) -> Dict[str, str]:
+    tags = {}
+    for value in values:
+        key, _, tag_value = value.partition("=")
+        tags[key] = tag_value
+    return tags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="依保留規則清理 Packer 建構的 AMI")
+    parser.add_argument("--region", required=True)
+    parser.add_argument("--keep", type=int, default=3, help="每組保留最新的 AMI 數量")
+    parser.add_argument("--max-age-days", type=float, help="超過此天數的 AMI 一律清理")
+    parser.add_argument("--min-keep", type=int, default=1, help="每組至少保留的 AMI 數量")
+    parser.add_argument("--group-by", default=",".join(DEFAULT_GROUP_BY), help="分組依據的標籤")
+    parser.add_argument("--filter-tag", action="append", default=None, metavar="KEY=VALUE",
+                        help="只處理帶有此標籤的 AMI，預設 PackerBuild=true")
+    parser.add_argument("--keep-snapshots", action="store_true", help="只取消註冊 AMI，不刪除快照")
+    parser.add_argument("--max-workers", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--endpoint-url", help="EC2 端點（例如本地的 moto server）")
+    parser.add_argument("--plan-output", help="將清理計畫寫入檔案")
+    parser.add_argument("--execute", action="store_true", help="實際刪除，未指定時只輸出計畫")
+    args = parser.parse_args()
+
+    try:
+        ec2 = create_ec2_client(args.region, args.endpoint_url)
+    except RuntimeError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
+
+    policy = RetentionPolicy(
+        keep_latest=args.keep,
+        max_age_days=args.max_age_days,
+        group_by=[key for key in args.group_by.split(",") if key],
+        min_keep=args.min_keep
+    )
+    filter_tags = _parse_tags(args.filter_tag) if args.filter_tag is not None else None
+    plan = build_cleanup_plan(ec2, args.region, policy, filter_tags)
+
+    plan_json = json.dumps(plan, indent=2, ensure_ascii=False)
+    if args.plan_output:
+        with open(args.plan_output, 'w', encoding='utf-8') as f:
+            f.write(plan_json + "\n")
+    if not args.execute:
+        print(plan_json)
+    print(
+        f"📋 掃描 {plan['images_scanned']} 個 AMI（{plan['groups']} 組）: 刪除 {len(plan['delete'])} 個、"
+        f"{plan['snapshots']} 個快照，使用中略過 {len(plan['in_use'])} 個，保留 {len(plan['keep'])} 個",
+        file=sys.stderr
+    )
+    if not args.execute:
+        print("🧪 DRY RUN: 未刪除任何資源，加上 --execute 以實際執行", file=sys.stderr)
+        return
+
+    executor = CleanupExecutor(ec2, max_workers=args.max_workers, retries=args.retries)
+    results = executor.run(plan, delete_snapshots=not args.keep_snapshots, on_result=lambda r: print(
+        f"  {'✅' if r['status'] == 'success' else '⚠️' if r['status'] == 'partial_success' else '❌'} "
+        f"{r['image_id']}: {r['status']} ({len(r['deleted_snapshots'])} 個快照)", file=sys.stderr
+    ))
+    print(json.dumps({'plan': plan, 'results': results}, indent=2, ensure_ascii=False))
+    if any(result['status'] != 'success' for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+AMI 發佈 - 建構完成後以單次 API 呼叫套用完整標籤，並平行複製到多個區域
+"""
+
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# 依積木類別產生的標籤，標籤值會去除 ID 的類別前綴（與原本 Jenkinsfile 的格式相同）
+CATEGORY_TAGS = (
+    ("base", "Base", "base-"),
+    ("application", "Applications", "app-"),
+    ("configuration", "Configurations", "config-"),
+    ("custom", "Custom", "")
+)
+
+# EC2 單次 create_tags 最多可帶的標籤數
+MAX_TAGS_PER_CALL = 50
+
+
+def compute_publish_tags(build_config: Dict[str, Any], block_categories: Dict[str, str],
+                         extra_tags: Dict[str, str] = None) -> Dict[str, str]:
+    """依建構配置計算 AMI 的完整標籤集合"""
+    packer_vars = build_config['packer_vars']
+    blocks = build_config['blocks']['execution_order']
+    tags = {
+        "Environment": build_config['build_info']['environment'],
+        "Owner": packer_vars.get('owner', ''),
+        "BuildDate": time.strftime('%Y-%m-%d', time.gmtime()),
+        "EnabledBlocks": ",".join(blocks),
+        "BuildFingerprint": build_config['build_info'].get('fingerprint', ''),
+        "OSFamily": build_config['os_info']['family']
+    }
+    for category, tag_key, prefix in CATEGORY_TAGS:
+        names = [
+            block_id[len(prefix):] if prefix and block_id.startswith(prefix) else block_id
+            for block_id in blocks if block_categories.get(block_id, 'custom') == category
+        ]
+        if names:
+            tags[tag_key] = "_".join(names)
+    tags.update(extra_tags or {})
+    if len(tags) > MAX_TAGS_PER_CALL:
+        raise ValueError(f"標籤數量 {len(tags)} 超過單次呼叫上限 {MAX_TAGS_PER_CALL}")
+    return tags
+
+
+def tag_image(ec2, image_id: str, tags: Dict[str, str]):
+    """以單次 create_tags 套用所有標籤"""
+    ec2.create_tags(
+        Resources=[image_id],
+        Tags=[{'Key': key, 'Value': str(value)} for key, value in sorted(tags.items())]
+    )
+
+
+class RegionCopier:
+    """
+    將 AMI 平行複製到多個區域並以 asyncio 輪詢狀態
+
+    client_factory(region) 需回傳該區域的 EC2 client；boto3 的呼叫是同步的，
+    因此以 asyncio.to_thread 執行，輪詢間隔內不佔用執行緒。
+    """
+
+    def __init__(self, client_factory: Callable[[str], Any], poll_interval: float = 15,
+                 timeout: float = 3600):
+        self.client_factory = client_factory
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    async def _copy(self, source_region: str, image_id: str, name: str, region: str,
+                    tags: Dict[str, str]) -> Dict[str, Any]:
+        """複製到單一區域，等待 available 後套用相同標籤"""
+        import asyncio
+        started = time.monotonic()
+        result = {'region': region, 'ami_id': None, 'state': 'failed'}
+        try:
+            ec2 = self.client_factory(region)
+            response = await asyncio.to_thread(
+                ec2.copy_image, SourceRegion=source_region, SourceImageId=image_id,
+                Name=name, Description=f"Copied from {source_region}:{image_id}"
+            )
+            result['ami_id'] = response['ImageId']
+
+            while True:
+                images = await asyncio.to_thread(ec2.describe_images, ImageIds=[result['ami_id']])
+                state = images['Images'][0]['State'] if images.get('Images') else 'pending'
+                if state in ('available', 'failed', 'invalid', 'error', 'deregistered'):
+                    result['state'] = state
+                    break
+                if time.monotonic() - started > self.timeout:
+                    result['state'] = 'timeout'
+                    break
+                await asyncio.sleep(self.poll_interval)
+
+            if result['state'] == 'available' and tags:
+                await asyncio.to_thread(tag_image, ec2, result['ami_id'], tags)
+        except Exception as e:
+            result['error'] = getattr(e, 'response', {}).get('Error', {}).get('Code') or str(e)
+        result['elapsed_seconds'] = round(time.monotonic() - started, 1)
+        return result
+
+    async def copy_all(self, source_region: str, image_id: str, name: str,
+                       regions: List[str], tags: Dict[str, str] = None) -> List[Dict[str, Any]]:
+        """同時複製到所有目標區域"""
+        import asyncio
+        targets = [region for region in dict.fromkeys(regions) if region and region != source_region]
+        return list(await asyncio.gather(*(
+            self._copy(source_region, image_id, name, region, tags) for region in targets
+        )))
+
+
+def publish_image(client_factory: Callable[[str], Any], source_region: str, image_id: str,
+                  tags: Dict[str, str], copy_regions: List[str] = None,
+                  poll_interval: float = 15, timeout: float = 3600) -> Dict[str, Any]:
+    """
+    套用標籤並複製到其他區域，回傳各區域 AMI ID 的彙整 manifest
+
+    來源 AMI 的標籤在複製前套用。copy_image 不會帶上來源的標籤，因此各區域的副本在 available 後
+    套用來源 AMI 的全部標籤（包含 Packer 建構時設定的 PackerBuild、Name、BuildType，ami_cleanup
+    預設以 PackerBuild=true 篩選）再加上發佈標籤。
+    """
+    ec2 = client_factory(source_region)
+    tag_image(ec2, image_id, tags)
+
+    images = ec2.describe_images(ImageIds=[image_id]).get('Images', [])
+    source_tags = {tag['Key']: tag['Value'] for tag in images[0].get('Tags', [])} if images else {}
+    # aws: 開頭的標籤由 AWS 保留，無法以 create_tags 設定
+    copy_tags = {key: value for key, value in source_tags.items() if not key.startswith('aws:')}
+    copy_tags.update(tags)
+    name = tags.get('Name') or (images[0].get('Name', image_id) if images else image_id)
+
+    copies = []
+    if copy_regions:
+        # asyncio 只在需要複製時才載入，避免拖慢組合器每次啟動
+        import asyncio
+        copier = RegionCopier(client_factory, poll_interval, timeout)
+        copies = asyncio.run(copier.copy_all(source_region, image_id, name, copy_regions, copy_tags))
+
+    return {
+        'source': {'region': source_region, 'ami_id': image_id},
+        'tags': tags,
+        'regions': dict(
+            [(source_region, image_id)] +
+            [(copy['region'], copy['ami_id']) for copy in copies if copy['state'] == 'available']
+        ),
+        'copies': copies,
+        'failed': [copy['region'] for copy in copies if copy['state'] != 'available']
+    }
+
+
+def write_publish_manifest(manifest: Dict[str, Any], output_path: str) -> Path:
+    """寫出發佈結果"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+    return output_path
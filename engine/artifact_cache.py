@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+建構產物索引 - 以 JSON 檔案記錄已產生的中間層 AMI 與完成的建構，供後續建構重用
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class JsonIndex:
+    """以單一 JSON 檔案保存的鍵值索引，每次寫入都以原子方式替換檔案"""
+
+    def __init__(self, index_file: str):
+        self.index_file = Path(index_file)
+        self.records: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.records = json.load(f).get('records', {})
+        except (OSError, ValueError):
+            self.records = {}
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """取得索引項目"""
+        return self.records.get(key)
+
+    def put(self, key: str, record: Dict[str, Any]):
+        """寫入索引項目並立即存檔"""
+        self.records[key] = record
+        self.save()
+
+    def remove(self, key: str):
+        """移除索引項目並立即存檔"""
+        if self.records.pop(key, None) is not None:
+            self.save()
+
+    def save(self):
+        """將索引寫回磁碟"""
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_name(f"{self.index_file.name}.{os.getpid()}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'records': self.records}, f, indent=2, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_file, self.index_file)
+
+
+class FakeAmiStore(JsonIndex):
+    """本地的 AMI 替身，依來源 AMI 與積木內容雜湊產生固定的 AMI ID"""
+
+    def create_image(self, source_ami: str, blocks: List[str], content_hash: str,
+                     region: str = "") -> str:
+        """模擬以來源 AMI 執行積木後建立新映像"""
+        ami_id = "ami-" + hashlib.sha256(f"{source_ami}:{content_hash}".encode('utf-8')).hexdigest()[:17]
+        self.put(ami_id, {
+            'source_ami': source_ami,
+            'blocks': list(blocks),
+            'content_hash': content_hash,
+            'region': region,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        })
+        return ami_id
+
+    def exists(self, ami_id: str) -> bool:
+        """檢查 AMI 是否仍存在"""
+        return ami_id in self.records
+
+
+class AmiLayerCache(JsonIndex):
+    """以積木前綴內容雜湊為鍵的中間層 AMI 索引"""
+
+    def find_longest_prefix(self, prefix_hashes: List[str],
+                            ami_store: FakeAmiStore = None) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """
+        由最長的前綴開始查詢，回傳 (命中的前綴長度, 索引項目)
+
+        若提供 ami_store，已不存在的 AMI 會被視為未命中並從索引移除。
+        """
+        for depth in range(len(prefix_hashes), 0, -1):
+            record = self.get(prefix_hashes[depth - 1])
+            if not record:
+                continue
+            if ami_store is not None and not ami_store.exists(record['ami_id']):
+                self.remove(prefix_hashes[depth - 1])
+                continue
+            return depth, record
+        return 0, None
+
+    def register(self, prefix_hash: str, ami_id: str, blocks: List[str], region: str = ""):
+        """登記新產生的中間層 AMI"""
+        self.put(prefix_hash, {
+            'ami_id': ami_id,
+            'blocks': list(blocks),
+            'region': region,
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        })
+
+
+class BuildIndex(JsonIndex):
+    """以建構指紋為鍵的已完成建構索引，由 packer-manifest.json 匯入"""
+
+    def find(self, fingerprint: str) -> Optional[Dict[str, Any]]:
+        """依指紋查詢既有的建構產物"""
+        return self.get(fingerprint)
+
+    def record(self, fingerprint: str, artifact_id: str, **metadata):
+        """登記建構產物，artifact_id 格式為 Packer 的 "region:ami-xxx" """
+        region, _, ami_id = artifact_id.rpartition(':')
+        record = {'artifact_id': artifact_id, 'ami_id': ami_id, 'region': region}
+        record.update(metadata)
+        self.put(fingerprint, record)
+
+    def ingest_manifest(self, manifest_path: str, build_config: Dict[str, Any] = None) -> int:
+        """
+        匯入 packer-manifest.json 中帶有指紋的建構結果，回傳匯入筆數
+
+        各積木的內容雜湊取自 build_config 或模板寫入的 custom_data，供變更影響分析使用。
+        """
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        ingested = 0
+        for build in manifest.get('builds', []):
+            custom_data = build.get('custom_data') or {}
+            fingerprint = custom_data.get('fingerprint')
+            if not fingerprint or not build.get('artifact_id'):
+                continue
+
+            metadata = {
+                'enabled_blocks': custom_data.get('enabled_blocks', ''),
+                'environment': custom_data.get('environment', ''),
+                'build_time': build.get('build_time'),
+                'packer_run_uuid': build.get('packer_run_uuid')
+            }
+            if build_config and build_config['build_info'].get('fingerprint') == fingerprint:
+                metadata['block_hashes'] = build_config['build_info'].get('block_hashes', {})
+            elif custom_data.get('block_hashes'):
+                # packer_template 產生的模板會把各積木的內容雜湊寫入 custom_data
+                try:
+                    metadata['block_hashes'] = json.loads(custom_data['block_hashes'])
+                except ValueError:
+                    pass
+
+            # 多區域建構時 artifact_id 以逗號分隔，只登記第一個作為主要產物
+            artifact_id = build['artifact_id'].split(',')[0]
+            self.record(fingerprint, artifact_id, **metadata)
+            ingested += 1
+        return ingested
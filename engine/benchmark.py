@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+效能基準測試 - 在磁碟上產生合成的積木樹，量測 BlockComposer 各項操作的延遲與記憶體用量
+"""
+
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from registry_cache import yaml_loader_name
+
+BENCHMARK_FORMAT_VERSION = 1
+
+DEFAULT_SIZES = (100, 1000, 10000)
+
+# 合成積木分佈在這些類別目錄下
+_CATEGORIES = (("applications", "application"), ("configurations", "configuration"))
+
+# 每三個合成積木有一個宣告 os_support，其餘與 OS 無關
+_OS_SUPPORT = (("debian", ["20.04", "22.04"]), ("amazon-linux", ["2", "2023"]), ("rhel", ["8", "9"]))
+
+# 量測 query_blocks 時輪流使用的查詢
+_QUERIES = (
+    {'os_family': 'amazon-linux', 'os_version': '2023', 'provides': ['feat-00000-0']},
+    {'category': 'application', 'tags': ['tier-1']},
+    {'os_family': 'debian', 'tags': ['group-3']},
+    {'requires': ['linux-os'], 'category': ['application', 'configuration']}
+)
+
+
+def generate_synthetic_tree(root: str, block_count: int, provides_fanout: int = 2,
+                            requires_fanout: int = 2, depth: int = 4,
+                            seed: int = 0) -> Dict[str, Any]:
+    """
+    產生合成積木樹，回傳每層的積木 ID
+
+    積木依 depth 分層，每個積木提供 provides_fanout 個功能，並需要上一層
+    requires_fanout 個功能，因此任一積木的依賴閉包大小以 requires_fanout ** depth 為上限。
+    block.yaml 以 JSON 寫出（JSON 也是合法的 YAML）。
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    base_dir = root / "base" / "bench-base"
+    base_dir.mkdir(parents=True, exist_ok=True)
+    _write_block(base_dir, {
+        "id": "bench-base",
+        "name": "Synthetic Base",
+        "category": "base",
+        "os_info": {"family": "debian", "version": "20.04", "ssh_username": "ubuntu"},
+        "provides": ["linux-os"],
+        "scripts": {"install": "install.sh"},
+        "execution_order": 1
+    })
+
+    app_count = max(block_count - 1, 0)
+    depth = max(1, min(depth, app_count or 1))
+    layers: List[List[str]] = [[] for _ in range(depth)]
+    providers: Dict[str, str] = {}
+    requires_of: Dict[str, List[str]] = {}
+
+    for index in range(app_count):
+        layer = index * depth // app_count
+        block_id = f"bench-{index:05d}"
+        provides = [f"feat-{index:05d}-{n}" for n in range(provides_fanout)]
+        requires = ["linux-os"]
+        if layer > 0:
+            previous = layers[layer - 1]
+            for provider in rng.sample(previous, min(requires_fanout, len(previous))):
+                requires.append(f"feat-{provider[len('bench-'):]}-0")
+
+        directory, category = _CATEGORIES[index % len(_CATEGORIES)]
+        block_dir = root / directory / block_id
+        block_dir.mkdir(parents=True, exist_ok=True)
+        block = {
+            "id": block_id,
+            "name": f"Synthetic Block {index}",
+            "category": category,
+            "description": "synthetic benchmark block",
+            "tags": [f"tier-{layer}", f"group-{index % 10}"],
+            "provides": provides,
+            "requires": requires,
+            "parameters": [{"name": "version", "type": "string", "default": "1.0"}],
+            "scripts": {"install": "install.sh", "configure": "configure.sh"},
+            "execution_order": 10 + layer * 10 + rng.randint(0, 9)
+        }
+        if index % 3 == 0:
+            # 基礎積木為 debian，os_support 一律包含 debian 才能產生建構配置
+            block["os_support"] = [
+                {"os_family": family, "os_versions": versions, "scripts": block["scripts"]}
+                for family, versions in (_OS_SUPPORT[0], _OS_SUPPORT[1 + index // 3 % 2])
+            ]
+        _write_block(block_dir, block)
+        layers[layer].append(block_id)
+        requires_of[block_id] = requires
+        for feature in provides:
+            providers[feature] = block_id
+
+    return {
+        'root': str(root),
+        'blocks': block_count,
+        'layers': layers,
+        'providers': providers,
+        'requires': requires_of
+    }
+
+
+def _write_block(block_dir: Path, block: Dict[str, Any]):
+    """寫出 block.yaml 與其腳本"""
+    with open(block_dir / "block.yaml", 'w', encoding='utf-8') as f:
+        json.dump({"block": block}, f, indent=2)
+    for script in block.get('scripts', {}).values():
+        (block_dir / script).write_text(f"#!/bin/bash\necho '{block['id']} {script}'\n", encoding='utf-8')
+
+
+def sample_selections(tree: Dict[str, Any], count: int, seed: int = 0) -> List[List[str]]:
+    """由最上層挑選積木並展開其依賴閉包，產生必定合法的積木組合"""
+    rng = random.Random(seed)
+    candidates = next((layer for layer in reversed(tree['layers']) if layer), [])
+    if not candidates:
+        return [["bench-base"]] * count
+
+    selections = []
+    for _ in range(count):
+        target = rng.choice(candidates)
+        selected = {"bench-base"}
+        stack = [target]
+        while stack:
+            block_id = stack.pop()
+            if block_id in selected:
+                continue
+            selected.add(block_id)
+            stack.extend(
+                tree['providers'][feature] for feature in tree['requires'][block_id]
+                if feature in tree['providers']
+            )
+        selection = sorted(selected)
+        rng.shuffle(selection)
+        selections.append(selection)
+    return selections
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    """以 nearest-rank 方法計算百分位數"""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def measure(operation: Callable[[int], Any], iterations: int) -> Dict[str, Any]:
+    """
+    量測操作的延遲分佈與峰值記憶體
+
+    延遲與記憶體分開量測，避免 tracemalloc 的額外負擔影響計時結果。
+    operation 接收迭代序號，方便輪流使用不同的輸入。
+    """
+    samples = []
+    for iteration in range(iterations):
+        started = time.perf_counter()
+        operation(iteration)
+        samples.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        operation(0)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(samples, 50), 4),
+        'p99_ms': round(percentile(samples, 99), 4),
+        'mean_ms': round(sum(samples) / len(samples), 4),
+        'max_ms': round(max(samples), 4),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def _full_reload(composer):
+    """
+    重新掃描並重建索引
+
+    _load_blocks 在註冊表版本未變時不會重建索引（常駐服務的快速路徑），基準測試要量測的是
+    掃描加上建立 BlockModel 的完整載入成本，因此先清除版本。
+    """
+    composer.registry_version = ""
+    composer._load_blocks()
+
+
+def benchmark_size(composer_cls, block_count: int, iterations: int = 50,
+                   load_iterations: int = 5, provides_fanout: int = 2,
+                   requires_fanout: int = 2, depth: int = 4, seed: int = 0,
+                   work_dir: str = None) -> Dict[str, Any]:
+    """以指定數量的合成積木量測 BlockComposer 的各項操作"""
+    root = Path(tempfile.mkdtemp(prefix=f"blocks-{block_count}-", dir=work_dir))
+    try:
+        tree = generate_synthetic_tree(root, block_count, provides_fanout, requires_fanout, depth, seed)
+        selections = sample_selections(tree, max(iterations, 1), seed)
+        cache_file = root / ".registry-cache.json"
+
+        uncached = composer_cls(str(root), use_cache=False)
+        composer = composer_cls(str(root), cache_file=str(cache_file))
+        configs = [
+            composer.generate_build_config(f"bench-{index}", "dev", selection)
+            for index, selection in enumerate(selections)
+        ]
+
+        operations = {
+            'load_blocks': measure(lambda i: _full_reload(uncached), load_iterations),
+            'load_blocks_cached': measure(lambda i: _full_reload(composer), load_iterations),
+            'get_available_blocks': measure(lambda i: composer.get_available_blocks(), iterations),
+            'query_blocks': measure(lambda i: composer.query_blocks(**_QUERIES[i % len(_QUERIES)]), iterations),
+            'validate_dependencies': measure(
+                lambda i: composer.validate_dependencies(selections[i % len(selections)]), iterations
+            ),
+            'generate_build_config': measure(
+                lambda i: composer.generate_build_config(
+                    f"bench-{i}", "dev", selections[i % len(selections)]
+                ), iterations
+            ),
+            'generate_packer_command': measure(
+                lambda i: composer.generate_packer_command(configs[i % len(configs)]), iterations
+            )
+        }
+        return {
+            'blocks': len(composer.blocks_registry),
+            'selection_size': round(sum(len(s) for s in selections) / len(selections), 1),
+            'operations': operations
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def _git_commit() -> str:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+            cwd=Path(__file__).resolve().parent, timeout=5
+        )
+        return completed.stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def run_benchmarks(composer_cls, sizes=DEFAULT_SIZES, on_size=None, **options) -> Dict[str, Any]:
+    """依序量測每個規模，回傳可寫成基準檔的結果"""
+    results = {}
+    for size in sizes:
+        results[str(size)] = benchmark_size(composer_cls, size, **options)
+        if on_size:
+            on_size(size, results[str(size)])
+
+    return {
+        'format': BENCHMARK_FORMAT_VERSION,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'yaml_loader': yaml_loader_name(),
+        'options': dict(options, sizes=list(sizes)),
+        'results': results
+    }
+
+
+def write_baseline(report: Dict[str, Any], output_path: str) -> Path:
+    """寫出基準檔"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return output_path
+
+
+def compare_benchmarks(current: Dict[str, Any], baseline: Dict[str, Any],
+                       threshold: float = 0.2, metric: str = 'p50_ms') -> List[Dict[str, Any]]:
+    """比較兩份基準結果，回傳 metric 增幅超過 threshold 的操作"""
+    regressions = []
+    for size, result in current.get('results', {}).items():
+        baseline_ops = baseline.get('results', {}).get(size, {}).get('operations', {})
+        for name, stats in result['operations'].items():
+            previous = baseline_ops.get(name, {}).get(metric)
+            if not previous:
+                continue
+            ratio = stats[metric] / previous
+            if ratio > 1 + threshold:
+                regressions.append({
+                    'size': size,
+                    'operation': name,
+                    'metric': metric,
+                    'baseline': previous,
+                    'current': stats[metric],
+                    'ratio': round(ratio, 3)
+                })
+    return regressions
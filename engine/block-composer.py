@@ -3,62 +3,205 @@
 積木組合器 - 根據用戶選擇的積木生成 Packer 建構配置
 """
 
+import copy
+import hashlib
 import json
-import yaml
 import os
 import sys
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterable, Iterator
+
+from artifact_cache import AmiLayerCache, BuildIndex, FakeAmiStore
+from block_model import BlockModel, normalize_block_definition, os_entries
+from block_sources import (DEFAULT_STORE_DIR, SOURCES_ENV, BlockStore, load_sources_file,
+                           resolve_sources)
+from build_estimator import choose_instance, estimate_builds, load_catalog
+from build_timing import TIMING_HISTORY_ENV, compare_profiles, load_profiles, profile_log, write_timing_profile
+from package_cache import (REMOTE_PACKAGE_DIR, DirectoryFetcher, PackageBundleCache,
+                           package_set_hash, render_prefetch_script)
+from package_plan import (PACKAGES_BLOCK, collect_packages, package_manager_for, plan_invocations,
+                          render_install_script, render_repository_script)
+from packer_template import render_packer_template, write_packer_template
+from preflight import ShellSyntaxChecker, check_block_parameters, check_script_file
+from registry_cache import RegistryCache, parse_block_file, yaml_loader_name
+from script_bundle import build_script_bundle
+
+# 註冊表快取檔名，預設放在積木目錄下
+REGISTRY_CACHE_FILE = ".registry-cache.json"
+
+# 驗證結果快取的預設容量
+VALIDATION_CACHE_SIZE = 1024
+
+# 找不到基礎積木時使用的 OS 資訊，與 builder.pkr.hcl 的預設值一致
+DEFAULT_OS_INFO = {"family": "debian", "version": "", "ssh_username": "ubuntu", "package_manager": "apt"}
+
+# instance_type 參數為此值時依估算結果自動挑選實例類型
+AUTO_INSTANCE_TYPE = "auto"
+
+# 自動挑選實例時根磁碟的最小容量 (GiB)
+MIN_ROOT_VOLUME_SIZE = 8
+
+# 依腳本鍵名決定所屬階段，其餘腳本都屬於主要安裝階段
+SCRIPT_PHASES = {"validate": "validate", "cleanup": "cleanup"}
+
+# 各階段的執行順序，與 builder.pkr.hcl 一致
+PHASE_ORDER = ("main", "custom", "validate", "cleanup")
 
 class BlockComposer:
-    def __init__(self, blocks_path: str = "../blocks"):
+    def __init__(self, blocks_path: str = "../blocks",
+                 cache_file: str = None,
+                 use_cache: bool = True,
+                 validation_cache_size: int = VALIDATION_CACHE_SIZE,
+                 block_roots: List[Dict[str, Any]] = None):
         self.blocks_path = Path(blocks_path)
+        # 積木根目錄依優先順序排列，同一 ID 以最先出現的來源為準（見 block_sources.resolve_sources）
+        self.block_roots = block_roots or [
+            {'name': 'local', 'type': 'local', 'path': str(self.blocks_path), 'categories': None}
+        ]
+        self.shadowed_blocks = []
+        self.skipped_files = set()
+        # 歷史時間剖析（build_timing 的 packer-timing.json），供自動挑選實例類型使用
+        self.timing_history = []
+        self.instance_catalog = load_catalog()
+        self.validation_cache = OrderedDict()
+        self.validation_cache_size = validation_cache_size
+        self.validation_cache_stats = {'hits': 0, 'misses': 0}
         self.blocks_registry = {}
+        self.block_model = BlockModel({})
+        self.feature_index = {}
+        self.registry_version = ""
+        self.load_stats = {}
+        self.registry_cache = None
+        self.syntax_checker = ShellSyntaxChecker()
+        if use_cache:
+            self.registry_cache = RegistryCache(
+                cache_file or self.blocks_path / REGISTRY_CACHE_FILE
+            )
         self._load_blocks()
     
     def _load_blocks(self):
-        """載入所有積木的 metadata"""
-        for category_dir in self.blocks_path.iterdir():
+        """載入所有積木的 metadata（有快取時只重新解析變更過的 block.yaml）"""
+        started = time.perf_counter()
+        registry = {}
+        file_digests = []
+        seen_files = []
+        shadowed = []
+        
+        for root in self.block_roots:
+            for block_yaml, block_info, digest in self._scan_root(Path(root['path']), seen_files):
+                if root['categories'] and block_info.get('category', 'custom') not in root['categories']:
+                    print(f"⚠️ 來源 '{root['name']}' 不可提供 {block_info.get('category', 'custom')} "
+                          f"類別的積木，略過 {block_info.get('id')}", file=sys.stderr)
+                    continue
+                if block_info.get('id') in registry:
+                    shadowed.append({
+                        'id': block_info['id'],
+                        'source': root['name'],
+                        'shadowed_by': registry[block_info['id']]['source']
+                    })
+                    continue
+                
+                # 複製一份，避免修改到快取中的原始內容
+                block_info = dict(block_info)
+                block_info['path'] = str(block_yaml.parent)
+                block_info['source'] = root['name']
+                registry[block_info['id']] = block_info
+                file_digests.append(f"{block_yaml}:{digest}")
+        
+        if self.registry_cache:
+            self.registry_cache.prune(seen_files)
+            self.registry_cache.save()
+        
+        registry_version = hashlib.sha256(
+            "\n".join(file_digests).encode('utf-8')
+        ).hexdigest()
+        self.blocks_registry = registry
+        self.shadowed_blocks = shadowed
+        # 內容沒有變更時保留索引與驗證快取，常駐服務反覆重新載入時不必重新驗證
+        if registry_version != self.registry_version:
+            self.registry_version = registry_version
+            self._build_indexes()
+        self.load_stats = {
+            'blocks': len(registry),
+            'files': len(seen_files),
+            'sources': len(self.block_roots),
+            'shadowed': len(shadowed),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 3),
+            # 全部命中快取時不會載入 yaml，此處不應為了取得名稱而載入
+            'yaml_loader': yaml_loader_name(load=False),
+            'cache': dict(self.registry_cache.stats) if self.registry_cache else None
+        }
+    
+    def _scan_root(self, root: Path, seen_files: List[Path]):
+        """逐一產出根目錄下 <類別>/<積木>/block.yaml 正規化後的積木定義"""
+        for category_dir in sorted(root.iterdir()):
             if not category_dir.is_dir():
                 continue
                 
-            category = category_dir.name
-            for block_dir in category_dir.iterdir():
+            for block_dir in sorted(category_dir.iterdir()):
                 if not block_dir.is_dir():
                     continue
                     
                 block_yaml = block_dir / "block.yaml"
-                if block_yaml.exists():
-                    with open(block_yaml, 'r', encoding='utf-8') as f:
-                        block_config = yaml.safe_load(f)
-                        block_id = block_config['block']['id']
-                        block_config['block']['path'] = str(block_dir)
-                        self.blocks_registry[block_id] = block_config['block']
+                if not block_yaml.exists():
+                    continue
+                
+                seen_files.append(block_yaml)
+                if self.registry_cache:
+                    block_config, digest = self.registry_cache.load(block_yaml)
+                else:
+                    block_config, digest = parse_block_file(block_yaml)
+                
+                # 舊版格式（沒有 block: 區段）在此轉成目前的格式
+                block_info = normalize_block_definition(block_config, block_dir.name, category_dir.name)
+                if block_info is None:
+                    # 重新載入時同一個檔案只警告一次
+                    if block_yaml not in self.skipped_files:
+                        self.skipped_files.add(block_yaml)
+                        print(f"⚠️ 略過無法辨識的積木定義: {block_yaml}", file=sys.stderr)
+                    continue
+                yield block_yaml, block_info, digest
+    
+    def reload(self) -> bool:
+        """重新載入積木註冊表，回傳內容是否有變更"""
+        previous_version = self.registry_version
+        if self.registry_cache:
+            self.registry_cache.stats = dict.fromkeys(self.registry_cache.stats, 0)
+        self._load_blocks()
+        return self.registry_version != previous_version
+    
+    def _build_indexes(self):
+        """建立精簡的積木模型與功能 → 提供者積木的反向索引"""
+        self.block_model = BlockModel(self.blocks_registry)
+        self.feature_index = self.block_model.provider_index()
+        
+        # 註冊表變更後，先前的驗證結果不再可信
+        self.validation_cache.clear()
+    
+    def get_providers(self, feature: str) -> List[str]:
+        """取得提供指定功能的積木 ID 列表"""
+        return list(self.feature_index.get(feature, []))
     
     def get_available_blocks(self) -> Dict[str, List[Dict]]:
-        """取得所有可用的積木，按類別分組"""
-        blocks_by_category = {
-            'base': [],
-            'application': [],
-            'configuration': [],
-            'custom': []
-        }
+        """
+        取得所有可用的積木，按類別分組
         
-        for block_id, block_info in self.blocks_registry.items():
-            category = block_info.get('category', 'custom')
-            if category not in blocks_by_category:
-                blocks_by_category[category] = []
-            blocks_by_category[category].append({
-                'id': block_id,
-                'name': block_info.get('name', block_id),
-                'description': block_info.get('description', ''),
-                'version': block_info.get('version', ''),
-                'provides': block_info.get('provides', []),
-                'requires': block_info.get('requires', []),
-                'parameters': block_info.get('parameters', [])
-            })
+        結果在註冊表版本變更前都是同一份，呼叫端不可修改；需要修改時請先 copy.deepcopy。
+        """
+        return self.block_model.available_blocks()
+    
+    def query_blocks(self, category: Any = None, tags: List[str] = (), os_family: str = None,
+                     os_version: str = None, provides: List[str] = (),
+                     requires: List[str] = ()) -> List[Dict[str, Any]]:
+        """
+        依類別、標籤、OS 支援與功能篩選積木，條件之間取交集（見 BlockModel.query）
         
-        return blocks_by_category
+        例如 query_blocks(os_family='amazon-linux', os_version='2023', provides=['web-server'])。
+        回傳的摘要與 get_available_blocks 共用，呼叫端不可修改。
+        """
+        return self.block_model.query(category, tags, os_family, os_version, provides, requires)
     
     def validate_dependencies(self, selected_blocks: List[str]) -> Dict[str, Any]:
         """驗證積木依賴關係"""
@@ -66,42 +209,355 @@ class BlockComposer:
             'valid': True,
             'errors': [],
             'warnings': [],
-            'execution_order': []
+            'execution_order': [],
+            'execution_layers': []
         }
         
-        # 檢查每個積木的依賴
-        provided_features = set()
-        selected_block_info = []
+        # 功能集合以位元遮罩表示，檢查依賴只需整數運算
+        model = self.block_model
+        provided_mask = 0
+        selected_records = []
         
-        for block_id in selected_blocks:
-            if block_id not in self.blocks_registry:
+        # 去除重複選擇，保留第一次出現的位置
+        for block_id in dict.fromkeys(selected_blocks):
+            record = model.get(block_id)
+            if record is None:
                 result['errors'].append(f"積木 '{block_id}' 不存在")
                 continue
-                
-            block_info = self.blocks_registry[block_id]
-            selected_block_info.append((block_id, block_info))
-            provided_features.update(block_info.get('provides', []))
+            selected_records.append(record)
+            provided_mask |= record.provides_mask
         
-        # 檢查依賴是否滿足
-        for block_id, block_info in selected_block_info:
-            required_features = set(block_info.get('requires', []))
-            missing_features = required_features - provided_features
-            
-            if missing_features:
+        # 檢查依賴是否滿足，只有缺少功能時才把位元轉回功能名稱
+        for block_id, missing_mask in model.missing_mask(selected_records, provided_mask).items():
+            missing_features = model.features.decode(missing_mask)
+            error = f"積木 '{block_id}' 需要以下功能但未提供: {', '.join(missing_features)}"
+            hints = [
+                f"{feature} 可由 {', '.join(self.feature_index[feature])} 提供"
+                for feature in missing_features if feature in self.feature_index
+            ]
+            if hints:
+                error += f"（{'; '.join(hints)}）"
+            result['errors'].append(error)
+        
+        # 依賴圖分層排序，同時偵測循環依賴
+        if not result['errors']:
+            layers, cyclic_blocks = self._resolve_layers([record.id for record in selected_records])
+            if cyclic_blocks:
                 result['errors'].append(
-                    f"積木 '{block_id}' 需要以下功能但未提供: {', '.join(missing_features)}"
+                    f"積木之間存在循環依賴: {', '.join(cyclic_blocks)}"
                 )
+            else:
+                result['execution_layers'] = layers
+                result['execution_order'] = [block_id for layer in layers for block_id in layer]
         
         # 如果有錯誤，標記為無效
         if result['errors']:
             result['valid'] = False
+        
+        return result
+    
+    def validate_dependencies_cached(self, selected_blocks: List[str]) -> Dict[str, Any]:
+        """以 LRU 快取驗證積木組合，相同的積木集合（不論順序）只驗證一次"""
+        key = frozenset(selected_blocks)
+        cached = self.validation_cache.get(key)
+        if cached is not None:
+            self.validation_cache.move_to_end(key)
+            self.validation_cache_stats['hits'] += 1
         else:
-            # 按執行順序排序
-            selected_block_info.sort(key=lambda x: x[1].get('execution_order', 50))
-            result['execution_order'] = [block_id for block_id, _ in selected_block_info]
+            self.validation_cache_stats['misses'] += 1
+            cached = self.validate_dependencies(sorted(key))
+            self.validation_cache[key] = cached
+            if len(self.validation_cache) > self.validation_cache_size:
+                self.validation_cache.popitem(last=False)
+        
+        # 回傳副本，避免呼叫端修改到快取內容
+        return copy.deepcopy(cached)
+    
+    def validate_batch(self, selections: Iterable[Any]) -> Iterator[Dict[str, Any]]:
+        """
+        批次驗證多組積木組合，逐筆產出結果
+        
+        每筆輸入可以是積木 ID 列表，或 {"id": ..., "blocks": [...]} 格式的物件。
+        """
+        for index, selection in enumerate(selections):
+            request_id = index
+            if isinstance(selection, dict):
+                request_id = selection.get('id', index)
+                selection = selection.get('blocks', [])
+            
+            if not isinstance(selection, list):
+                yield {
+                    'id': request_id,
+                    'valid': False,
+                    'errors': ["輸入格式錯誤: 需要積木 ID 列表"]
+                }
+                continue
+            
+            result = self.validate_dependencies_cached(selection)
+            result['id'] = request_id
+            yield result
+    
+    def preflight(self, selected_blocks: List[str], parameters: Dict = None,
+                  custom_scripts: List[Dict] = None) -> Dict[str, Any]:
+        """
+        在啟動實例前靜態檢查建構計畫，一次回報所有錯誤
+        
+        檢查依賴、OS 支援、各 OS 家族的腳本路徑、執行權限與 Shell 語法，
+        以及 parameters['block_parameters'] 是否符合積木的 parameters 宣告。
+        語法檢查結果會快取，反覆檢查相同組合時只需檢查檔案狀態。
+        """
+        started = time.perf_counter()
+        parameters = parameters or {}
+        result = {
+            'valid': True,
+            'errors': [],
+            'warnings': [],
+            'os_info': None,
+            'checked_scripts': 0,
+            'elapsed_ms': 0
+        }
+        
+        validation_result = self.validate_dependencies_cached(selected_blocks)
+        result['errors'].extend(validation_result['errors'])
+        known_blocks = [b for b in dict.fromkeys(selected_blocks) if b in self.blocks_registry]
+        execution_order = validation_result['execution_order'] or sorted(
+            known_blocks, key=lambda b: self.block_model.records[b].sort_key
+        )
+        os_info = self._detect_os_info(execution_order)
+        os_family, os_version = os_info['family'], os_info['version']
+        result['os_info'] = os_info
         
+        if not self.syntax_checker.available:
+            result['warnings'].append("找不到 bash，略過腳本語法檢查")
+        
+        for block_id in execution_order:
+            block_info = self.blocks_registry[block_id]
+            # 支援的 OS 取自 os_support，基礎積木取自 os_info；兩者都沒有的積木與 OS 無關
+            entries = os_entries(block_info)
+            versions = [
+                version for family, listed in entries if family == os_family for version in listed or (None,)
+            ]
+            if entries and not versions:
+                supported = ", ".join(dict.fromkeys(family for family, _ in entries))
+                result['errors'].append(f"積木 '{block_id}' 不支援 OS 家族 '{os_family}'（支援: {supported}）")
+                continue
+            if os_version and versions and None not in versions and str(os_version) not in versions:
+                result['warnings'].append(f"積木 '{block_id}' 未列出 {os_family} {os_version} 的支援")
+            packages = block_info.get('packages') or {}
+            if packages and os_family not in packages:
+                result['warnings'].append(
+                    f"積木 '{block_id}' 沒有宣告 '{os_family}' 的套件（只宣告了 {', '.join(packages)}），"
+                    f"不會安裝任何套件"
+                )
+            
+            for step_name, script in self.get_block_scripts(block_id, os_family).items():
+                script_path = str((Path(block_info['path']) / script).resolve())
+                errors, warnings = check_script_file(script_path, self.syntax_checker)
+                result['checked_scripts'] += 1
+                result['errors'].extend(f"積木 '{block_id}' 步驟 '{step_name}': {e}" for e in errors)
+                result['warnings'].extend(f"積木 '{block_id}' 步驟 '{step_name}': {w}" for w in warnings)
+        
+        block_parameters = parameters.get('block_parameters', {})
+        for block_id, values in block_parameters.items():
+            if block_id not in self.blocks_registry:
+                result['errors'].append(f"參數指定的積木 '{block_id}' 不存在")
+                continue
+            if block_id not in known_blocks:
+                result['errors'].append(f"參數指定的積木 '{block_id}' 未被選擇")
+            errors, warnings = check_block_parameters(
+                block_id, self.blocks_registry[block_id].get('parameters', []), values
+            )
+            result['errors'].extend(errors)
+            result['warnings'].extend(warnings)
+        
+        for script in custom_scripts or []:
+            name = script.get('name', 'custom')
+            content = script.get('content') or ''
+            if not content.strip():
+                result['errors'].append(f"自定義腳本 '{name}' 沒有內容")
+                continue
+            if self.syntax_checker.available:
+                problem = self.syntax_checker.check_source(content)
+                result['checked_scripts'] += 1
+                if problem:
+                    result['errors'].append(f"自定義腳本 '{name}' 語法錯誤: {problem}")
+        
+        result['valid'] = not result['errors']
+        result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
         return result
     
+    def resolve_execution_layers(self, selected_blocks: List[str]) -> List[List[str]]:
+        """回傳可平行執行的積木分層，同一層的積木彼此獨立"""
+        validation_result = self.validate_dependencies(selected_blocks)
+        if not validation_result['valid']:
+            raise ValueError(f"依賴驗證失敗: {validation_result['errors']}")
+        return validation_result['execution_layers']
+    
+    def resolve_features(self, features: List[str], base_block: str) -> Dict[str, Any]:
+        """
+        根據需要的功能，在指定的基礎積木上自動挑選最少的積木組合
+        
+        先以貪婪法挑選能覆蓋最多未滿足功能的積木（遞迴補齊其 requires），
+        再移除多餘的積木，最後交由 validate_dependencies 產生執行順序。
+        """
+        result = {
+            'valid': True,
+            'errors': [],
+            'warnings': [],
+            'selected_blocks': [],
+            'execution_order': [],
+            'execution_layers': []
+        }
+        
+        if base_block not in self.blocks_registry:
+            result['valid'] = False
+            result['errors'].append(f"積木 '{base_block}' 不存在")
+            return result
+        
+        os_info = self.blocks_registry[base_block].get('os_info', {})
+        os_family = os_info.get('family')
+        os_version = str(os_info.get('version', ''))
+        
+        selected = [base_block]
+        provided = set(self.blocks_registry[base_block].get('provides', []))
+        requested = set(features)
+        unsatisfied = requested - provided
+        
+        while unsatisfied:
+            candidates = set()
+            for feature in sorted(unsatisfied):
+                providers = [
+                    block_id for block_id in self.feature_index.get(feature, [])
+                    if block_id not in selected
+                    and self.blocks_registry[block_id].get('category') != 'base'
+                    and self._supports_os(block_id, os_family, os_version)
+                ]
+                if providers:
+                    candidates.update(providers)
+                else:
+                    result['errors'].append(
+                        f"功能 '{feature}' 沒有支援 {os_family} {os_version} 的積木可提供"
+                    )
+                    unsatisfied.discard(feature)
+            
+            if not candidates:
+                break
+            
+            def score(block_id):
+                block_info = self.blocks_registry[block_id]
+                covered = len(unsatisfied & set(block_info.get('provides', [])))
+                new_requires = len(set(block_info.get('requires', [])) - provided)
+                return (-covered, new_requires, block_info.get('execution_order', 50), block_id)
+            
+            chosen = min(candidates, key=score)
+            selected.append(chosen)
+            provided.update(self.blocks_registry[chosen].get('provides', []))
+            unsatisfied.update(self.blocks_registry[chosen].get('requires', []))
+            unsatisfied -= provided
+        
+        # 移除拿掉後仍能滿足所有需求的積木，確保組合最小
+        for block_id in reversed(selected[1:]):
+            remaining = [b for b in selected if b != block_id]
+            remaining_provided = set()
+            needed = set(requested)
+            for other_id in remaining:
+                remaining_provided.update(self.blocks_registry[other_id].get('provides', []))
+                needed.update(self.blocks_registry[other_id].get('requires', []))
+            if needed <= remaining_provided:
+                selected = remaining
+        
+        result['selected_blocks'] = selected
+        if result['errors']:
+            result['valid'] = False
+            return result
+        
+        validation_result = self.validate_dependencies(selected)
+        result['valid'] = validation_result['valid']
+        result['errors'] = validation_result['errors']
+        result['execution_order'] = validation_result['execution_order']
+        result['execution_layers'] = validation_result['execution_layers']
+        return result
+    
+    def _supports_os(self, block_id: str, os_family: str, os_version: str = None) -> bool:
+        """檢查積木是否支援指定的 OS；未宣告 os_support 的積木視為與 OS 無關"""
+        os_support = self.blocks_registry[block_id].get('os_support')
+        if not os_support or not os_family:
+            return True
+        
+        for entry in os_support:
+            if entry.get('os_family') != os_family:
+                continue
+            versions = [str(v) for v in entry.get('os_versions', [])]
+            if not os_version or not versions or os_version in versions:
+                return True
+        return False
+    
+    def _upstream_blocks(self, block_ids: List[str]) -> Dict[str, set]:
+        """
+        回傳每個積木在組合內直接依賴的積木 {積木: {上游積木}}
+        
+        上游包含提供其 requires 功能的積木，以及 after 列出的積木（舊版 dependencies）。
+        after 列出的基礎積木不在組合內時，改為排在組合內的基礎積木之後（舊版積木常寫
+        base-ubuntu-2004 代表任一基礎積木）。
+        """
+        records = self.block_model.records
+        selected = set(block_ids)
+        providers = {}
+        base_blocks = []
+        for block_id in block_ids:
+            for feature in records[block_id].provides:
+                providers.setdefault(feature, []).append(block_id)
+            if records[block_id].category == 'base':
+                base_blocks.append(block_id)
+        
+        upstream_blocks = {}
+        for block_id in block_ids:
+            upstream = set()
+            for feature in records[block_id].requires:
+                upstream.update(providers.get(feature, ()))
+            for dependency_id in records[block_id].after:
+                if dependency_id in selected:
+                    upstream.add(dependency_id)
+                elif dependency_id in records and records[dependency_id].category == 'base':
+                    upstream.update(base_blocks)
+            upstream.discard(block_id)
+            upstream_blocks[block_id] = upstream
+        return upstream_blocks
+    
+    def _resolve_layers(self, block_ids: List[str]):
+        """
+        以 provides/requires 與 after 建立 上游 → 下游 依賴圖，並以 Kahn 演算法分層排序
+        
+        時間複雜度為 O(V + E)（不含同層排序），execution_order 只作為同層內的排序依據。
+        回傳 (分層結果, 處於循環中的積木)
+        """
+        dependents = {block_id: [] for block_id in block_ids}
+        indegree = {}
+        for block_id, upstream in self._upstream_blocks(block_ids).items():
+            indegree[block_id] = len(upstream)
+            for provider_id in upstream:
+                dependents[provider_id].append(block_id)
+        
+        records = self.block_model.records
+        
+        def sort_key(block_id):
+            return records[block_id].sort_key
+        
+        layers = []
+        current = sorted((b for b, degree in indegree.items() if degree == 0), key=sort_key)
+        while current:
+            layers.append(current)
+            ready = []
+            for block_id in current:
+                for consumer_id in dependents[block_id]:
+                    indegree[consumer_id] -= 1
+                    if indegree[consumer_id] == 0:
+                        ready.append(consumer_id)
+            current = sorted(ready, key=sort_key)
+        
+        cyclic_blocks = sorted(b for b, degree in indegree.items() if degree > 0)
+        return layers, cyclic_blocks
+    
     def generate_build_config(self, 
                             build_name: str,
                             environment: str,
@@ -115,41 +571,427 @@ class BlockComposer:
         if not validation_result['valid']:
             raise ValueError(f"依賴驗證失敗: {validation_result['errors']}")
         
+        os_info = self._detect_os_info(validation_result['execution_order'])
+        instance_choice = None
+        if (parameters or {}).get('instance_type') == AUTO_INSTANCE_TYPE:
+            target_minutes = parameters.get('target_minutes')
+            instance_choice = self.estimate_build(
+                validation_result['execution_order'], os_info['family'],
+                target_seconds=target_minutes * 60 if target_minutes else None
+            )['choice']
+        block_hashes = {
+            block_id: self.block_content_hash(block_id)
+            for block_id in validation_result['execution_order']
+        }
+        
         # 生成配置
         build_config = {
             "build_info": {
                 "name": build_name,
                 "environment": environment,
                 "created_at": "{{timestamp}}",
-                "build_type": "dynamic"
+                "build_type": "dynamic",
+                "block_hashes": block_hashes
             },
             "blocks": {
                 "enabled": validation_result['execution_order'],
-                "execution_order": validation_result['execution_order']
+                "execution_order": validation_result['execution_order'],
+                "execution_layers": validation_result['execution_layers']
             },
+            "os_info": os_info,
             "parameters": parameters or {},
             "custom_scripts": custom_scripts or [],
             "packer_vars": self._generate_packer_vars(
-                environment, selected_blocks, parameters or {}
+                environment, selected_blocks, parameters or {},
+                build_name=build_name, os_info=os_info, instance_choice=instance_choice
             )
         }
+        if instance_choice:
+            build_config['build_info']['estimate'] = instance_choice
+        
+        fingerprint = self.compute_build_fingerprint(build_config)
+        build_config['build_info']['fingerprint'] = fingerprint
+        build_config['packer_vars']['build_fingerprint'] = fingerprint
         
         return build_config
     
+    def compute_build_fingerprint(self, build_config: Dict[str, Any]) -> str:
+        """
+        計算建構指紋: 相同的積木集合、版本、腳本內容、基底 AMI、區域與參數必定得到相同指紋
+        
+        建構名稱與 {{timestamp}} 不影響產物內容，因此不納入計算。
+        """
+        packer_vars = build_config['packer_vars']
+        block_hashes = build_config['build_info']['block_hashes']
+        canonical = {
+            'blocks': sorted(block_hashes),
+            'versions': {
+                block_id: str(self.blocks_registry[block_id].get('version', ''))
+                for block_id in block_hashes
+            },
+            'contents': block_hashes,
+            'environment': build_config['build_info']['environment'],
+            'base_ami_id': packer_vars['base_ami_id'],
+            'region': packer_vars['region'],
+            'parameters': build_config['parameters'],
+            'custom_scripts': build_config['custom_scripts']
+        }
+        return hashlib.sha256(
+            json.dumps(canonical, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest()
+    
+    def find_existing_build(self, build_config: Dict[str, Any], build_index) -> Dict[str, Any]:
+        """在建構索引中尋找指紋相同的既有產物，找不到時回傳 None"""
+        return build_index.find(build_config['build_info']['fingerprint'])
+    
+    def _detect_os_info(self, execution_order: List[str]) -> Dict[str, Any]:
+        """從基礎積木的 os_info 取得 OS 家族、版本、SSH 使用者與套件管理工具"""
+        for block_id in execution_order:
+            os_info = self.blocks_registry[block_id].get('os_info')
+            if os_info:
+                return {
+                    "family": os_info.get('family', DEFAULT_OS_INFO['family']),
+                    "version": str(os_info.get('version', '')),
+                    "ssh_username": os_info.get('ssh_username', DEFAULT_OS_INFO['ssh_username']),
+                    "package_manager": package_manager_for(os_info)
+                }
+        return dict(DEFAULT_OS_INFO)
+    
     def _generate_packer_vars(self, environment: str, selected_blocks: List[str], 
-                             parameters: Dict) -> Dict[str, Any]:
-        """生成 Packer 變數"""
-        return {
+                             parameters: Dict, build_name: str = "",
+                             os_info: Dict[str, Any] = None,
+                             instance_choice: Dict[str, Any] = None) -> Dict[str, Any]:
+        """生成 Packer 變數，instance_choice 為 estimate_build() 挑選的實例與根磁碟設定"""
+        os_info = os_info or DEFAULT_OS_INFO
+        packer_vars = {
             "env": environment,
             "enabled_blocks": selected_blocks,
             "custom_scripts": parameters.get("custom_scripts", []),
             "region": parameters.get("region", "ap-northeast-1"),
             "instance_type": parameters.get("instance_type", "t3.micro"),
             "base_ami_id": parameters.get("base_ami_id", ""),
-            "owner": parameters.get("owner", "infra-team")
+            "owner": parameters.get("owner", "infra-team"),
+            "build_name": build_name,
+            "os_family": os_info['family'],
+            "ssh_username": parameters.get("ssh_username", os_info['ssh_username'])
         }
+        if instance_choice:
+            packer_vars["instance_type"] = instance_choice['instance_type']
+            packer_vars["root_volume_size"] = max(instance_choice['root_volume_size'] or 0, MIN_ROOT_VOLUME_SIZE)
+            packer_vars["root_volume_throughput"] = instance_choice['volume_throughput']
+        return packer_vars
+    
+    def estimate_build(self, execution_order: List[str], os_family: str,
+                       target_seconds: float = None) -> Dict[str, Any]:
+        """
+        估算各實例類型的建構時間與費用，並挑選在目標時間內最便宜的組合
+        
+        使用積木的 resources 宣告（min_memory、min_disk、cpu_weight、io_weight、estimated_seconds）
+        與 timing_history 中的歷史剖析。
+        """
+        blocks = []
+        for block_id in execution_order:
+            try:
+                steps = len(self.get_block_scripts(block_id, os_family))
+            except ValueError:
+                steps = 1
+            blocks.append({
+                'id': block_id,
+                'steps': steps,
+                'resources': self.blocks_registry[block_id].get('resources') or {}
+            })
+        estimates = estimate_builds(blocks, self.timing_history, self.instance_catalog)
+        return {
+            'estimates': estimates,
+            'choice': choose_instance(estimates, target_seconds),
+            'target_seconds': target_seconds,
+            'history_samples': len(self.timing_history)
+        }
+    
+    def get_block_scripts(self, block_id: str, os_family: str) -> Dict[str, str]:
+        """取得積木在指定 OS 家族下的腳本（鍵名 → 相對路徑）"""
+        block_info = self.blocks_registry[block_id]
+        os_support = block_info.get('os_support')
+        if not os_support:
+            return dict(block_info.get('scripts', {}))
+        
+        for entry in os_support:
+            if entry.get('os_family') == os_family:
+                return dict(entry.get('scripts', {}))
+        raise ValueError(f"積木 '{block_id}' 不支援 OS 家族 '{os_family}'")
+    
+    def plan_packages(self, build_config: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        合併已選積木在 block.yaml 宣告的套件，回傳倉庫設定與安裝交易的計畫
+        
+        已由中間層 AMI 提供的積木不會再安裝套件。基礎積木的系統更新步驟已更新過套件索引，
+        因此只有新增倉庫或基礎積木不在本次執行範圍時才會再更新一次。
+        parameters 中 aggregate_packages 為 false 時停用合併，回傳 None。
+        """
+        if not build_config['parameters'].get('aggregate_packages', True):
+            return None
+        
+        os_info = build_config['os_info']
+        os_family = os_info['family']
+        manager = os_info.get('package_manager') or package_manager_for(os_info)
+        cached_prefix = set(build_config['blocks'].get('cached_prefix', []))
+        blocks = [
+            {'id': block_id,
+             'packages': self.blocks_registry[block_id].get('packages', {}).get(os_family)}
+            for block_id in build_config['blocks']['execution_order']
+            if block_id not in cached_prefix
+        ]
+        plan = collect_packages(blocks, os_family)
+        if not plan['install'] and not plan['repositories']:
+            return None
+        
+        base_in_plan = any(
+            self.blocks_registry[block['id']].get('category') == 'base' for block in blocks
+        )
+        refresh = manager == 'apt' and (bool(plan['repositories']) or not base_in_plan)
+        scripts = []
+        for block_id in plan['blocks']:
+            block_path = Path(self.blocks_registry[block_id]['path'])
+            for step_name, script in self.get_block_scripts(block_id, os_family).items():
+                if SCRIPT_PHASES.get(step_name, 'main') == 'main':
+                    scripts.append(str(block_path / script))
+        
+        plan['package_manager'] = manager
+        plan['refresh'] = refresh
+        plan['invocations'] = plan_invocations(plan, manager, refresh, scripts)
+        plan['set_hash'] = package_set_hash(plan, os_info)
+        return plan
+    
+    def stage_package_bundle(self, build_config: Dict[str, Any], package_cache,
+                             fetcher) -> Dict[str, Any]:
+        """
+        依套件集合雜湊取得或建立離線套件包，並記錄於 build_config['package_bundle']
+        
+        之後產生的執行計畫會先上傳並解開套件包，再執行合併的安裝交易。
+        沒有宣告套件時回傳 None。
+        """
+        package_plan = self.plan_packages(build_config)
+        if not package_plan:
+            return None
+        record = package_cache.stage(package_plan['set_hash'], package_plan, fetcher)
+        build_config['package_bundle'] = {
+            'name': record['name'],
+            'path': record['path'],
+            'sha256': record['sha256'],
+            'set_hash': package_plan['set_hash']
+        }
+        return record
+    
+    def build_plan_steps(self, build_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        依執行順序展開每個積木的腳本步驟，並代入對應 OS 的腳本路徑
+        
+        回傳的步驟已依階段排序: 主要安裝 → 自定義腳本 → 驗證 → 清理。
+        積木宣告的套件會合併為倉庫設定與安裝兩個步驟，接在基礎積木之後、其他積木之前。
+        """
+        os_family = build_config['os_info']['family']
+        # 已由中間層 AMI 提供的積木不需再執行主要安裝步驟
+        cached_prefix = set(build_config['blocks'].get('cached_prefix', []))
+        steps_by_phase = {phase: [] for phase in PHASE_ORDER}
+        package_plan = self.plan_packages(build_config)
+        for block_id in build_config['blocks']['execution_order']:
+            block_info = self.blocks_registry[block_id]
+            if package_plan and block_info.get('category') != 'base':
+                steps_by_phase['main'].extend(self._package_steps(package_plan, build_config))
+                package_plan = None
+            for step_name, script in self.get_block_scripts(block_id, os_family).items():
+                phase = SCRIPT_PHASES.get(step_name, 'main')
+                if phase == 'main' and block_id in cached_prefix:
+                    continue
+                steps_by_phase[phase].append({
+                    'block': block_id,
+                    'step': step_name,
+                    'phase': phase,
+                    'script': str((Path(block_info['path']) / script).resolve()),
+                    'expect_disconnect': phase == 'main' and bool(block_info.get('expect_disconnect', False))
+                })
+        
+        if package_plan:
+            steps_by_phase['main'].extend(self._package_steps(package_plan, build_config))
+        
+        custom_scripts = sorted(build_config.get('custom_scripts', []),
+                                key=lambda script: script.get('order', 50))
+        for script in custom_scripts:
+            steps_by_phase['custom'].append({
+                'block': 'custom',
+                'step': script.get('name', 'custom'),
+                'phase': 'custom',
+                'inline': script['content'],
+                'expect_disconnect': False
+            })
+        
+        return [step for phase in PHASE_ORDER for step in steps_by_phase[phase]]
+    
+    def _package_steps(self, package_plan: Dict[str, Any],
+                       build_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """產生合併後的倉庫設定與套件安裝步驟，有對應的離線套件包時先解開套件包"""
+        manager = package_plan['package_manager']
+        bundle = build_config.get('package_bundle')
+        if bundle and bundle['set_hash'] != package_plan['set_hash']:
+            bundle = None
+        steps = []
+        if bundle:
+            steps.append({
+                'block': PACKAGES_BLOCK,
+                'step': 'prefetch',
+                'phase': 'main',
+                'inline': render_prefetch_script(bundle, manager),
+                'package_bundle': bundle['path'],
+                'expect_disconnect': False
+            })
+        if package_plan['repositories'] or package_plan['refresh']:
+            steps.append({
+                'block': PACKAGES_BLOCK,
+                'step': 'repositories',
+                'phase': 'main',
+                'inline': render_repository_script(package_plan, manager, package_plan['refresh']),
+                'expect_disconnect': False
+            })
+        if package_plan['install']:
+            steps.append({
+                'block': PACKAGES_BLOCK,
+                'step': 'install',
+                'phase': 'main',
+                'inline': render_install_script(package_plan, manager,
+                                                REMOTE_PACKAGE_DIR if bundle else None),
+                'expect_disconnect': False
+            })
+        return steps
+    
+    def block_content_hash(self, block_id: str) -> str:
+        """計算積木目錄內容（block.yaml 與所有腳本）的雜湊"""
+        block_dir = Path(self.blocks_registry[block_id]['path'])
+        digest = hashlib.sha256()
+        for file_path in sorted(p for p in block_dir.rglob('*') if p.is_file()):
+            digest.update(str(file_path.relative_to(block_dir)).encode('utf-8'))
+            digest.update(b"\0")
+            digest.update(file_path.read_bytes())
+            digest.update(b"\0")
+        return digest.hexdigest()
+    
+    def compute_prefix_hashes(self, build_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        為執行順序的每個前綴計算鏈式內容雜湊
+        
+        雜湊涵蓋基底 AMI、區域、OS 家族，以及前綴中每個積木的 block.yaml、腳本內容與參數，
+        因此任何一項變更都會讓該前綴之後的所有中間層失效。
+        """
+        packer_vars = build_config['packer_vars']
+        block_parameters = build_config['parameters'].get('block_parameters', {})
+        chained = hashlib.sha256(json.dumps({
+            'base_ami_id': packer_vars['base_ami_id'],
+            'region': packer_vars['region'],
+            'os_family': build_config['os_info']['family']
+        }, sort_keys=True).encode('utf-8')).hexdigest()
+        
+        prefixes = []
+        execution_order = build_config['blocks']['execution_order']
+        for depth, block_id in enumerate(execution_order, 1):
+            chained = hashlib.sha256(json.dumps({
+                'previous': chained,
+                'block': block_id,
+                'content': self.block_content_hash(block_id),
+                'parameters': block_parameters.get(block_id, {})
+            }, sort_keys=True).encode('utf-8')).hexdigest()
+            prefixes.append({'blocks': execution_order[:depth], 'hash': chained})
+        return prefixes
+    
+    def plan_layered_build(self, build_config: Dict[str, Any], layer_cache,
+                           ami_store=None) -> Dict[str, Any]:
+        """查詢中間層 AMI 快取，找出可直接起跑的最長前綴"""
+        prefixes = self.compute_prefix_hashes(build_config)
+        depth, record = layer_cache.find_longest_prefix(
+            [prefix['hash'] for prefix in prefixes], ami_store
+        )
+        execution_order = build_config['blocks']['execution_order']
+        return {
+            'prefixes': prefixes,
+            'cache_hit_depth': depth,
+            'cached_prefix': execution_order[:depth],
+            'remaining_blocks': execution_order[depth:],
+            'start_ami': record['ami_id'] if record else build_config['packer_vars']['base_ami_id']
+        }
+    
+    def apply_layer_plan(self, build_config: Dict[str, Any], layer_plan: Dict[str, Any]) -> Dict[str, Any]:
+        """回傳以快取中間層 AMI 為起點的建構配置副本"""
+        layered_config = copy.deepcopy(build_config)
+        layered_config['blocks']['cached_prefix'] = list(layer_plan['cached_prefix'])
+        layered_config['packer_vars']['base_ami_id'] = layer_plan['start_ami']
+        return layered_config
+    
+    def register_prefix_layers(self, build_config: Dict[str, Any], layer_plan: Dict[str, Any],
+                               layer_cache, build_layer) -> List[Dict[str, Any]]:
+        """
+        依序為尚未快取的前綴建立並登記中間層 AMI
+        
+        build_layer(source_ami, block_id, prefix) 需回傳在 source_ami 上執行該積木後產生的 AMI ID。
+        """
+        region = build_config['packer_vars']['region']
+        source_ami = layer_plan['start_ami']
+        registered = []
+        for prefix in layer_plan['prefixes'][layer_plan['cache_hit_depth']:]:
+            block_id = prefix['blocks'][-1]
+            source_ami = build_layer(source_ami, block_id, prefix)
+            layer_cache.register(prefix['hash'], source_ami, prefix['blocks'], region)
+            registered.append({'blocks': prefix['blocks'], 'hash': prefix['hash'], 'ami_id': source_ami})
+        return registered
+    
+    def plan_step_dependencies(self, build_config: Dict[str, Any],
+                               plan_steps: List[Dict[str, Any]]) -> Dict[str, List[str]]:
+        """
+        回傳主要安裝階段每個積木必須等待的積木 {積木: [上游積木]}
+        
+        依 provides/requires 與 after 決定上游；合併的套件步驟等待排在它之前的基礎積木，
+        其後的積木都等待套件步驟。已由中間層 AMI 提供的積木沒有主要步驟，不列入。
+        """
+        main_blocks = []
+        for step in plan_steps:
+            if step['phase'] == 'main' and step['block'] not in main_blocks:
+                main_blocks.append(step['block'])
+        upstream = self._upstream_blocks(build_config['blocks']['execution_order'])
+        
+        dependencies = {}
+        for position, block_id in enumerate(main_blocks):
+            if block_id == PACKAGES_BLOCK:
+                waits_for = set(main_blocks[:position])
+            else:
+                waits_for = set(upstream.get(block_id, ()))
+                if PACKAGES_BLOCK in main_blocks[:position]:
+                    waits_for.add(PACKAGES_BLOCK)
+            dependencies[block_id] = sorted(waits_for & set(main_blocks))
+        return dependencies
+    
+    def generate_script_bundle(self, build_config: Dict[str, Any], output_dir: str,
+                               workers: int = 1) -> Dict[str, Any]:
+        """
+        將建構所需的全部腳本打包成單一內容定址的壓縮檔，附帶執行器 run.sh
+        
+        workers 大於 1 時，執行器依 provides/requires 同時執行彼此獨立的積木。
+        """
+        plan_steps = self.build_plan_steps(build_config)
+        dependencies = self.plan_step_dependencies(build_config, plan_steps) if workers > 1 else None
+        return build_script_bundle(plan_steps, output_dir, dependencies=dependencies, workers=workers)
     
-    def generate_packer_command(self, build_config: Dict[str, Any]) -> str:
+    def generate_packer_template(self, build_config: Dict[str, Any],
+                                 output_path: str = None,
+                                 bundle: Dict[str, Any] = None) -> Dict[str, Any]:
+        """
+        生成只包含已選積木的 Packer 模板，可選擇同時寫出 .pkr.json 檔案
+        
+        傳入 generate_script_bundle() 的結果時，模板只會上傳並執行該腳本包一次。
+        """
+        template = render_packer_template(build_config, self.build_plan_steps(build_config), bundle)
+        if output_path:
+            write_packer_template(template, output_path)
+        return template
+    
+    def generate_packer_command(self, build_config: Dict[str, Any],
+                                template_path: str = "builder.pkr.hcl") -> str:
         """生成 Packer 執行命令"""
         packer_vars = build_config['packer_vars']
         
@@ -163,12 +1005,29 @@ class BlockComposer:
                 value_str = str(value)
             cmd_parts.append(f'-var="{key}={value_str}"')
         
-        cmd_parts.append("builder.pkr.hcl")
+        cmd_parts.append(str(template_path))
         
         return " ".join(cmd_parts)
 
 def main():
-    composer = BlockComposer()
+    # 設定 BLOCK_SOURCES 時彙整多個積木來源，遠端來源使用設定檔旁的本地儲存區
+    block_roots = None
+    sources_file = os.environ.get(SOURCES_ENV)
+    if sources_file:
+        block_store = BlockStore(Path(sources_file).resolve().parent / DEFAULT_STORE_DIR)
+        try:
+            block_roots = resolve_sources(
+                load_sources_file(sources_file), block_store,
+                refresh=sys.argv[1:3] == ["sources", "sync"]
+            )
+        except (ValueError, RuntimeError, OSError) as e:
+            print(f"❌ 積木來源解析失敗（{SOURCES_ENV}={sources_file}）: {e}", file=sys.stderr)
+            sys.exit(1)
+    composer = BlockComposer(block_roots=block_roots)
+    # 設定 BLOCK_TIMING_HISTORY 時，instance_type 為 auto 的建構配置依這些歷史剖析挑選實例
+    timing_history = os.environ.get(TIMING_HISTORY_ENV)
+    if timing_history:
+        composer.timing_history = load_profiles(path for path in timing_history.split(os.pathsep) if path)
     
     if len(sys.argv) < 2:
         # 顯示可用積木
@@ -219,5 +1078,838 @@ def main():
         except ValueError as e:
             print(f"❌ 配置生成失敗: {e}")
 
+    elif command == "validate":
+        # 驗證積木組合: 可傳入積木 ID 或 JSON 檔案
+        if len(sys.argv) == 3 and sys.argv[2].endswith('.json'):
+            with open(sys.argv[2], 'r', encoding='utf-8') as f:
+                selected_blocks = json.load(f)
+        else:
+            selected_blocks = sys.argv[2:]
+
+        result = composer.validate_dependencies(selected_blocks)
+        if result['valid']:
+            print("✅ 依賴檢查通過")
+            for index, layer in enumerate(result['execution_layers'], 1):
+                print(f"  第 {index} 層: {', '.join(layer)}")
+        else:
+            print("❌ 依賴檢查失敗")
+            for error in result['errors']:
+                print(f"  • {error}")
+            sys.exit(1)
+
+    elif command == "sources":
+        # 顯示積木來源與被覆蓋的積木: sources [sync]（sync 會重新取得遠端來源並清除未引用的鏡像）
+        if len(sys.argv) > 2 and sys.argv[2] != "sync":
+            print("用法: block-composer.py sources [sync]")
+            sys.exit(1)
+
+        counts = {}
+        for block_info in composer.blocks_registry.values():
+            counts[block_info['source']] = counts.get(block_info['source'], 0) + 1
+        print(f"📚 積木來源（依優先順序，{SOURCES_ENV}={sources_file or '未設定'}）:")
+        for index, root in enumerate(composer.block_roots, 1):
+            categories = f" [{', '.join(root['categories'])}]" if root['categories'] else ""
+            print(f"  {index}. {root['name']} ({root['type']}){categories}: "
+                  f"{counts.get(root['name'], 0)} 個積木 - {root['path']}")
+        for shadowed in composer.shadowed_blocks:
+            print(f"  ⚠️ {shadowed['source']} 的 {shadowed['id']} 被 {shadowed['shadowed_by']} 覆蓋")
+        if sources_file:
+            print(f"🗄️ 本地儲存區: 命中 {block_store.stats['hits']}, 取得 {block_store.stats['fetched']}")
+            if len(sys.argv) > 2:
+                for digest in block_store.prune():
+                    print(f"  🗑️ 清除未引用的鏡像 {digest}")
+
+    elif command == "preflight":
+        # 建構前靜態檢查: preflight [--params <parameters.json>] [--custom-scripts <scripts.json>] <積木>...
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py preflight")
+        parser.add_argument("--params", help="建構參數 JSON 檔案（積木參數放在 block_parameters）")
+        parser.add_argument("--custom-scripts", help="自定義腳本 JSON 檔案")
+        parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        parameters = {}
+        custom_scripts = []
+        if args.params:
+            with open(args.params, 'r', encoding='utf-8') as f:
+                parameters = json.load(f)
+        if args.custom_scripts:
+            with open(args.custom_scripts, 'r', encoding='utf-8') as f:
+                custom_scripts = json.load(f)
+
+        result = composer.preflight(args.blocks, parameters, custom_scripts)
+        if args.json:
+            print(json.dumps(result, indent=2, ensure_ascii=False))
+        else:
+            for warning in result['warnings']:
+                print(f"  ⚠️ {warning}")
+            if result['valid']:
+                print(f"✅ 建構前檢查通過（{result['checked_scripts']} 個腳本, {result['elapsed_ms']} ms）")
+            else:
+                print(f"❌ 建構前檢查發現 {len(result['errors'])} 個錯誤")
+                for error in result['errors']:
+                    print(f"  • {error}")
+        if not result['valid']:
+            sys.exit(1)
+
+    elif command == "template":
+        # 生成建構專用的 Packer 模板:
+        # template <輸出檔案.pkr.json> [--bundle <目錄>] [--workers <數量>] [--package-mirror <目錄>]
+        #          [--package-cache <目錄>] <積木>...
+        args = sys.argv[2:]
+        options = {"--bundle": None, "--workers": "1", "--package-mirror": None, "--package-cache": ".package-cache"}
+        for option in options:
+            if option in args:
+                position = args.index(option)
+                options[option] = args[position + 1] if position + 1 < len(args) else None
+                del args[position:position + 2]
+        bundle_dir = options["--bundle"]
+        if (len(args) < 2 or any(option in sys.argv and not options[option] for option in options)
+                or not (options["--workers"] or "").isdigit() or int(options["--workers"]) < 1):
+            print("用法: block-composer.py template <output.pkr.json> [--bundle <dir>] [--workers <n>] "
+                  "[--package-mirror <dir>] [--package-cache <dir>] <block> [block...]")
+            sys.exit(1)
+
+        output_path = args[0]
+        bundle = None
+        try:
+            config = composer.generate_build_config(
+                build_name="dynamic",
+                environment="dev",
+                selected_blocks=args[1:]
+            )
+            package_bundle = None
+            if options["--package-mirror"]:
+                package_bundle = composer.stage_package_bundle(
+                    config,
+                    PackageBundleCache(options["--package-cache"]),
+                    DirectoryFetcher(options["--package-mirror"])
+                )
+            if bundle_dir:
+                bundle = composer.generate_script_bundle(config, bundle_dir, workers=int(options["--workers"]))
+            composer.generate_packer_template(config, output_path, bundle=bundle)
+        except ValueError as e:
+            print(f"❌ 模板生成失敗: {e}")
+            sys.exit(1)
+
+        package_plan = composer.plan_packages(config)
+        if package_plan:
+            invocations = package_plan['invocations']
+            print(
+                f"📦 合併安裝 {len(package_plan['install'])} 個套件、{len(package_plan['repositories'])} 個倉庫，"
+                f"減少 {invocations['removed']} 次 {package_plan['package_manager']} 呼叫"
+                f"（{invocations['before']} → {invocations['after']}）"
+            )
+        if package_bundle:
+            state = "重用既有" if package_bundle['reused'] else "新建"
+            print(f"📦 離線套件包（{state}）: {package_bundle['path']} - {package_bundle['files']} 個檔案")
+            if package_bundle['missing']:
+                print(f"  ⚠️ 鏡像目錄缺少，將於實例上下載: {', '.join(package_bundle['missing'])}")
+            for evicted in package_bundle['evicted']:
+                print(f"  🗑️ 淘汰最久未使用的套件包 {evicted[:16]}")
+        if bundle:
+            state = "重用既有" if bundle['reused'] else "新建"
+            print(f"📦 腳本包（{state}）: {bundle['path']} - {bundle['steps']} 個步驟, {bundle['size']} bytes")
+            if bundle['workers'] > 1:
+                print(f"  ⚡ 彼此獨立的積木最多 {bundle['workers']} 個同時執行")
+        print(f"✅ Packer 模板已寫入: {output_path}")
+        print(f"\n🚀 Packer 執行命令:")
+        print(composer.generate_packer_command(config, output_path))
+
+    elif command == "packages":
+        # 顯示合併後的套件安裝計畫: packages <積木>...
+        if len(sys.argv) < 3:
+            print("用法: block-composer.py packages <block> [block...]")
+            sys.exit(1)
+
+        try:
+            config = composer.generate_build_config(
+                build_name="dynamic",
+                environment="dev",
+                selected_blocks=sys.argv[2:]
+            )
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}")
+            sys.exit(1)
+
+        package_plan = composer.plan_packages(config)
+        if not package_plan:
+            print("ℹ️ 已選積木沒有宣告套件")
+            return
+
+        invocations = package_plan['invocations']
+        print(f"📦 {package_plan['os_family']} / {package_plan['package_manager']}: {', '.join(package_plan['blocks'])}")
+        for repository in package_plan['repositories']:
+            print(f"  🗄️ {repository['name']}: {repository.get('source') or repository.get('repo_url')}")
+        print(f"  📥 {' '.join(package_plan['install'])}")
+        print(
+            f"✅ 套件管理工具呼叫 {invocations['before']} → {invocations['after']} 次"
+            f"（減少 {invocations['removed']} 次）"
+        )
+
+    elif command == "layers":
+        # 中間層 AMI 快取（本地替身）: layers [--cache-dir <目錄>] [--base-ami <AMI>] <積木>...
+        args = sys.argv[2:]
+        options = {"--cache-dir": ".ami-cache", "--base-ami": "ami-base"}
+        for option in options:
+            if option in args:
+                position = args.index(option)
+                options[option] = args[position + 1] if position + 1 < len(args) else None
+                del args[position:position + 2]
+        if not args or not all(options.values()):
+            print("用法: block-composer.py layers [--cache-dir <dir>] [--base-ami <ami>] <block> [block...]")
+            sys.exit(1)
+
+        try:
+            config = composer.generate_build_config(
+                build_name="layered",
+                environment="dev",
+                selected_blocks=args,
+                parameters={"base_ami_id": options["--base-ami"]}
+            )
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}")
+            sys.exit(1)
+
+        cache_dir = Path(options["--cache-dir"])
+        layer_cache = AmiLayerCache(cache_dir / "layers.json")
+        ami_store = FakeAmiStore(cache_dir / "fake-amis.json")
+        layer_plan = composer.plan_layered_build(config, layer_cache, ami_store)
+
+        print(f"🧱 命中快取的前綴: {', '.join(layer_plan['cached_prefix']) or '(無)'}")
+        print(f"🚀 起始 AMI: {layer_plan['start_ami']}")
+        print(f"🔧 需要執行的積木: {', '.join(layer_plan['remaining_blocks']) or '(無)'}")
+
+        registered = composer.register_prefix_layers(
+            config, layer_plan, layer_cache,
+            lambda source_ami, block_id, prefix: ami_store.create_image(
+                source_ami, prefix['blocks'], prefix['hash'], config['packer_vars']['region']
+            )
+        )
+        for layer in registered:
+            print(f"  ➕ 登記中間層 {layer['ami_id']}: {' → '.join(layer['blocks'])}")
+
+    elif command == "reuse-check":
+        # 以建構指紋查詢是否已有相同的 AMI，輸出 JSON 供 Jenkins 判斷是否略過建構
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py reuse-check")
+        parser.add_argument("--index", required=True, help="建構索引檔案")
+        parser.add_argument("--env", default="dev")
+        parser.add_argument("--region", default="ap-northeast-1")
+        parser.add_argument("--instance-type", default="t3.micro")
+        parser.add_argument("--base-ami", default="")
+        parser.add_argument("--owner", default="infra-team")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            config = composer.generate_build_config(
+                build_name="dynamic",
+                environment=args.env,
+                selected_blocks=args.blocks,
+                parameters={
+                    "region": args.region,
+                    "instance_type": args.instance_type,
+                    "base_ami_id": args.base_ami,
+                    "owner": args.owner
+                }
+            )
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}", file=sys.stderr)
+            sys.exit(1)
+
+        existing = composer.find_existing_build(config, BuildIndex(args.index))
+        print(json.dumps({
+            "fingerprint": config['build_info']['fingerprint'],
+            "artifact": existing
+        }, ensure_ascii=False))
+
+    elif command == "publish":
+        # 建構完成後發佈 AMI: 單次呼叫套用完整標籤，並平行複製到其他區域
+        import argparse
+        from ami_cleanup import create_ec2_client
+        from ami_publish import compute_publish_tags, publish_image, write_publish_manifest
+        parser = argparse.ArgumentParser(prog="block-composer.py publish")
+        parser.add_argument("--image-id", required=True)
+        parser.add_argument("--env", default="dev")
+        parser.add_argument("--region", default="ap-northeast-1")
+        parser.add_argument("--instance-type", default="t3.micro")
+        parser.add_argument("--base-ami", default="")
+        parser.add_argument("--owner", default="infra-team")
+        parser.add_argument("--copy-regions", default="", help="以逗號分隔的目標區域")
+        parser.add_argument("--tag", action="append", default=[], metavar="KEY=VALUE", help="額外的標籤")
+        parser.add_argument("--poll-interval", type=float, default=15)
+        parser.add_argument("--timeout", type=float, default=3600)
+        parser.add_argument("--endpoint-url", help="EC2 端點（例如本地的 moto server）")
+        parser.add_argument("--output", default="publish-manifest.json")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            config = composer.generate_build_config(
+                build_name="dynamic",
+                environment=args.env,
+                selected_blocks=args.blocks,
+                parameters={
+                    "region": args.region,
+                    "instance_type": args.instance_type,
+                    "base_ami_id": args.base_ami,
+                    "owner": args.owner
+                }
+            )
+            extra_tags = dict(tag.partition("=")[::2] for tag in args.tag)
+            tags = compute_publish_tags(
+                config,
+                {block_id: info.get('category', 'custom') for block_id, info in composer.blocks_registry.items()},
+                extra_tags
+            )
+        except ValueError as e:
+            print(f"❌ 發佈失敗: {e}")
+            sys.exit(1)
+
+        try:
+            manifest = publish_image(
+                lambda region: create_ec2_client(region, args.endpoint_url),
+                args.region, args.image_id, tags,
+                [region for region in args.copy_regions.split(",") if region],
+                poll_interval=args.poll_interval, timeout=args.timeout
+            )
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+        write_publish_manifest(manifest, args.output)
+        print(f"🏷️ 已套用 {len(tags)} 個標籤: {args.image_id}")
+        for copy in manifest['copies']:
+            mark = '✅' if copy['state'] == 'available' else '❌'
+            print(f"  {mark} {copy['region']}: {copy['ami_id'] or '-'} ({copy['state']}, {copy['elapsed_seconds']}s)")
+        print(f"📋 發佈結果已寫入: {args.output}")
+        if manifest['failed']:
+            sys.exit(1)
+
+    elif command == "index-manifest":
+        # 將 packer-manifest.json 的建構結果匯入建構索引: index-manifest <索引檔案> <manifest>
+        if len(sys.argv) < 4:
+            print("用法: block-composer.py index-manifest <index.json> <packer-manifest.json>")
+            sys.exit(1)
+
+        count = BuildIndex(sys.argv[2]).ingest_manifest(sys.argv[3])
+        print(f"✅ 已匯入 {count} 筆建構結果")
+
+    elif command == "estimate":
+        # 估算建構時間與費用並挑選實例: estimate [--target-minutes N] [--history <剖析檔或目錄>...] <積木>...
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py estimate")
+        parser.add_argument("--target-minutes", type=float, help="目標建構時間（分鐘）")
+        parser.add_argument("--history", nargs="*", default=[],
+                            help=f"packer-timing.json 檔案或目錄（預設使用 {TIMING_HISTORY_ENV}）")
+        parser.add_argument("--catalog", help="覆蓋內建實例類型目錄的 JSON 檔案")
+        parser.add_argument("--select", action="store_true", help="只輸出挑選的實例類型")
+        parser.add_argument("--top", type=int, default=10, help="顯示的估算筆數")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        if args.history:
+            composer.timing_history = load_profiles(args.history)
+        composer.instance_catalog = load_catalog(args.catalog)
+        validation_result = composer.validate_dependencies(args.blocks)
+        if not validation_result['valid']:
+            print(f"❌ 依賴驗證失敗: {validation_result['errors']}", file=sys.stderr)
+            sys.exit(1)
+        execution_order = validation_result['execution_order']
+        try:
+            estimate = composer.estimate_build(
+                execution_order, composer._detect_os_info(execution_order)['family'],
+                target_seconds=args.target_minutes * 60 if args.target_minutes else None
+            )
+        except ValueError as e:
+            print(f"❌ {e}", file=sys.stderr)
+            sys.exit(1)
+
+        choice = estimate['choice']
+        if args.select:
+            print(choice['instance_type'])
+            return
+
+        print(f"⏱️ 依 {estimate['history_samples']} 份歷史剖析估算（費用由低到高）:")
+        for row in estimate['estimates'][:args.top]:
+            marker = "👉" if (row['instance_type'], row['volume_throughput']) == (
+                choice['instance_type'], choice['volume_throughput']) else "  "
+            print(f"  {marker} {row['instance_type']:<10} gp3 {row['volume_throughput']:>3} MB/s  "
+                  f"{row['seconds'] / 60:6.1f} 分鐘  ${row['cost_usd']:.4f}")
+        status = "✅" if choice['meets_target'] else "⚠️ 無法達成目標時間，改選最快的組合:"
+        print(f"{status} {choice['instance_type']} + gp3 {choice['volume_throughput']} MB/s，"
+              f"預估 {choice['seconds'] / 60:.1f} 分鐘、${choice['cost_usd']:.4f}")
+
+    elif command == "sandbox":
+        # 在本地沙箱執行積木腳本: sandbox [--backend container|chroot] [--image <映像>] [--rootfs <目錄>] <積木>...
+        import argparse
+        from sandbox_runner import ChrootBackend, ContainerBackend, default_image, run_plan, write_sandbox_report
+        parser = argparse.ArgumentParser(prog="block-composer.py sandbox")
+        parser.add_argument("--backend", choices=["container", "chroot"], default="container")
+        parser.add_argument("--image", help="容器映像（預設依基礎積木的 OS 選擇）")
+        parser.add_argument("--runtime", help="容器執行工具（預設 docker，其次 podman）")
+        parser.add_argument("--rootfs", help="chroot 後端使用的 rootfs 目錄")
+        parser.add_argument("--real-packages", action="store_true", help="不替換套件管理工具，實際安裝套件")
+        parser.add_argument("--stub", nargs="*", default=[], help="額外以替身取代的指令")
+        parser.add_argument("--timeout", type=float, default=600, help="單一步驟的逾時秒數")
+        parser.add_argument("--keep-going", action="store_true", help="步驟失敗後繼續執行其餘步驟")
+        parser.add_argument("--work-dir", help="保留沙箱工作目錄（腳本、日誌與替身呼叫紀錄）")
+        parser.add_argument("--output", help="將結果寫成 JSON 檔案")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            config = composer.generate_build_config(
+                build_name="sandbox",
+                environment="dev",
+                selected_blocks=args.blocks
+            )
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}")
+            sys.exit(1)
+
+        os_info = config['os_info']
+        if args.backend == "chroot":
+            if not args.rootfs:
+                print("❌ chroot 後端需要 --rootfs")
+                sys.exit(1)
+            backend = ChrootBackend(args.rootfs)
+        else:
+            backend = ContainerBackend(args.image or default_image(os_info), args.runtime)
+
+        status_icons = {'success': '✅', 'failed': '❌', 'timeout': '⏰'}
+        print(f"🧪 以 {args.backend} 後端執行 {len(composer.build_plan_steps(config))} 個步驟")
+        try:
+            report = run_plan(
+                composer.build_plan_steps(config), backend, os_info['family'],
+                stub_packages=not args.real_packages, extra_stubs=args.stub,
+                timeout=args.timeout, keep_going=args.keep_going, work_dir=args.work_dir,
+                on_result=lambda r: print(
+                    f"  {status_icons[r['status']]} {r['block']}: {r['step']} "
+                    f"({r['seconds']:.2f}s, exit {r['exit_code']})"
+                )
+            )
+        except RuntimeError as e:
+            print(f"❌ 無法啟動沙箱: {e}")
+            sys.exit(1)
+
+        for result in report['steps']:
+            if result.get('output_tail'):
+                print(f"\n--- {result['block']}: {result['step']} 輸出（最後 {len(result['output_tail'])} 行）---")
+                print("\n".join(result['output_tail']))
+        if args.output:
+            write_sandbox_report(report, args.output)
+        print(f"📋 成功 {report['succeeded']} / 失敗 {report['failed']} / 略過 {report['skipped']}，"
+              f"共 {report['total_seconds']:.2f}s")
+        if report['failed']:
+            sys.exit(1)
+
+    elif command == "impact":
+        # 變更影響分析: impact (--git-range <A..B> | --files <檔案>...) [--definitions <規格.json>...] [--index <索引>]
+        import argparse
+        from impact import analyze_impact, changed_files_from_git, load_build_definitions
+        parser = argparse.ArgumentParser(prog="block-composer.py impact")
+        parser.add_argument("--git-range", help="git revision 範圍，例如 origin/main..HEAD")
+        parser.add_argument("--files", nargs="*", default=[], help="變更的檔案（相對路徑以 repo 根目錄為基準）")
+        parser.add_argument("--definitions", nargs="*", default=[], help="建構定義（矩陣規格或模板 JSON）")
+        parser.add_argument("--index", help="建構索引檔案")
+        parser.add_argument("--json", action="store_true", help="以 JSON 輸出結果")
+        args = parser.parse_args(sys.argv[2:])
+
+        changed_files = list(args.files)
+        try:
+            if args.git_range:
+                changed_files.extend(changed_files_from_git(args.git_range))
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+
+        report = analyze_impact(
+            composer, changed_files,
+            definitions=load_build_definitions(args.definitions),
+            build_index=BuildIndex(args.index) if args.index else None
+        )
+        if args.json:
+            print(json.dumps(report, indent=2, ensure_ascii=False))
+            return
+
+        print(f"🔍 {len(changed_files)} 個變更檔案對應到 {len(report['changed_blocks'])} 個積木")
+        for block_id, source in report['impacted_blocks'].items():
+            via = "" if block_id == source else f"（可能受 {source} 影響）"
+            print(f"  • {block_id}{via}")
+        for path in report['global_files']:
+            print(f"  ⚠️ 引擎檔案變更，所有建構都需要重建: {path}")
+        print(f"📋 需要重建的建構定義: {len(report['stale_definitions'])} / {report['total_definitions']}")
+        for definition in report['stale_definitions']:
+            print(f"  • {definition['name']} ({definition['blocks'][0]}): "
+                  f"重新執行 {', '.join(definition['rerun_blocks'])}")
+        if args.index:
+            print(f"🗑️ 過期的 AMI: {len(report['stale_builds'])} / {report['total_builds']}")
+            for build in report['stale_builds']:
+                print(f"  • {build['ami_id']} ({build['region']}, {build['environment']}): "
+                      f"{', '.join(build['reasons'])}")
+
+    elif command == "timing":
+        # 由 packer -machine-readable 日誌產生各積木的時間剖析，寫在 packer-manifest.json 旁
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py timing")
+        parser.add_argument("log", help="packer build -machine-readable 的輸出，- 表示標準輸入")
+        parser.add_argument("--manifest", default="packer-manifest.json", help="packer-manifest.json 路徑")
+        parser.add_argument("--instance-type", help="建構使用的實例類型，供 estimate 換算歷史耗時")
+        parser.add_argument("blocks", nargs="+")
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            config = composer.generate_build_config(
+                build_name="dynamic",
+                environment="dev",
+                selected_blocks=args.blocks
+            )
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}")
+            sys.exit(1)
+
+        plan_steps = composer.build_plan_steps(config)
+        if args.log == "-":
+            profile = profile_log(sys.stdin, plan_steps)
+        else:
+            with open(args.log, 'r', encoding='utf-8', errors='replace') as f:
+                profile = profile_log(f, plan_steps)
+        if args.instance_type:
+            profile['instance_type'] = args.instance_type
+        output_path = write_timing_profile(profile, args.manifest)
+
+        print(f"⏱️ 總耗時 {profile['total_seconds']}s（{profile['lines']} 行日誌）")
+        for block_id, block in sorted(profile['blocks'].items(), key=lambda item: -item[1]['seconds']):
+            print(f"  • {block_id}: {block['seconds']:.0f}s")
+        for segment, seconds in profile['overhead'].items():
+            print(f"  · packer {segment}: {seconds:.0f}s")
+        if profile['failed_step']:
+            print(f"❌ 失敗步驟: {': '.join(profile['failed_step'])}")
+        print(f"✅ 時間剖析已寫入: {output_path}")
+
+    elif command == "timing-report":
+        # 與歷史剖析比較: timing-report <剖析檔案> <歷史檔案或目錄>... [--threshold 0.25] [--min-seconds 30]
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py timing-report")
+        parser.add_argument("profile")
+        parser.add_argument("history", nargs="+")
+        parser.add_argument("--threshold", type=float, default=0.25, help="相對中位數的容許增幅")
+        parser.add_argument("--min-seconds", type=float, default=30, help="最小的增加秒數")
+        args = parser.parse_args(sys.argv[2:])
+
+        with open(args.profile, 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        history = load_profiles(args.history, exclude=args.profile)
+        if not history:
+            print("⚠️ 沒有可比較的歷史剖析")
+            return
+
+        regressions = compare_profiles(current, history, args.threshold, args.min_seconds)
+        if not regressions:
+            print(f"✅ 與 {len(history)} 筆歷史剖析相比沒有積木變慢")
+            return
+
+        print(f"❌ {len(regressions)} 個積木變慢（與 {len(history)} 筆歷史剖析的中位數相比）:")
+        for item in regressions:
+            print(
+                f"  • {item['block']}: {item['seconds']:.0f}s "
+                f"(中位數 {item['baseline_seconds']:.0f}s, +{item['delta_seconds']:.0f}s)"
+            )
+        sys.exit(1)
+
+    elif command == "matrix":
+        # 矩陣建構: matrix <矩陣規格.json> [--dry-run]
+        from matrix import (INTERRUPT_GRACE_SECONDS, PackerExecutor, expand_matrix, prepare_jobs,
+                            write_matrix_manifest)
+        if len(sys.argv) < 3:
+            print("用法: block-composer.py matrix <matrix.json> [--dry-run]")
+            sys.exit(1)
+
+        with open(sys.argv[2], 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+
+        try:
+            jobs = expand_matrix(composer, spec)
+        except ValueError as e:
+            print(f"❌ 配置生成失敗: {e}")
+            sys.exit(1)
+
+        work_dir = Path(spec.get('work_dir', 'matrix-builds')) / spec.get('name', 'matrix')
+        prepare_jobs(composer, jobs, work_dir, os.environ.get('PACKER_BIN', 'packer'))
+        print(f"🧮 展開 {len(jobs)} 個建構，工作目錄: {work_dir}")
+        if "--dry-run" in sys.argv:
+            for job in jobs:
+                print(f"  • {job['id']}: {' '.join(job['command'])}")
+            return
+
+        executor = PackerExecutor(
+            max_workers=spec.get('max_workers', 4),
+            per_region_limit=spec.get('per_region_limit', 2),
+            region_limits=spec.get('region_limits'),
+            timeout=spec.get('timeout_seconds'),
+            interrupt_grace=spec.get('interrupt_grace_seconds', INTERRUPT_GRACE_SECONDS)
+        )
+        results = executor.run(jobs, on_result=lambda r: print(
+            f"  {'✅' if r['status'] == 'success' else '❌'} {r['id']}: {r['status']} "
+            f"({r.get('duration_seconds', 0)}s) {', '.join(r['artifacts'])}"
+        ))
+        manifest = write_matrix_manifest(results, work_dir / "matrix-manifest.json")
+        print(f"📋 成功 {manifest['succeeded']} / 失敗 {manifest['failed']} / 略過 {manifest['skipped']}")
+        if manifest['failed'] or manifest['skipped']:
+            sys.exit(1)
+
+    elif command == "validate-batch":
+        # 批次驗證: 每行一組 JSON，從檔案或標準輸入讀取，每行輸出一筆結果
+        source = sys.argv[2] if len(sys.argv) > 2 else "-"
+        stream = sys.stdin if source == "-" else open(source, 'r', encoding='utf-8')
+
+        def read_selections():
+            for line in stream:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # 無法解析的行原樣交給 validate_batch 回報格式錯誤
+                    yield line
+
+        started = time.perf_counter()
+        count = 0
+        for result in composer.validate_batch(read_selections()):
+            print(json.dumps(result, ensure_ascii=False))
+            count += 1
+        sys.stdout.flush()
+
+        elapsed = time.perf_counter() - started
+        print(
+            f"📊 驗證 {count} 筆，耗時 {elapsed * 1000:.1f} ms，"
+            f"快取命中 {composer.validation_cache_stats['hits']} / 未命中 {composer.validation_cache_stats['misses']}",
+            file=sys.stderr
+        )
+
+    elif command == "broker-sim":
+        # 以假建構器模擬建構請求佇列: broker-sim --requests <請求.json> [--repeat N] [--interval 秒] [--duration 秒]
+        import argparse
+        import asyncio
+        # build_broker 會載入 asyncio，只在需要時匯入以免拖慢其他指令
+        from build_broker import BuildBroker, FakeBuilder, simulate
+        parser = argparse.ArgumentParser(prog="block-composer.py broker-sim")
+        parser.add_argument("--requests", required=True,
+                            help="請求列表 JSON: [{\"blocks\": [...], \"environment\", \"region\", \"parameters\"}]")
+        parser.add_argument("--repeat", type=int, default=1, help="將請求列表重複送出的次數")
+        parser.add_argument("--interval", type=float, default=0.0, help="相鄰請求的間隔秒數")
+        parser.add_argument("--duration", type=float, default=1.0, help="假建構器每次建構的秒數")
+        parser.add_argument("--jitter", type=float, default=0.0, help="建構秒數的隨機增減範圍")
+        parser.add_argument("--failure-rate", type=float, default=0.0)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--max-concurrent", type=int, default=4, help="全域同時建構上限")
+        parser.add_argument("--per-region", type=int, default=2, help="每個區域的同時建構上限")
+        parser.add_argument("--region-limit", action="append", default=[], metavar="REGION=N",
+                            help="個別區域的同時建構上限")
+        parser.add_argument("--index", help="建構索引檔案，已有相同指紋產物的請求直接重用")
+        parser.add_argument("--output", help="將每筆請求的結果寫成 JSON 檔案")
+        args = parser.parse_args(sys.argv[2:])
+
+        with open(args.requests, 'r', encoding='utf-8') as f:
+            requests = json.load(f) * args.repeat
+        region_limits = {}
+        for item in args.region_limit:
+            region, _, limit = item.partition("=")
+            region_limits[region] = int(limit)
+
+        builder = FakeBuilder(args.duration, args.jitter, args.failure_rate, args.seed)
+        broker = BuildBroker(
+            composer, builder, max_concurrent=args.max_concurrent, per_region_limit=args.per_region,
+            region_limits=region_limits, build_index=BuildIndex(args.index) if args.index else None
+        )
+        report = asyncio.run(simulate(broker, requests, args.interval))
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+
+        stats = report['stats']
+        print(f"📨 {stats['requests']} 個請求 → 實際建構 {stats['builds']} 次"
+              f"（合併 {stats['coalesced']}、重用 {stats['reused']}、拒絕 {stats['rejected']}）")
+        print(f"✅ 成功 {stats['succeeded']} / ❌ 失敗 {stats['failed']}")
+        print(f"⏱️ 總耗時 {report['elapsed_seconds']}s，{report['requests_per_second']} 請求/秒，"
+              f"等待時間 p50 {report['wait_p50_seconds']}s / 最長 {report['wait_max_seconds']}s")
+        print(f"🔒 同時建構最多 {builder.max_running} 個，各區域: "
+              + ", ".join(f"{region} {count}" for region, count in sorted(builder.max_running_by_region.items())))
+        rejected = {}
+        for result in report['results']:
+            if result['status'] == 'rejected':
+                rejected.setdefault(result['error'], []).append(str(result['request_id']))
+        for error, request_ids in rejected.items():
+            print(f"  ⚠️ {len(request_ids)} 個請求被拒絕（{', '.join(request_ids[:5])}"
+                  f"{' ...' if len(request_ids) > 5 else ''}）: {error}")
+
+    elif command == "resolve":
+        # 依功能自動挑選積木: resolve <基礎積木> <功能>...
+        if len(sys.argv) < 4:
+            print("用法: block-composer.py resolve <base-block> <feature> [feature...]")
+            sys.exit(1)
+
+        result = composer.resolve_features(sys.argv[3:], base_block=sys.argv[2])
+        if result['valid']:
+            print(f"✅ 自動挑選的積木: {', '.join(result['selected_blocks'])}")
+            for index, layer in enumerate(result['execution_layers'], 1):
+                print(f"  第 {index} 層: {', '.join(layer)}")
+        else:
+            print("❌ 無法滿足需要的功能")
+            for error in result['errors']:
+                print(f"  • {error}")
+            sys.exit(1)
+
+    elif command == "query":
+        # 以索引查詢積木: query [--category C] [--tag T] [--os 家族[:版本]] [--provides F] [--requires F]
+        import argparse
+        parser = argparse.ArgumentParser(prog="block-composer.py query")
+        parser.add_argument("--category", action="append", help="類別，可重複指定（符合任一即可）")
+        parser.add_argument("--tag", action="append", default=[], help="標籤，可重複指定（必須全部符合）")
+        parser.add_argument("--os", help="OS 家族，可加上版本，例如 amazon-linux:2023")
+        parser.add_argument("--provides", action="append", default=[], help="提供的功能，可重複指定")
+        parser.add_argument("--requires", action="append", default=[], help="需要的功能，可重複指定")
+        parser.add_argument("--keys", action="store_true", help="列出各索引可用的鍵")
+        parser.add_argument("--json", action="store_true", help="以 JSON 輸出")
+        args = parser.parse_args(sys.argv[2:])
+
+        if args.keys:
+            print(json.dumps(composer.block_model.index_keys(), indent=2, ensure_ascii=False))
+            return
+
+        os_family, _, os_version = (args.os or "").partition(":")
+        started = time.perf_counter()
+        blocks = composer.query_blocks(
+            category=args.category,
+            tags=args.tag,
+            os_family=os_family or None,
+            os_version=os_version or None,
+            provides=args.provides,
+            requires=args.requires
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if args.json:
+            print(json.dumps(blocks, indent=2, ensure_ascii=False))
+            return
+        print(f"🔎 {len(blocks)} 個積木符合條件（{elapsed_ms:.3f} ms，共 {len(composer.blocks_registry)} 個積木）:")
+        for block in blocks:
+            print(f"  • {block['id']} [{block['category']}] - {block['name']}")
+            if block['provides']:
+                print(f"    提供: {', '.join(block['provides'])}")
+
+    elif command == "benchmark":
+        # 以合成積木樹量測效能，可寫出基準檔並與先前的基準比較
+        import argparse
+        # benchmark 會載入 tracemalloc 與 subprocess，只在此指令匯入
+        from benchmark import DEFAULT_SIZES, compare_benchmarks, run_benchmarks, write_baseline
+        parser = argparse.ArgumentParser(prog="block-composer.py benchmark")
+        parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="積木數量，以逗號分隔")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--load-iterations", type=int, default=5, help="載入註冊表的量測次數")
+        parser.add_argument("--provides-fanout", type=int, default=2)
+        parser.add_argument("--requires-fanout", type=int, default=2)
+        parser.add_argument("--depth", type=int, default=4, help="依賴的層數")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="寫出基準檔")
+        parser.add_argument("--compare", help="與先前的基準檔比較 p50")
+        parser.add_argument("--threshold", type=float, default=0.2)
+        args = parser.parse_args(sys.argv[2:])
+
+        def print_size(size, result):
+            print(f"\n📏 {result['blocks']} 個積木（平均組合 {result['selection_size']} 個）:")
+            for name, stats in result['operations'].items():
+                print(
+                    f"  • {name:<24} p50 {stats['p50_ms']:>10.3f} ms  "
+                    f"p99 {stats['p99_ms']:>10.3f} ms  peak {stats['peak_kb']:>10.1f} KiB"
+                )
+
+        report = run_benchmarks(
+            BlockComposer,
+            sizes=[int(size) for size in args.sizes.split(",") if size],
+            on_size=print_size,
+            iterations=args.iterations,
+            load_iterations=args.load_iterations,
+            provides_fanout=args.provides_fanout,
+            requires_fanout=args.requires_fanout,
+            depth=args.depth,
+            seed=args.seed
+        )
+        if args.output:
+            print(f"\n✅ 基準檔已寫入: {write_baseline(report, args.output)}")
+        if args.compare:
+            with open(args.compare, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+            regressions = compare_benchmarks(report, baseline, args.threshold)
+            if regressions:
+                print(f"\n❌ {len(regressions)} 項操作變慢（與 {baseline.get('commit') or args.compare} 相比）:")
+                for item in regressions:
+                    print(
+                        f"  • {item['size']} 個積木 {item['operation']}: "
+                        f"{item['baseline']} → {item['current']} ms (x{item['ratio']})"
+                    )
+                sys.exit(1)
+            print(f"\n✅ 與 {baseline.get('commit') or args.compare} 相比沒有操作變慢")
+
+    elif command == "serve":
+        # 常駐服務: serve [--socket <路徑>] [--reload-interval <秒>]，以 composer_client.py 呼叫
+        import argparse
+        from composer_daemon import RELOAD_INTERVAL, serve
+        parser = argparse.ArgumentParser(prog="block-composer.py serve")
+        parser.add_argument("--socket", help="Unix socket 路徑（預設 $BLOCK_COMPOSER_SOCKET 或 /tmp/block-composer-<uid>.sock）")
+        parser.add_argument("--reload-interval", type=float, default=RELOAD_INTERVAL,
+                            help="檢查 block.yaml 是否變更的最短間隔秒數")
+        args = parser.parse_args(sys.argv[2:])
+
+        try:
+            stats = serve(
+                composer, args.socket, args.reload_interval,
+                on_ready=lambda path: print(
+                    f"🛰️ 常駐服務已啟動: {path}（{len(composer.blocks_registry)} 個積木，"
+                    f"載入 {composer.load_stats['elapsed_ms']} ms）", flush=True
+                )
+            )
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        print(f"👋 常駐服務已停止，共處理 {sum(m['count'] for m in stats['requests'].values())} 個請求")
+        for method, latency in stats['requests'].items():
+            print(f"  • {method}: {latency['count']} 次, p50 {latency['p50_ms']} ms, p95 {latency['p95_ms']} ms")
+
+    elif command == "cache-stats":
+        # 比較冷啟動（無快取）與熱啟動（快取命中）的載入時間
+        # 兩次載入都在新的行程中執行：冷啟動的時間才會包含載入 yaml，積木來源也與此行程相同（含 BLOCK_SOURCES）
+        if "--probe" in sys.argv:
+            print(json.dumps(composer.load_stats))
+            return
+
+        import subprocess
+
+        def probe() -> Dict[str, Any]:
+            started = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, str(Path(__file__).resolve()), "cache-stats", "--probe"],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                print(f"❌ 無法量測載入時間: {completed.stderr.strip()}")
+                sys.exit(1)
+            stats = json.loads(completed.stdout.strip().splitlines()[-1])
+            stats['process_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            return stats
+
+        composer.registry_cache.clear()
+        cold = probe()
+        warm = probe()
+
+        print(f"📦 積木數量: {warm['blocks']}（{warm['sources']} 個來源）")
+        print(f"🔧 YAML loader: {cold['yaml_loader']}")
+        print(f"🧊 冷啟動: {cold['elapsed_ms']} ms（整個行程 {cold['process_ms']} ms） {cold['cache']}")
+        print(f"🔥 熱啟動: {warm['elapsed_ms']} ms（整個行程 {warm['process_ms']} ms） {warm['cache']}")
+        print(f"🗂️ 快取檔案: {composer.registry_cache.cache_file}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
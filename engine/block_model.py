@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+積木模型 - 以 __slots__ 紀錄保存驗證與排序需要的欄位，功能名稱對應到整數位元，依賴檢查以位元運算完成；
+另維護類別、標籤、OS 支援與功能的次要索引，查詢時以位元 AND 取交集
+"""
+
+import sys
+from typing import Any, Dict, Iterable, List
+
+# 未宣告 execution_order 的積木排在中間
+DEFAULT_EXECUTION_ORDER = 50
+
+# 未宣告 category 的積木歸類
+DEFAULT_CATEGORY = "custom"
+
+# get_available_blocks 固定列出的類別順序，其他類別依出現順序接在後面
+CATEGORY_ORDER = ("base", "application", "configuration", "custom")
+
+# 舊版積木 ID 的類別前綴（blocks/custom/README.md 的命名慣例: custom-應用名稱），未列出的類別直接以類別名稱為前綴
+_ID_PREFIXES = {"base": "base", "application": "app", "configuration": "config", "custom": "custom"}
+
+# blocks/ 下的類別目錄名稱對應的類別
+_DIRECTORY_CATEGORIES = {"applications": "application", "configurations": "configuration"}
+
+# 舊版 block.yaml（沒有最上層 block: 區段）的 variables 值對應的參數型別
+_VARIABLE_TYPES = ((bool, "boolean"), (int, "integer"), (float, "number"), (list, "array"), (dict, "object"))
+
+
+def normalize_block_definition(config: Any, block_dir_name: str, category_dir_name: str = None) -> Dict[str, Any]:
+    """
+    將 block.yaml 的內容轉成統一的積木定義，無法辨識時回傳 None
+
+    目前的格式把所有欄位放在 block: 區段下；舊版格式（見 blocks/custom/README.md）直接寫在最上層、
+    沒有 id，並以 variables 宣告參數。舊版積木依命名慣例以 <類別前綴>-<目錄名稱> 作為 ID
+    （blocks/custom/my-app → custom-my-app），name 保留為顯示名稱；variables 轉成 parameters；
+    dependencies 列的是積木 ID 而非功能，轉成 after（排在這些積木之後，不參與功能檢查）。
+    """
+    if not isinstance(config, dict):
+        return None
+    if 'block' in config:
+        return config['block'] if isinstance(config['block'], dict) else None
+    if 'name' not in config and 'id' not in config:
+        return None
+
+    block = dict(config)
+    category = config.get('category') or _DIRECTORY_CATEGORIES.get(category_dir_name, category_dir_name) or DEFAULT_CATEGORY
+    block['category'] = category
+    block['id'] = str(config.get('id') or legacy_block_id(block_dir_name, category))
+    variables = config.get('variables')
+    if 'parameters' not in config and isinstance(variables, dict):
+        block['parameters'] = [
+            {'name': name, 'type': _variable_type(value), 'default': value}
+            for name, value in variables.items()
+        ]
+    dependencies = config.get('dependencies')
+    if 'after' not in config and isinstance(dependencies, list):
+        block['after'] = [str(block_id) for block_id in dependencies if block_id]
+    block['schema'] = 'legacy'
+    return block
+
+
+def legacy_block_id(name: str, category: str) -> str:
+    """依命名慣例組成舊版積木的 ID，名稱已帶類別前綴時不重複加上"""
+    prefix = _ID_PREFIXES.get(category, category)
+    return name if name.startswith(f"{prefix}-") else f"{prefix}-{name}"
+
+
+def _variable_type(value: Any) -> str:
+    for python_type, type_name in _VARIABLE_TYPES:
+        if isinstance(value, python_type):
+            return type_name
+    return "string"
+
+
+def _bit_positions(mask: int) -> List[int]:
+    """回傳遮罩中為 1 的位元位置（由小到大），以字串搜尋避免逐位元運算大整數"""
+    digits = bin(mask)[:1:-1]
+    positions = []
+    position = digits.find('1')
+    while position >= 0:
+        positions.append(position)
+        position = digits.find('1', position + 1)
+    return positions
+
+
+def os_entries(block_info: Dict[str, Any]) -> List[tuple]:
+    """
+    回傳積木支援的 (OS 家族, 版本 tuple)，空 tuple 表示該家族的所有版本
+
+    基礎積木沒有 os_support，以 os_info 作為唯一支援的 OS；兩者都沒有的積木回傳空列表，表示與 OS 無關。
+    """
+    os_support = block_info.get('os_support')
+    if os_support:
+        return [
+            (str(entry.get('os_family')), tuple(str(v) for v in entry.get('os_versions') or ()))
+            for entry in os_support if isinstance(entry, dict) and entry.get('os_family')
+        ]
+    os_info = block_info.get('os_info')
+    if isinstance(os_info, dict) and os_info.get('family'):
+        version = str(os_info.get('version') or '')
+        return [(str(os_info['family']), (version,) if version else ())]
+    return []
+
+
+class FeatureBits:
+    """
+    功能名稱與位元位置的雙向對照
+
+    每個功能名稱以 sys.intern 共用同一個字串物件，依第一次出現的順序配給位元；
+    功能集合以 Python int 表示，集合運算即整數的 AND / OR。
+    """
+
+    def __init__(self):
+        self.positions: Dict[str, int] = {}
+        self.names: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def bit(self, feature: str) -> int:
+        """回傳功能的位元，未見過的功能配給下一個位元"""
+        position = self.positions.get(feature)
+        if position is None:
+            position = len(self.names)
+            feature = sys.intern(feature)
+            self.positions[feature] = position
+            self.names.append(feature)
+        return 1 << position
+
+    def mask(self, features: Iterable[str]) -> int:
+        """將功能名稱集合轉成位元遮罩"""
+        mask = 0
+        for feature in features:
+            mask |= self.bit(feature)
+        return mask
+
+    def decode(self, mask: int) -> List[str]:
+        """將位元遮罩轉回排序後的功能名稱，只在產生錯誤訊息時使用"""
+        features = []
+        while mask:
+            lowest = mask & -mask
+            features.append(self.names[lowest.bit_length() - 1])
+            mask ^= lowest
+        return sorted(features)
+
+
+class BlockRecord:
+    """
+    單一積木的精簡紀錄，provides/requires 同時保留名稱 tuple 與位元遮罩
+
+    after 為必須排在前面的積木 ID（舊版 block.yaml 的 dependencies），只影響排序。
+    """
+
+    __slots__ = ('id', 'position', 'category', 'tags', 'execution_order', 'provides', 'requires',
+                 'provides_mask', 'requires_mask', 'after')
+
+    def __init__(self, block_id: str, block_info: Dict[str, Any], features: FeatureBits):
+        self.id = sys.intern(block_id)
+        self.position = None
+        self.category = sys.intern(str(block_info.get('category', DEFAULT_CATEGORY)))
+        self.tags = tuple(sys.intern(str(tag)) for tag in block_info.get('tags') or ())
+        self.execution_order = block_info.get('execution_order', DEFAULT_EXECUTION_ORDER)
+        self.provides = tuple(sys.intern(f) for f in block_info.get('provides') or ())
+        self.requires = tuple(sys.intern(f) for f in block_info.get('requires') or ())
+        self.provides_mask = features.mask(self.provides)
+        self.requires_mask = features.mask(self.requires)
+        self.after = tuple(sys.intern(str(block_id)) for block_id in block_info.get('after') or ())
+
+    @property
+    def sort_key(self):
+        return (self.execution_order, self.id)
+
+    def __repr__(self) -> str:
+        return f"BlockRecord({self.id!r})"
+
+
+class BlockModel:
+    """
+    由 blocks_registry 建立的唯讀模型，註冊表版本變更時整個重建
+
+    原始的 block.yaml 內容仍保留在 blocks_registry，供腳本、套件與參數等較少使用的欄位查詢；
+    依賴驗證、分層排序與積木清單只使用此模型。
+
+    積木依 (execution_order, ID) 排序後配給位置，次要索引把每個鍵對應到積木位置的位元遮罩，
+    因此查詢結果解碼後即為排序好的順序。
+    """
+
+    def __init__(self, registry: Dict[str, Dict[str, Any]]):
+        self.features = FeatureBits()
+        self.records: Dict[str, BlockRecord] = {}
+        for block_id, block_info in registry.items():
+            record = BlockRecord(block_id, block_info, self.features)
+            self.records[record.id] = record
+        self.ordered: List[BlockRecord] = sorted(self.records.values(), key=lambda r: r.sort_key)
+        for position, record in enumerate(self.ordered):
+            record.position = position
+        self._registry = registry
+        self._available = None
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._build_indexes()
+
+    def _build_indexes(self):
+        """建立 鍵 → 積木位置遮罩 的次要索引"""
+        self.all_mask = (1 << len(self.ordered)) - 1
+        # 沒有宣告 os_support / os_info 的積木與 OS 無關，符合任何 OS 查詢
+        self.os_agnostic_mask = 0
+        self.indexes: Dict[str, Dict[Any, int]] = {
+            'category': {}, 'tag': {}, 'os_family': {}, 'os_version': {}, 'provides': {}, 'requires': {}
+        }
+        category_index, tag_index = self.indexes['category'], self.indexes['tag']
+        family_index, version_index = self.indexes['os_family'], self.indexes['os_version']
+        provides_index, requires_index = self.indexes['provides'], self.indexes['requires']
+
+        for record in self.ordered:
+            bit = 1 << record.position
+            category_index[record.category] = category_index.get(record.category, 0) | bit
+            for tag in record.tags:
+                tag_index[tag] = tag_index.get(tag, 0) | bit
+            for feature in record.provides:
+                provides_index[feature] = provides_index.get(feature, 0) | bit
+            for feature in record.requires:
+                requires_index[feature] = requires_index.get(feature, 0) | bit
+            entries = os_entries(self._registry[record.id])
+            if not entries:
+                self.os_agnostic_mask |= bit
+            for family, versions in entries:
+                family_index[family] = family_index.get(family, 0) | bit
+                # 未列出版本的項目支援該家族的所有版本，以 (家族, None) 記錄
+                for version in versions or (None,):
+                    key = (family, version)
+                    version_index[key] = version_index.get(key, 0) | bit
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __contains__(self, block_id: str) -> bool:
+        return block_id in self.records
+
+    def get(self, block_id: str) -> BlockRecord:
+        return self.records.get(block_id)
+
+    def provider_index(self) -> Dict[str, List[str]]:
+        """功能 → 提供者積木 ID，提供者依 execution_order 與 ID 排序"""
+        index: Dict[str, List[str]] = {}
+        for record in self.ordered:
+            for feature in record.provides:
+                index.setdefault(feature, []).append(record.id)
+        return index
+
+    def missing_mask(self, records: List[BlockRecord], provided: int = None) -> Dict[str, int]:
+        """回傳每個需求未被滿足的積木 {積木 ID: 缺少功能的位元遮罩}"""
+        if provided is None:
+            provided = 0
+            for record in records:
+                provided |= record.provides_mask
+        return {
+            record.id: record.requires_mask & ~provided
+            for record in records if record.requires_mask & ~provided
+        }
+
+    def available_blocks(self) -> Dict[str, List[Dict[str, Any]]]:
+        """按類別分組的積木清單，第一次呼叫時建立，之後回傳同一份"""
+        if self._available is None:
+            available = {category: [] for category in CATEGORY_ORDER}
+            for block_id, record in self.records.items():
+                available.setdefault(record.category, []).append(self._summary(record))
+            self._available = available
+        return self._available
+
+    def _summary(self, record: BlockRecord) -> Dict[str, Any]:
+        summary = self._summaries.get(record.id)
+        if summary is None:
+            block_info = self._registry[record.id]
+            summary = self._summaries[record.id] = {
+                'id': record.id,
+                'name': block_info.get('name', record.id),
+                'category': record.category,
+                'description': block_info.get('description', ''),
+                'version': block_info.get('version', ''),
+                'tags': list(record.tags),
+                'provides': list(record.provides),
+                'requires': list(record.requires),
+                'parameters': block_info.get('parameters', [])
+            }
+        return summary
+
+    def _lookup(self, index_name: str, keys: Iterable[Any]) -> List[int]:
+        index = self.indexes[index_name]
+        return [index.get(key, 0) for key in keys]
+
+    def query(self, category: Any = None, tags: Iterable[str] = (), os_family: str = None,
+              os_version: str = None, provides: Iterable[str] = (),
+              requires: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """
+        以次要索引查詢積木，回傳依 (execution_order, ID) 排序的積木摘要
+
+        category 可為單一類別或列表（符合任一即可）；tags、provides、requires 必須全部符合。
+        os_family 查詢支援該家族的積木，加上 os_version 時只保留列出該版本或未限制版本的積木；
+        與 OS 無關的積木一律符合。回傳的摘要與 available_blocks 共用，呼叫端不可修改。
+        """
+        if os_version is not None and not os_family:
+            raise ValueError("指定 os_version 時必須同時指定 os_family")
+
+        mask = self.all_mask
+        if category is not None:
+            categories = [category] if isinstance(category, str) else list(category)
+            category_mask = 0
+            for matched in self._lookup('category', categories):
+                category_mask |= matched
+            mask &= category_mask
+        for matched in self._lookup('tag', tags):
+            mask &= matched
+        for matched in self._lookup('provides', provides):
+            mask &= matched
+        for matched in self._lookup('requires', requires):
+            mask &= matched
+        if os_family:
+            if os_version is None:
+                os_mask = self.indexes['os_family'].get(os_family, 0)
+            else:
+                versions = self.indexes['os_version']
+                os_mask = versions.get((os_family, str(os_version)), 0) | versions.get((os_family, None), 0)
+            mask &= os_mask | self.os_agnostic_mask
+
+        ordered = self.ordered
+        return [self._summary(ordered[position]) for position in _bit_positions(mask)]
+
+    def index_keys(self) -> Dict[str, List[Any]]:
+        """各索引目前有哪些鍵，供入口網站產生篩選選項"""
+        keys = {name: sorted(index) for name, index in self.indexes.items() if name != 'os_version'}
+        keys['os_version'] = sorted(
+            f"{family}:{version}" for family, version in self.indexes['os_version'] if version is not None
+        )
+        return keys
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+多來源積木倉庫 - 彙整本地目錄、git 倉庫與壓縮檔中的積木，遠端內容鏡像到以內容定址的本地儲存區
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from artifact_cache import JsonIndex
+
+# 未指定來源設定時使用的環境變數
+SOURCES_ENV = "BLOCK_SOURCES"
+
+# 本地儲存區的預設位置（相對於來源設定檔）
+DEFAULT_STORE_DIR = ".block-store"
+
+SOURCE_TYPES = ("local", "git", "tarball")
+
+
+def load_sources_file(path: str) -> List[Dict[str, Any]]:
+    """
+    讀取來源設定檔，相對路徑以設定檔所在目錄為準
+
+    格式為 {"sources": [{"name", "type", ...}]}，排在前面的來源優先。
+    """
+    path = Path(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        sources = json.load(f).get('sources', [])
+    for source in sources:
+        for key in ('path', 'url'):
+            value = source.get(key)
+            if value and '://' not in value and not Path(value).is_absolute():
+                source[key] = str((path.parent / value).resolve())
+    return sources
+
+
+def _source_key(source: Dict[str, Any]) -> str:
+    """來源在索引中的鍵，相同位置與 ref 的來源共用鏡像"""
+    if source['type'] == 'git':
+        return f"git:{source['url']}#{source.get('ref', 'HEAD')}"
+    return f"{source['type']}:{source.get('url') or source.get('path')}"
+
+
+def _run_git(args: List[str], cwd: str = None) -> str:
+    # 只有 git 來源需要 subprocess，組合器啟動時不載入
+    import subprocess
+    completed = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"git {' '.join(args)} 失敗: {completed.stderr.strip()}")
+    return completed.stdout.strip()
+
+
+def _safe_extract(archive: tarfile.TarFile, destination: Path):
+    """解開壓縮檔，拒絕指向目標目錄外的路徑與連結"""
+    root = destination.resolve()
+    for member in archive.getmembers():
+        target = (root / member.name).resolve()
+        if target != root and root not in target.parents:
+            raise ValueError(f"壓縮檔包含不安全的路徑: {member.name}")
+        if member.issym() or member.islnk() or member.isdev():
+            raise ValueError(f"壓縮檔包含不支援的檔案類型: {member.name}")
+    archive.extractall(root)
+
+
+class BlockStore(JsonIndex):
+    """
+    以內容定址的積木鏡像儲存區
+
+    git 來源以 commit 為鍵、壓縮檔以 sha256 為鍵存放於 <store_dir>/objects/，
+    索引 <store_dir>/index.json 記錄每個來源最後解析到的內容；
+    未要求 refresh 時直接使用索引中的鏡像，不會再連線取得。
+    """
+
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        self.stats = {'hits': 0, 'fetched': 0}
+        super().__init__(self.store_dir / "index.json")
+
+    def _object_dir(self, digest: str) -> Path:
+        return self.store_dir / "objects" / digest
+
+    def _commit_object(self, digest: str, populate) -> Path:
+        """若內容尚未存在，先寫入暫存目錄再原子地搬到 objects/<digest>"""
+        object_dir = self._object_dir(digest)
+        if object_dir.exists():
+            return object_dir
+        object_dir.parent.mkdir(parents=True, exist_ok=True)
+        tmp_dir = Path(tempfile.mkdtemp(prefix=f".{digest[:12]}-", dir=object_dir.parent))
+        try:
+            populate(tmp_dir)
+            os.replace(tmp_dir, object_dir)
+        except OSError:
+            # 其他程序已先寫入相同內容
+            if not object_dir.exists():
+                raise
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        return object_dir
+
+    def _mirror_git(self, source: Dict[str, Any]) -> Dict[str, Any]:
+        url = source['url']
+        ref = source.get('ref', 'HEAD')
+        repo_dir = self.store_dir / "repos" / (hashlib.sha256(url.encode('utf-8')).hexdigest()[:16] + ".git")
+        if not repo_dir.exists():
+            repo_dir.parent.mkdir(parents=True, exist_ok=True)
+            _run_git(["init", "--quiet", "--bare", str(repo_dir)])
+
+        if len(ref) == 40:
+            # ref 已是完整 commit: 本地已有時不需連線，否則取得所有分支與標籤
+            # （多數伺服器不允許直接取得任意 commit）
+            try:
+                commit = _run_git(["rev-parse", "--verify", f"{ref}^{{commit}}"], cwd=str(repo_dir))
+            except RuntimeError:
+                _run_git(["fetch", "--quiet", url, "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"],
+                         cwd=str(repo_dir))
+                commit = _run_git(["rev-parse", "--verify", f"{ref}^{{commit}}"], cwd=str(repo_dir))
+        else:
+            _run_git(["fetch", "--quiet", "--depth", "1", url, ref], cwd=str(repo_dir))
+            commit = _run_git(["rev-parse", "FETCH_HEAD^{commit}"], cwd=str(repo_dir))
+
+        def populate(tmp_dir: Path):
+            import subprocess
+            archive = subprocess.run(
+                ["git", "archive", "--format=tar", commit], cwd=str(repo_dir), capture_output=True
+            )
+            if archive.returncode != 0:
+                raise RuntimeError(f"git archive {commit} 失敗: {archive.stderr.decode(errors='replace').strip()}")
+            with tempfile.TemporaryFile() as buffer:
+                buffer.write(archive.stdout)
+                buffer.seek(0)
+                with tarfile.open(fileobj=buffer, mode='r:') as tar:
+                    _safe_extract(tar, tmp_dir)
+
+        digest = f"git-{commit}"
+        self._commit_object(digest, populate)
+        return {'digest': digest, 'revision': commit}
+
+    def _mirror_tarball(self, source: Dict[str, Any]) -> Dict[str, Any]:
+        location = source.get('url') or source['path']
+        with tempfile.NamedTemporaryFile(dir=self.store_dir, delete=False) as download:
+            tmp_path = Path(download.name)
+            if '://' in location:
+                import urllib.request
+                with urllib.request.urlopen(location, timeout=60) as response:
+                    shutil.copyfileobj(response, download)
+            else:
+                with open(location, 'rb') as f:
+                    shutil.copyfileobj(f, download)
+        try:
+            digest_hex = hashlib.sha256(tmp_path.read_bytes()).hexdigest()
+            if source.get('sha256') and source['sha256'] != digest_hex:
+                raise ValueError(f"壓縮檔 {location} 的 sha256 不符: {digest_hex}")
+
+            def populate(tmp_dir: Path):
+                with tarfile.open(tmp_path, mode='r:*') as tar:
+                    _safe_extract(tar, tmp_dir)
+
+            digest = f"tar-{digest_hex}"
+            self._commit_object(digest, populate)
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return {'digest': digest, 'revision': digest_hex}
+
+    def mirror(self, source: Dict[str, Any], refresh: bool = False) -> Path:
+        """取得來源在本地儲存區的目錄，必要時才連線取得"""
+        key = _source_key(source)
+        record = self.get(key)
+        if record and not refresh and self._object_dir(record['digest']).exists():
+            self.stats['hits'] += 1
+            return self._object_dir(record['digest'])
+
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        if source['type'] == 'git':
+            resolved = self._mirror_git(source)
+        else:
+            resolved = self._mirror_tarball(source)
+        self.stats['fetched'] += 1
+        self.put(key, dict(resolved, source=source.get('name', key), mirrored_at=time.time()))
+        return self._object_dir(resolved['digest'])
+
+    def prune(self) -> List[str]:
+        """刪除不再被任何索引項目引用的鏡像內容，回傳刪除的 digest"""
+        objects_dir = self.store_dir / "objects"
+        if not objects_dir.exists():
+            return []
+        referenced = {record['digest'] for record in self.records.values()}
+        removed = []
+        for object_dir in objects_dir.iterdir():
+            if object_dir.name not in referenced and not object_dir.name.startswith('.'):
+                shutil.rmtree(object_dir, ignore_errors=True)
+                removed.append(object_dir.name)
+        return removed
+
+
+def resolve_sources(sources: List[Dict[str, Any]], store: BlockStore = None,
+                    refresh: bool = False) -> List[Dict[str, Any]]:
+    """
+    將來源設定解析為可直接讀取的積木根目錄，依優先順序排列
+
+    本地目錄直接使用原路徑；git 與壓縮檔先鏡像到儲存區，subdir 指定積木所在的子目錄。
+    categories 可限制該來源只能提供哪些類別的積木。
+    """
+    roots = []
+    for index, source in enumerate(sources):
+        source_type = source.get('type', 'local')
+        if source_type not in SOURCE_TYPES:
+            raise ValueError(f"未知的積木來源類型 '{source_type}'")
+        name = source.get('name') or f"{source_type}-{index}"
+        if source_type == 'local':
+            path = Path(source['path'])
+        else:
+            if store is None:
+                raise ValueError(f"積木來源 '{name}' 需要本地儲存區")
+            path = store.mirror(dict(source, type=source_type, name=name), refresh)
+        if source.get('subdir'):
+            path = path / source['subdir']
+        if not path.is_dir():
+            raise ValueError(f"積木來源 '{name}' 的目錄不存在: {path}")
+        roots.append({
+            'name': name,
+            'type': source_type,
+            'path': str(path),
+            'categories': list(source['categories']) if source.get('categories') else None
+        })
+    return roots
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+建構請求佇列 - 以 asyncio 接收建構請求，合併指紋相同且進行中的請求，並限制全域與每個區域的同時建構數量
+"""
+
+import asyncio
+import hashlib
+import random
+import signal
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from matrix import INTERRUPT_GRACE_SECONDS, prepare_jobs, read_manifest_artifacts
+
+# 未指定區域時使用的預設值，與 block-composer.py 的預設 packer 變數一致
+DEFAULT_REGION = "ap-northeast-1"
+
+
+class FakeBuilder:
+    """
+    不啟動 EC2 的建構替身，等待指定秒數後回傳以指紋產生的固定 AMI ID
+
+    記錄實際建構次數與同時進行的最大數量，用於驗證合併與上限是否生效。
+    """
+
+    def __init__(self, duration: float = 1.0, jitter: float = 0.0, failure_rate: float = 0.0,
+                 seed: int = None):
+        self.duration = duration
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.builds = 0
+        self.running = 0
+        self.max_running = 0
+        self.max_running_by_region: Dict[str, int] = {}
+        self._running_by_region: Dict[str, int] = {}
+
+    async def build(self, build_config: Dict[str, Any]) -> Dict[str, Any]:
+        region = build_config['packer_vars']['region']
+        fingerprint = build_config['build_info']['fingerprint']
+        self.builds += 1
+        self.running += 1
+        self._running_by_region[region] = self._running_by_region.get(region, 0) + 1
+        self.max_running = max(self.max_running, self.running)
+        self.max_running_by_region[region] = max(self.max_running_by_region.get(region, 0),
+                                                 self._running_by_region[region])
+        try:
+            await asyncio.sleep(max(0.0, self.duration + self.random.uniform(-self.jitter, self.jitter)))
+        finally:
+            self.running -= 1
+            self._running_by_region[region] -= 1
+
+        if self.random.random() < self.failure_rate:
+            return {'status': 'failure', 'returncode': 1, 'artifact_id': None}
+        ami_id = "ami-" + hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:17]
+        return {'status': 'success', 'returncode': 0, 'artifact_id': f"{region}:{ami_id}"}
+
+
+class PackerBuilder:
+    """以 packer build 子程序執行建構，每個指紋使用 work_dir 下的專屬目錄（模板產生方式與矩陣建構相同）"""
+
+    def __init__(self, composer, work_dir: str, packer_bin: str = "packer", timeout: float = None,
+                 interrupt_grace: float = INTERRUPT_GRACE_SECONDS):
+        self.composer = composer
+        self.work_dir = Path(work_dir)
+        self.packer_bin = packer_bin
+        self.timeout = timeout
+        self.interrupt_grace = interrupt_grace
+
+    async def build(self, build_config: Dict[str, Any]) -> Dict[str, Any]:
+        fingerprint = build_config['build_info']['fingerprint']
+        job = prepare_jobs(self.composer, [{
+            'id': fingerprint[:16],
+            'environment': build_config['build_info']['environment'],
+            'region': build_config['packer_vars']['region'],
+            'base_block': build_config['blocks']['execution_order'][0],
+            'build_config': build_config
+        }], str(self.work_dir), self.packer_bin)[0]
+
+        job_dir = Path(job['cwd'])
+        log_path = job_dir / "packer.log"
+        manifest_path = job_dir / "packer-manifest.json"
+        if manifest_path.exists():
+            manifest_path.unlink()
+        with open(log_path, 'wb') as log_file:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *job['command'], cwd=str(job_dir), stdout=log_file, stderr=asyncio.subprocess.STDOUT
+                )
+            except OSError as e:
+                log_file.write(f"無法執行 packer: {e}\n".encode('utf-8'))
+                return {'status': 'failure', 'returncode': -2, 'artifact_id': None, 'log': str(log_path)}
+            try:
+                returncode = await asyncio.wait_for(process.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                # 與 matrix.run_packer 相同，先讓 Packer 清理 EC2 資源再強制結束
+                process.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(process.wait(), self.interrupt_grace)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                returncode = -1
+
+        result = {
+            'status': 'success' if returncode == 0 else 'failure',
+            'returncode': returncode,
+            'artifact_id': None,
+            'log': str(log_path)
+        }
+        if returncode == 0 and manifest_path.exists():
+            artifacts = read_manifest_artifacts(manifest_path)
+            result['manifest'] = str(manifest_path)
+            result['artifact_id'] = artifacts[-1].split(',')[0] if artifacts else None
+        return result
+
+
+class BuildBroker:
+    """
+    接收建構請求並合併相同的建構
+
+    請求先經 BlockComposer 產生建構配置，以建構指紋作為正規化後的鍵：積木順序、重複積木
+    與建構名稱不影響指紋。指紋相同的請求共用同一個進行中的建構，完成後結果分送給每個請求者；
+    指定建構索引時，已有相同指紋產物的請求直接回傳既有 AMI。
+    建構先取得區域名額再取得全域名額，避免等待區域名額的建構佔住全域名額。
+    """
+
+    def __init__(self, composer, builder, max_concurrent: int = 4, per_region_limit: int = 2,
+                 region_limits: Dict[str, int] = None, build_index=None):
+        self.composer = composer
+        self.builder = builder
+        self.per_region_limit = per_region_limit
+        self.region_limits = region_limits or {}
+        self.build_index = build_index
+        self.max_concurrent = max_concurrent
+        # 號誌在第一次使用時才建立，確保綁定到執行中的事件迴圈（Python 3.9 以前的行為）
+        self.global_slots: asyncio.Semaphore = None
+        self.region_slots: Dict[str, asyncio.Semaphore] = {}
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.stats = {'requests': 0, 'rejected': 0, 'reused': 0, 'coalesced': 0,
+                      'builds': 0, 'succeeded': 0, 'failed': 0}
+
+    def _region_semaphore(self, region: str) -> asyncio.Semaphore:
+        if region not in self.region_slots:
+            self.region_slots[region] = asyncio.Semaphore(self.region_limits.get(region, self.per_region_limit))
+        return self.region_slots[region]
+
+    def canonicalize(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """將請求轉為建構配置，積木組合無效時拋出 ValueError"""
+        parameters = dict(request.get('parameters') or {})
+        parameters['region'] = request.get('region') or parameters.get('region', DEFAULT_REGION)
+        return self.composer.generate_build_config(
+            build_name=request.get('build_name') or "broker",
+            environment=request.get('environment', 'dev'),
+            selected_blocks=request.get('blocks', []),
+            custom_scripts=request.get('custom_scripts'),
+            parameters=parameters
+        )
+
+    async def _build(self, build_config: Dict[str, Any]) -> Dict[str, Any]:
+        region = build_config['packer_vars']['region']
+        fingerprint = build_config['build_info']['fingerprint']
+        queued_at = time.perf_counter()
+        if self.global_slots is None:
+            self.global_slots = asyncio.Semaphore(self.max_concurrent)
+        async with self._region_semaphore(region):
+            async with self.global_slots:
+                started_at = time.perf_counter()
+                self.stats['builds'] += 1
+                try:
+                    result = dict(await self.builder.build(build_config))
+                except Exception as e:
+                    result = {'status': 'failure', 'returncode': None, 'artifact_id': None, 'error': str(e)}
+        result.update({
+            'fingerprint': fingerprint,
+            'region': region,
+            'queued_seconds': round(started_at - queued_at, 3),
+            'build_seconds': round(time.perf_counter() - started_at, 3)
+        })
+
+        if result['status'] == 'success':
+            self.stats['succeeded'] += 1
+            if self.build_index is not None:
+                if result.get('manifest'):
+                    self.build_index.ingest_manifest(result['manifest'], build_config)
+                elif result.get('artifact_id'):
+                    self.build_index.record(
+                        fingerprint, result['artifact_id'],
+                        enabled_blocks=",".join(build_config['blocks']['enabled']),
+                        environment=build_config['build_info']['environment'],
+                        block_hashes=build_config['build_info']['block_hashes']
+                    )
+        else:
+            self.stats['failed'] += 1
+        return result
+
+    def _release(self, fingerprint: str, future: asyncio.Future):
+        if self.inflight.get(fingerprint) is future:
+            del self.inflight[fingerprint]
+
+    async def submit(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        送出建構請求並等待結果
+
+        回傳的 status 為 success / failure / reused / rejected，coalesced 表示共用了其他請求的建構。
+        請求者取消等待不會中斷共用的建構。
+        """
+        submitted_at = time.perf_counter()
+        self.stats['requests'] += 1
+        request_id = request.get('id', self.stats['requests'])
+        try:
+            build_config = self.canonicalize(request)
+        except ValueError as e:
+            self.stats['rejected'] += 1
+            return {'request_id': request_id, 'status': 'rejected', 'error': str(e),
+                    'coalesced': False, 'wait_seconds': 0.0}
+        fingerprint = build_config['build_info']['fingerprint']
+
+        existing = self.build_index.find(fingerprint) if self.build_index is not None else None
+        if existing:
+            self.stats['reused'] += 1
+            return {'request_id': request_id, 'status': 'reused', 'fingerprint': fingerprint,
+                    'artifact_id': existing.get('artifact_id'), 'region': existing.get('region'),
+                    'coalesced': False, 'wait_seconds': 0.0}
+
+        future = self.inflight.get(fingerprint)
+        coalesced = future is not None
+        if coalesced:
+            self.stats['coalesced'] += 1
+        else:
+            future = asyncio.ensure_future(self._build(build_config))
+            self.inflight[fingerprint] = future
+            future.add_done_callback(lambda done: self._release(fingerprint, done))
+
+        result = await asyncio.shield(future)
+        return dict(result, request_id=request_id, coalesced=coalesced,
+                    wait_seconds=round(time.perf_counter() - submitted_at, 3))
+
+
+async def simulate(broker: BuildBroker, requests: List[Dict[str, Any]],
+                   interval: float = 0.0) -> Dict[str, Any]:
+    """依 interval 秒的間隔依序送出請求，等待全部完成並彙整吞吐量"""
+    started = time.perf_counter()
+
+    async def delayed(index: int, request: Dict[str, Any]):
+        await asyncio.sleep(index * interval)
+        return await broker.submit(dict(request, id=request.get('id', index + 1)))
+
+    results = await asyncio.gather(*(delayed(index, request) for index, request in enumerate(requests)))
+    elapsed = time.perf_counter() - started
+    waits = [result['wait_seconds'] for result in results if result['status'] != 'rejected']
+    return {
+        'requests': len(results),
+        'elapsed_seconds': round(elapsed, 3),
+        'requests_per_second': round(len(results) / elapsed, 2) if elapsed else None,
+        'wait_p50_seconds': round(statistics.median(waits), 3) if waits else None,
+        'wait_max_seconds': round(max(waits), 3) if waits else None,
+        'stats': dict(broker.stats),
+        'results': list(results)
+    }
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+建構時間估算 - 依積木宣告的資源需求與歷史時間剖析，為每種實例類型估算建構時間與費用並挑選實例
+"""
+
+import json
+import re
+import statistics
+from typing import Any, Dict, List
+
+# 實例類型目錄: vCPU、記憶體 (GiB)、相對 t3.micro 的 CPU 速度、每小時費用 (USD，ap-northeast-1 隨需價格)
+# 速度為建構類工作（編譯、解壓、套件安裝）的粗估值，可用 --catalog 以實測值覆蓋
+INSTANCE_CATALOG = {
+    "t3.micro": {"vcpu": 2, "memory_gb": 1, "speed": 1.0, "hourly_usd": 0.0136},
+    "t3.small": {"vcpu": 2, "memory_gb": 2, "speed": 1.1, "hourly_usd": 0.0272},
+    "t3.medium": {"vcpu": 2, "memory_gb": 4, "speed": 1.25, "hourly_usd": 0.0544},
+    "t3.large": {"vcpu": 2, "memory_gb": 8, "speed": 1.35, "hourly_usd": 0.1088},
+    "t3.xlarge": {"vcpu": 4, "memory_gb": 16, "speed": 2.3, "hourly_usd": 0.2176},
+    "c5.large": {"vcpu": 2, "memory_gb": 4, "speed": 1.6, "hourly_usd": 0.107},
+    "c5.xlarge": {"vcpu": 4, "memory_gb": 8, "speed": 3.0, "hourly_usd": 0.214}
+}
+
+# gp3 根磁碟的吞吐量選項 (MB/s)；超過 125 MB/s 的部分每 MB/s 每月 0.048 USD
+VOLUME_THROUGHPUTS = (125, 250, 500)
+GP3_BASELINE_THROUGHPUT = 125
+GP3_THROUGHPUT_USD_PER_MONTH = 0.048
+HOURS_PER_MONTH = 730
+
+# 估算基準: 沒有標示實例類型的歷史剖析視為在此實例與 gp3 基準吞吐量下量測
+REFERENCE_INSTANCE = "t3.micro"
+
+# 沒有歷史資料時每個腳本步驟的預估秒數，以及 Packer 啟動/建立 AMI 的預估秒數
+DEFAULT_STEP_SECONDS = 60
+DEFAULT_OVERHEAD_SECONDS = {"launch": 120, "finalize": 300}
+
+# 未宣告 resources.cpu_weight / io_weight 時，建構時間中受 CPU 與磁碟影響的比例
+DEFAULT_CPU_WEIGHT = 0.5
+DEFAULT_IO_WEIGHT = 0.2
+
+_SIZE_RE = re.compile(r'^\s*([\d.]+)\s*([KMGT]i?B?)?\s*$', re.IGNORECASE)
+_SIZE_UNITS = {"K": 1 / 1024 / 1024, "M": 1 / 1024, "G": 1, "T": 1024}
+
+
+def parse_size_gb(value: Any) -> float:
+    """將 "2GB"、"512MB"、"10GiB" 或數字（GB）轉成 GB"""
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _SIZE_RE.match(str(value))
+    if not match:
+        raise ValueError(f"無法解析容量 '{value}'")
+    unit = (match.group(2) or "G")[0].upper()
+    return float(match.group(1)) * _SIZE_UNITS[unit]
+
+
+def load_catalog(path: str = None) -> Dict[str, Dict[str, Any]]:
+    """讀取實例類型目錄，檔案中的項目會覆蓋或補充內建目錄"""
+    catalog = {name: dict(spec) for name, spec in INSTANCE_CATALOG.items()}
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            for name, spec in json.load(f).items():
+                catalog[name] = dict(catalog.get(name, {}), **spec)
+    return catalog
+
+
+def _scale_factor(resources: Dict[str, Any], instance: Dict[str, Any],
+                  reference: Dict[str, Any], throughput: int,
+                  reference_throughput: int = GP3_BASELINE_THROUGHPUT) -> float:
+    """積木在指定實例上的耗時相對於基準實例的倍數"""
+    cpu_weight = float(resources.get('cpu_weight', DEFAULT_CPU_WEIGHT))
+    io_weight = float(resources.get('io_weight', DEFAULT_IO_WEIGHT))
+    fixed_weight = max(0.0, 1.0 - cpu_weight - io_weight)
+    return (fixed_weight
+            + cpu_weight * reference['speed'] / instance['speed']
+            + io_weight * reference_throughput / throughput)
+
+
+def block_baselines(blocks: List[Dict[str, Any]], history: List[Dict[str, Any]],
+                    catalog: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """
+    以歷史剖析的中位數推算每個積木在基準實例上的耗時
+
+    剖析檔標示了 instance_type / volume_throughput 時先換算回基準實例。
+    沒有歷史資料的積木使用 resources.estimated_seconds，或以腳本步驟數估算。
+    """
+    reference = catalog[REFERENCE_INSTANCE]
+    baselines = {}
+    for block in blocks:
+        resources = block.get('resources') or {}
+        samples = []
+        for profile in history:
+            seconds = profile.get('blocks', {}).get(block['id'], {}).get('seconds')
+            if seconds is None:
+                continue
+            instance = catalog.get(profile.get('instance_type', REFERENCE_INSTANCE), reference)
+            throughput = profile.get('volume_throughput', GP3_BASELINE_THROUGHPUT)
+            samples.append(seconds / _scale_factor(resources, instance, reference, throughput))
+        if samples:
+            baselines[block['id']] = {'seconds': statistics.median(samples), 'source': 'history',
+                                      'samples': len(samples)}
+        elif resources.get('estimated_seconds'):
+            baselines[block['id']] = {'seconds': float(resources['estimated_seconds']), 'source': 'declared',
+                                      'samples': 0}
+        else:
+            baselines[block['id']] = {'seconds': DEFAULT_STEP_SECONDS * max(block.get('steps', 1), 1),
+                                      'source': 'default', 'samples': 0}
+    return baselines
+
+
+def estimate_overhead(history: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Packer 啟動實例與建立 AMI 的耗時與實例類型無關，取歷史中位數"""
+    overhead = dict(DEFAULT_OVERHEAD_SECONDS)
+    for segment in overhead:
+        samples = [p['overhead'][segment] for p in history if segment in p.get('overhead', {})]
+        if samples:
+            overhead[segment] = statistics.median(samples)
+    return overhead
+
+
+def estimate_builds(blocks: List[Dict[str, Any]], history: List[Dict[str, Any]] = None,
+                    catalog: Dict[str, Dict[str, Any]] = None,
+                    throughputs=VOLUME_THROUGHPUTS) -> List[Dict[str, Any]]:
+    """
+    估算每種實例類型與磁碟吞吐量組合的建構時間與費用
+
+    blocks 為 [{'id', 'steps', 'resources'}]，依 resources.min_memory 排除記憶體不足的實例，
+    根磁碟大小取各積木 min_disk 的最大值。回傳依費用排序的估算結果。
+    """
+    history = history or []
+    catalog = catalog or INSTANCE_CATALOG
+    reference = catalog[REFERENCE_INSTANCE]
+    baselines = block_baselines(blocks, history, catalog)
+    overhead_seconds = sum(estimate_overhead(history).values())
+    min_memory = max((parse_size_gb((b.get('resources') or {}).get('min_memory')) for b in blocks), default=0)
+    min_disk = max((parse_size_gb((b.get('resources') or {}).get('min_disk')) for b in blocks), default=0)
+
+    estimates = []
+    for instance_type, instance in sorted(catalog.items()):
+        if instance['memory_gb'] < min_memory:
+            continue
+        for throughput in throughputs:
+            block_seconds = {
+                block['id']: baselines[block['id']]['seconds'] * _scale_factor(
+                    block.get('resources') or {}, instance, reference, throughput
+                )
+                for block in blocks
+            }
+            total_seconds = overhead_seconds + sum(block_seconds.values())
+            hours = total_seconds / 3600
+            volume_usd = (throughput - GP3_BASELINE_THROUGHPUT) * GP3_THROUGHPUT_USD_PER_MONTH / HOURS_PER_MONTH
+            estimates.append({
+                'instance_type': instance_type,
+                'volume_throughput': throughput,
+                'root_volume_size': int(min_disk) if min_disk else None,
+                'seconds': round(total_seconds, 1),
+                'cost_usd': round(hours * (instance['hourly_usd'] + volume_usd), 5),
+                'blocks': {block_id: round(seconds, 1) for block_id, seconds in block_seconds.items()}
+            })
+    estimates.sort(key=lambda e: (e['cost_usd'], e['seconds']))
+    return estimates
+
+
+def choose_instance(estimates: List[Dict[str, Any]], target_seconds: float = None) -> Dict[str, Any]:
+    """
+    挑選在目標時間內完成且費用最低的組合
+
+    沒有任何組合能達成目標時改選最快的組合；未指定目標時選最便宜的組合。
+    """
+    if not estimates:
+        raise ValueError("沒有符合記憶體需求的實例類型")
+    if target_seconds is None:
+        return dict(estimates[0], meets_target=True)
+    within = [e for e in estimates if e['seconds'] <= target_seconds]
+    if within:
+        return dict(within[0], meets_target=True)
+    return dict(min(estimates, key=lambda e: (e['seconds'], e['cost_usd'])), meets_target=False)
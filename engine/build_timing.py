@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""
+建構時間分析 - 串流解析 packer -machine-readable 輸出，將耗時歸屬到每個積木與腳本
+"""
+
+import json
+import re
+import statistics
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TIMING_PROFILE_FILE = "packer-timing.json"
+
+# 歷史剖析的檔案或目錄（以 os.pathsep 分隔），供 instance_type 為 auto 的建構配置挑選實例
+TIMING_HISTORY_ENV = "BLOCK_TIMING_HISTORY"
+
+# Packer machine-readable 輸出的跳脫字元
+_ESCAPES = (("%!(PACKER_COMMA)", ","), ("\\n", "\n"), ("\\r", "\r"))
+
+_PROVISIONING_RE = re.compile(r"Provisioning with shell script: (\S+)")
+_UPLOAD_RE = re.compile(r"Uploading (\S+) =>")
+_BUNDLE_MARKER_RE = re.compile(r"==> \[(\d+)/(\d+)\] (\S+): (\S+) (開始|完成|失敗)")
+
+# 不屬於任何積木的建構階段
+LAUNCH_SEGMENT = ("packer", "launch")
+FINALIZE_SEGMENT = ("packer", "finalize")
+UNKNOWN_STEP = "inline"
+UPLOAD_SEGMENT = ("packer", "upload")
+
+
+def parse_machine_readable_line(line: str) -> Optional[Tuple[int, str, str, List[str]]]:
+    """解析一行 machine-readable 輸出，回傳 (timestamp, target, type, data)"""
+    parts = line.rstrip("\n").split(",")
+    if len(parts) < 3 or not parts[0].isdigit():
+        return None
+
+    data = parts[3:]
+    for index, value in enumerate(data):
+        for escaped, plain in _ESCAPES:
+            value = value.replace(escaped, plain)
+        data[index] = value
+    return int(parts[0]), parts[1], parts[2], data
+
+
+class TimingProfiler:
+    """
+    以固定大小的狀態累計每個 (積木, 步驟) 的耗時
+
+    只保存目前進行中的區段與累計結果，記憶體用量與日誌長度無關。
+    並行執行器的腳本包標記可能重疊，每個 (積木, 步驟) 各自從開始標記計時到完成標記。
+    """
+
+    def __init__(self, plan_steps: List[Dict[str, Any]]):
+        self.script_index = {}
+        for step in plan_steps:
+            if 'script' in step:
+                self.script_index.setdefault(Path(step['script']).name, []).append(step)
+                self.script_index[step['script']] = [step]
+        self.durations: Dict[Tuple[str, str], float] = {}
+        self.order: List[Tuple[str, str]] = []
+        self.started_at = None
+        self.last_timestamp = None
+        self.current = None
+        self.current_started = None
+        self.active: Dict[Tuple[str, str], int] = {}
+        self.failed_step = None
+        self.lines = 0
+
+    def _lookup_script(self, path: str) -> Tuple[str, str]:
+        """以完整路徑或檔名對應到執行計畫中的積木步驟"""
+        candidates = self.script_index.get(path) or self.script_index.get(Path(path).name, [])
+        # 同檔名的腳本（例如 install.sh）依序指派給尚未計時的步驟
+        for step in candidates:
+            key = (step['block'], step['step'])
+            # 進行中的步驟尚未寫入 durations，同樣視為已計時
+            if key not in self.durations and key != self.current:
+                return key
+        if candidates:
+            return candidates[-1]['block'], candidates[-1]['step']
+        return "packer", UNKNOWN_STEP
+
+    def _add_duration(self, segment: Tuple[str, str], seconds: float):
+        if segment not in self.durations:
+            self.durations[segment] = 0.0
+            self.order.append(segment)
+        self.durations[segment] += seconds
+
+    def _close_active(self, timestamp: int):
+        """結束所有未收到完成標記的腳本包步驟（例如連線中斷）"""
+        for segment, started in self.active.items():
+            self._add_duration(segment, max(0, timestamp - started))
+        self.active = {}
+
+    def _switch(self, segment: Optional[Tuple[str, str]], timestamp: int):
+        """結束目前的區段並開始新的區段"""
+        if segment is not None:
+            self._close_active(timestamp)
+        if self.current is not None:
+            self._add_duration(self.current, max(0, timestamp - self.current_started))
+        self.current = segment
+        self.current_started = timestamp
+
+    def feed(self, line: str):
+        """處理一行輸出"""
+        parsed = parse_machine_readable_line(line)
+        if not parsed:
+            return
+        timestamp, _, message_type, data = parsed
+        self.lines += 1
+        if self.started_at is None:
+            self.started_at = timestamp
+            self._switch(LAUNCH_SEGMENT, timestamp)
+        self.last_timestamp = timestamp
+
+        if message_type != "ui" or len(data) < 2:
+            return
+        message = data[1]
+
+        marker = _BUNDLE_MARKER_RE.search(message)
+        if marker:
+            _, _, block_id, step_name, state = marker.groups()
+            segment = (block_id, step_name)
+            if state == "開始":
+                if not self.active:
+                    self._switch(None, timestamp)
+                self.active[segment] = timestamp
+                return
+            if state == "失敗" and self.failed_step is None:
+                self.failed_step = segment
+            started = self.active.pop(segment, None)
+            if started is not None:
+                self._add_duration(segment, max(0, timestamp - started))
+            if not self.active:
+                self._switch(FINALIZE_SEGMENT, timestamp)
+            return
+
+        provisioning = _PROVISIONING_RE.search(message)
+        if provisioning:
+            self._switch(self._lookup_script(provisioning.group(1)), timestamp)
+            return
+
+        if _UPLOAD_RE.search(message):
+            self._switch(UPLOAD_SEGMENT, timestamp)
+            return
+
+        if "Stopping the source instance" in message or "Creating AMI" in message:
+            self._switch(FINALIZE_SEGMENT, timestamp)
+
+    def finish(self) -> Dict[str, Any]:
+        """結束分析並產生時間剖析結果"""
+        if self.last_timestamp is not None:
+            self._close_active(self.last_timestamp)
+            self._switch(None, self.last_timestamp)
+
+        blocks: Dict[str, Dict[str, Any]] = {}
+        overhead = {}
+        for block_id, step_name in self.order:
+            seconds = self.durations[(block_id, step_name)]
+            if block_id == "packer":
+                overhead[step_name] = overhead.get(step_name, 0) + seconds
+                continue
+            block = blocks.setdefault(block_id, {'seconds': 0.0, 'steps': {}})
+            block['seconds'] += seconds
+            block['steps'][step_name] = block['steps'].get(step_name, 0) + seconds
+
+        total = (self.last_timestamp - self.started_at) if self.started_at is not None else 0
+        return {
+            'started_at': self.started_at,
+            'finished_at': self.last_timestamp,
+            'total_seconds': total,
+            'lines': self.lines,
+            'failed_step': list(self.failed_step) if self.failed_step else None,
+            'blocks': blocks,
+            'overhead': overhead
+        }
+
+
+def profile_log(lines: Iterable[str], plan_steps: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """串流處理整份日誌並回傳時間剖析結果"""
+    profiler = TimingProfiler(plan_steps)
+    for line in lines:
+        profiler.feed(line)
+    return profiler.finish()
+
+
+def write_timing_profile(profile: Dict[str, Any], manifest_path: str) -> Path:
+    """將時間剖析結果寫在 packer-manifest.json 旁"""
+    output_path = Path(manifest_path).parent / TIMING_PROFILE_FILE
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, indent=2, ensure_ascii=False)
+    return output_path
+
+
+def compare_profiles(current: Dict[str, Any], history: List[Dict[str, Any]],
+                     threshold: float = 0.25, min_seconds: float = 30) -> List[Dict[str, Any]]:
+    """
+    將本次剖析與歷史剖析的中位數比較，回傳變慢的積木
+
+    耗時超過中位數 (1 + threshold) 倍且增加至少 min_seconds 秒才視為退化。
+    """
+    regressions = []
+    for block_id, block in sorted(current.get('blocks', {}).items()):
+        samples = [
+            profile['blocks'][block_id]['seconds']
+            for profile in history if block_id in profile.get('blocks', {})
+        ]
+        if not samples:
+            continue
+        baseline = statistics.median(samples)
+        delta = block['seconds'] - baseline
+        if block['seconds'] > baseline * (1 + threshold) and delta >= min_seconds:
+            regressions.append({
+                'block': block_id,
+                'seconds': block['seconds'],
+                'baseline_seconds': baseline,
+                'delta_seconds': delta,
+                'samples': len(samples)
+            })
+    return regressions
+
+
+def load_profiles(paths: Iterable[str], exclude: str = None) -> List[Dict[str, Any]]:
+    """讀取多個歷史剖析檔案，目錄會展開為其中所有的 .json 檔，exclude 為要略過的檔案"""
+    excluded = Path(exclude).resolve() if exclude else None
+    profiles = []
+    for path in paths:
+        path = Path(path)
+        files = sorted(path.rglob("*.json")) if path.is_dir() else [path]
+        for file_path in files:
+            if excluded and file_path.resolve() == excluded:
+                continue
+            try:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if isinstance(profile, dict) and 'blocks' in profile:
+                profiles.append(profile)
+    return profiles
@@ -60,6 +60,13 @@ variable "blocks_path" {
   default     = "../blocks"
 }
 
+# 建構指紋（由 block-composer.py 計算，用於辨識重複建構）
+variable "build_fingerprint" {
+  type        = string
+  default     = ""
+  description = "Deterministic build fingerprint from block-composer.py"
+}
+
 # OS 家族識別（從基礎積木推斷）
 variable "os_family" {
   type        = string
@@ -67,6 +74,19 @@ variable "os_family" {
   description = "OS family (debian, rhel, amazon-linux) - auto-detected from base block"
 }
 
+# 根磁碟設定（instance_type 為 auto 時由 block-composer.py 依估算結果傳入，0 表示沿用來源 AMI 的設定）
+variable "root_volume_size" {
+  type        = number
+  default     = 0
+  description = "Root volume size in GiB (0 keeps the source AMI setting)"
+}
+
+variable "root_volume_throughput" {
+  type        = number
+  default     = 0
+  description = "gp3 root volume throughput in MB/s (0 keeps the source AMI setting)"
+}
+
 # 動態生成 AMI 名稱和 OS 偵測
 locals {
   timestamp   = formatdate("YYYYMMDD-HHmmss", timestamp())
@@ -80,6 +100,8 @@ locals {
     contains(var.enabled_blocks, "base-rhel-8") || contains(var.enabled_blocks, "base-centos-8") ? "rhel" :
     "debian" # 預設值
   )
+
+  root_device_name = local.os_family == "amazon-linux" ? "/dev/xvda" : "/dev/sda1"
 }
 
 # AMI 來源配置
@@ -91,6 +113,19 @@ source "amazon-ebs" "dynamic" {
   ssh_username  = var.ssh_username
   ssh_timeout   = "20m"
 
+  # 自動挑選實例時一併設定根磁碟容量與 gp3 吞吐量
+  dynamic "launch_block_device_mappings" {
+    for_each = var.root_volume_throughput > 0 ? [1] : []
+    content {
+      device_name           = local.root_device_name
+      volume_type           = "gp3"
+      volume_size           = var.root_volume_size
+      throughput            = var.root_volume_throughput
+      iops                  = 3000
+      delete_on_termination = true
+    }
+  }
+
   tags = {
     Name           = local.ami_name
     Environment    = var.env
@@ -231,6 +266,7 @@ build {
       build_type     = "dynamic"
       enabled_blocks = join(",", var.enabled_blocks)
       owner          = var.owner
+      fingerprint    = var.build_fingerprint
       build_time     = timestamp()
     }
   }
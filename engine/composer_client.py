@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+組合器常駐服務客戶端 - 只依賴標準函式庫的輕量模組，不載入 yaml 與組合器，透過 Unix socket 呼叫常駐服務
+"""
+
+import json
+import os
+import socket
+import sys
+from typing import Any, Dict, List
+
+# 指定常駐服務 socket 位置的環境變數
+SOCKET_ENV = "BLOCK_COMPOSER_SOCKET"
+
+# 等待單一請求回應的秒數
+REQUEST_TIMEOUT = 60
+
+
+def default_socket_path() -> str:
+    """常駐服務 socket 的預設位置，依序為 $BLOCK_COMPOSER_SOCKET、$XDG_RUNTIME_DIR、/tmp"""
+    if os.environ.get(SOCKET_ENV):
+        return os.environ[SOCKET_ENV]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return os.path.join(runtime_dir, "block-composer.sock")
+    return f"/tmp/block-composer-{os.getuid()}.sock"
+
+
+class ComposerClient:
+    """
+    以換行分隔的 JSON-RPC 2.0 呼叫常駐服務，同一個連線可連續送出多個請求
+
+    常駐服務未啟動時連線會拋出 OSError；服務回傳錯誤時拋出 ValueError。
+    """
+
+    def __init__(self, socket_path: str = None, timeout: float = REQUEST_TIMEOUT):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self.connection = None
+        self.reader = None
+        self.next_id = 1
+
+    def _connect(self):
+        if self.connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                raise
+            self.connection = connection
+            self.reader = connection.makefile('rb')
+
+    def call(self, method: str, **params) -> Any:
+        """呼叫常駐服務的方法並回傳 result"""
+        self._connect()
+        request_id = self.next_id
+        self.next_id += 1
+        request = {'jsonrpc': '2.0', 'id': request_id, 'method': method, 'params': params}
+        self.connection.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+        line = self.reader.readline()
+        if not line:
+            self.close()
+            raise ConnectionError("常駐服務已關閉連線")
+        response = json.loads(line)
+        if 'error' in response:
+            raise ValueError(response['error'].get('message', '常駐服務回傳錯誤'))
+        return response.get('result')
+
+    def close(self):
+        if self.connection is not None:
+            self.reader.close()
+            self.connection.close()
+            self.connection = None
+            self.reader = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _parse_args(argv: List[str]) -> Dict[str, Any]:
+    """解析 [--socket <路徑>] [--params <JSON>] <方法> [積木...]，不使用 argparse 以維持啟動速度"""
+    options = {'socket': None, 'params': {}, 'method': None, 'blocks': []}
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        if arg in ("--socket", "--params") and args:
+            value = args.pop(0)
+            options[arg[2:]] = json.loads(value) if arg == "--params" else value
+        elif options['method'] is None:
+            options['method'] = arg
+        else:
+            options['blocks'].append(arg)
+    return options
+
+
+def main(argv: List[str] = None) -> int:
+    options = _parse_args(sys.argv[1:] if argv is None else argv)
+    if not options['method']:
+        print("用法: composer_client.py [--socket <path>] [--params <json>] "
+              "<validate|compose|packer-command|preflight|query|stats|reload|ping|shutdown> [block...]")
+        return 1
+
+    params = dict(options['params'])
+    if options['blocks']:
+        params['blocks'] = options['blocks']
+    try:
+        with ComposerClient(options['socket']) as client:
+            result = client.call(options['method'], **params)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    except OSError as e:
+        print(f"❌ 無法連線到常駐服務 {options['socket'] or default_socket_path()}: {e}")
+        print("   請先執行: python3 block-composer.py serve")
+        return 2
+
+    if options['method'] == "packer-command":
+        print(result['command'])
+    else:
+        print(json.dumps(result, indent=2, ensure_ascii=False))
+    if isinstance(result, dict) and result.get('valid') is False:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+"""
+組合器常駐服務 - 以 Unix socket 提供 JSON-RPC 介面，重複使用已載入的積木註冊表，block.yaml 變更時增量重新載入
+"""
+
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict
+
+from composer_client import default_socket_path
+
+# 兩次檢查 block.yaml 是否變更的最短間隔秒數（檢查只比對 mtime/size，變更的檔案才重新解析）
+RELOAD_INTERVAL = 1.0
+
+# 每個方法保留最近多少筆延遲樣本
+LATENCY_WINDOW = 1024
+
+# 單一請求的大小上限
+MAX_REQUEST_BYTES = 1 << 20
+
+# JSON-RPC 2.0 錯誤代碼
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+def _percentile(samples: list, fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class LatencyStats:
+    """記錄每個方法的請求數、錯誤數與最近 window 筆的延遲分佈"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, method: str, seconds: float, ok: bool):
+        self.samples.setdefault(method, deque(maxlen=self.window)).append(seconds * 1000)
+        self.counts[method] = self.counts.get(method, 0) + 1
+        if not ok:
+            self.errors[method] = self.errors.get(method, 0) + 1
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            method: {
+                'count': self.counts[method],
+                'errors': self.errors.get(method, 0),
+                'p50_ms': round(_percentile(samples, 0.5), 3),
+                'p95_ms': round(_percentile(samples, 0.95), 3),
+                'p99_ms': round(_percentile(samples, 0.99), 3),
+                'max_ms': round(max(samples), 3)
+            }
+            for method, samples in sorted(self.samples.items())
+        }
+
+
+class ComposerService:
+    """
+    將 JSON-RPC 方法對應到 BlockComposer
+
+    組合器不是執行緒安全的，所有請求以同一把鎖依序處理；
+    處理請求前若距上次檢查超過 reload_interval，先以 reload() 增量載入變更的 block.yaml。
+    """
+
+    def __init__(self, composer, reload_interval: float = RELOAD_INTERVAL):
+        self.composer = composer
+        self.reload_interval = reload_interval
+        self.lock = threading.Lock()
+        self.latency = LatencyStats()
+        self.started_at = time.time()
+        self.last_reload = time.monotonic()
+        self.reload_stats = {'checks': 0, 'changed': 0, 'last_changed_at': None}
+        self.on_shutdown: Callable[[], None] = None
+        self.methods: Dict[str, Callable[..., Any]] = {
+            'ping': self.ping,
+            'validate': self.validate,
+            'compose': self.compose,
+            'packer-command': self.packer_command,
+            'preflight': self.preflight,
+            'query': self.query,
+            'reload': self.reload,
+            'stats': self.stats,
+            'shutdown': self.shutdown
+        }
+
+    def _reload_if_due(self, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and now - self.last_reload < self.reload_interval:
+            return False
+        self.last_reload = now
+        self.reload_stats['checks'] += 1
+        changed = self.composer.reload()
+        if changed:
+            self.reload_stats['changed'] += 1
+            self.reload_stats['last_changed_at'] = time.time()
+        return changed
+
+    def ping(self) -> Dict[str, Any]:
+        return {'pong': True, 'registry_version': self.composer.registry_version}
+
+    def validate(self, blocks: list) -> Dict[str, Any]:
+        return self.composer.validate_dependencies_cached(blocks)
+
+    def compose(self, blocks: list, build_name: str = "dynamic", environment: str = "dev",
+                custom_scripts: list = None, parameters: dict = None) -> Dict[str, Any]:
+        return self.composer.generate_build_config(
+            build_name=build_name,
+            environment=environment,
+            selected_blocks=blocks,
+            custom_scripts=custom_scripts,
+            parameters=parameters
+        )
+
+    def packer_command(self, blocks: list, template: str = "builder.pkr.hcl", **options) -> Dict[str, Any]:
+        config = self.compose(blocks, **options)
+        return {'command': self.composer.generate_packer_command(config, template)}
+
+    def preflight(self, blocks: list, parameters: dict = None, custom_scripts: list = None) -> Dict[str, Any]:
+        return self.composer.preflight(blocks, parameters, custom_scripts)
+
+    def query(self, category: Any = None, tags: list = (), os_family: str = None, os_version: str = None,
+              provides: list = (), requires: list = ()) -> Dict[str, Any]:
+        blocks = self.composer.query_blocks(category, tags, os_family, os_version, provides, requires)
+        return {'count': len(blocks), 'blocks': blocks}
+
+    def reload(self) -> Dict[str, Any]:
+        changed = self._reload_if_due(force=True)
+        return {'changed': changed, 'registry_version': self.composer.registry_version,
+                'load_stats': self.composer.load_stats}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'uptime_seconds': round(time.time() - self.started_at, 1),
+            'pid': os.getpid(),
+            'registry_version': self.composer.registry_version,
+            'blocks': len(self.composer.blocks_registry),
+            'reloads': dict(self.reload_stats),
+            'load_stats': self.composer.load_stats,
+            'validation_cache': dict(self.composer.validation_cache_stats),
+            'requests': self.latency.summary()
+        }
+
+    def shutdown(self) -> Dict[str, Any]:
+        if self.on_shutdown:
+            self.on_shutdown()
+        return {'stopping': True}
+
+    def handle_request(self, request: Any) -> Dict[str, Any]:
+        """處理單一 JSON-RPC 請求並回傳回應"""
+        if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+            return _error_response(None, INVALID_REQUEST, "請求必須是包含 method 的物件")
+        request_id = request.get('id')
+        method = request['method']
+        handler = self.methods.get(method)
+        if handler is None:
+            return _error_response(request_id, METHOD_NOT_FOUND, f"未知的方法 '{method}'")
+        params = request.get('params') or {}
+        if not isinstance(params, dict):
+            return _error_response(request_id, INVALID_PARAMS, "params 必須是物件")
+
+        started = time.perf_counter()
+        ok = False
+        with self.lock:
+            try:
+                if method not in ('reload', 'stats', 'shutdown'):
+                    self._reload_if_due()
+                result = handler(**params)
+                ok = True
+            except TypeError as e:
+                response = _error_response(request_id, INVALID_PARAMS, f"參數錯誤: {e}")
+            except (ValueError, KeyError, OSError) as e:
+                response = _error_response(request_id, SERVER_ERROR, str(e))
+            except Exception as e:
+                # 單一請求的錯誤不應中斷常駐服務
+                response = _error_response(request_id, SERVER_ERROR, f"{type(e).__name__}: {e}")
+            finally:
+                self.latency.record(method, time.perf_counter() - started, ok)
+        if ok:
+            response = {'jsonrpc': '2.0', 'id': request_id, 'result': result}
+        return response
+
+    def handle_line(self, line: bytes) -> Dict[str, Any]:
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            return _error_response(None, PARSE_ERROR, f"無法解析請求: {e}")
+        return self.handle_request(request)
+
+
+def _error_response(request_id: Any, code: int, message: str) -> Dict[str, Any]:
+    return {'jsonrpc': '2.0', 'id': request_id, 'error': {'code': code, 'message': message}}
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """每行一個請求，同一連線可連續送出多個請求"""
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST_BYTES + 1)
+            if not line:
+                return
+            if len(line) > MAX_REQUEST_BYTES:
+                response = _error_response(None, INVALID_REQUEST, "請求超過大小上限")
+            elif not line.strip():
+                continue
+            else:
+                response = self.server.service.handle_line(line)
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+
+def _claim_socket(socket_path: str):
+    """移除前一次未正常結束留下的 socket 檔，若已有服務在監聽則拋出 RuntimeError"""
+    if not os.path.exists(socket_path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"已有常駐服務在 {socket_path} 監聽")
+
+
+class ComposerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket 伺服器，socket 檔只允許目前使用者存取"""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, service: ComposerService):
+        self.service = service
+        self.socket_path = socket_path
+        _claim_socket(socket_path)
+        previous_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(previous_umask)
+        # 在另一個執行緒呼叫 shutdown()，避免處理 shutdown 請求的執行緒等待自己
+        service.on_shutdown = lambda: threading.Thread(target=self.shutdown, daemon=True).start()
+
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+def serve(composer, socket_path: str = None, reload_interval: float = RELOAD_INTERVAL,
+          on_ready: Callable[[str], None] = None):
+    """啟動常駐服務直到收到 shutdown 請求、SIGTERM 或 SIGINT"""
+    socket_path = socket_path or default_socket_path()
+    server = ComposerServer(socket_path, ComposerService(composer, reload_interval))
+
+    def stop(signum, frame):
+        server.service.on_shutdown()
+
+    previous_handlers = {sig: signal.signal(sig, stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        if on_ready:
+            on_ready(socket_path)
+        server.serve_forever()
+    finally:
+        server.server_close()
+        for sig, handler in previous_handlers.items():
+            signal.signal(sig, handler)
+    return server.service.stats()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+變更影響分析 - 將變更的檔案對應到積木，沿 provides/requires 傳播，找出需要重建的建構定義與 AMI
+"""
+
+import json
+import subprocess
+from collections import deque
+from pathlib import Path
+from typing import Any, Dict, Iterable, List
+
+# 影響所有建構產物的引擎檔案（相對於倉庫根目錄），變更時所有建構都需要重建
+GLOBAL_FILES = (
+    "engine/packer_template.py",
+    "engine/script_bundle.py",
+    "engine/package_plan.py",
+    "engine/package_cache.py"
+)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def changed_files_from_git(revision_range: str, repo_dir: str = None) -> List[str]:
+    """
+    以 git diff --name-only 取得變更的檔案，回傳絕對路徑
+
+    revision_range 可為 "A..B"，或單一 revision（與目前工作目錄比較）。
+    """
+    cwd = str(repo_dir or REPO_ROOT)
+    top = subprocess.run(["git", "rev-parse", "--show-toplevel"], cwd=cwd,
+                         capture_output=True, text=True)
+    diff = subprocess.run(["git", "diff", "--name-only", revision_range], cwd=cwd,
+                          capture_output=True, text=True)
+    if top.returncode != 0 or diff.returncode != 0:
+        raise ValueError(f"無法取得 {revision_range} 的變更: {(diff.stderr or top.stderr).strip()}")
+    root = Path(top.stdout.strip())
+    return [str(root / line) for line in diff.stdout.splitlines() if line.strip()]
+
+
+def map_files_to_blocks(composer, files: Iterable[str]) -> Dict[str, Any]:
+    """
+    將檔案對應到所屬的積木目錄，回傳 {'blocks': {積木: [檔案]}, 'global': [...], 'unmapped': [...]}
+
+    相對路徑一律視為相對於 repo 根目錄（與 git diff --name-only 的輸出一致），不受目前工作目錄影響。
+    """
+    block_dirs = {
+        Path(block_info['path']).resolve(): block_id
+        for block_id, block_info in composer.blocks_registry.items()
+    }
+    global_files = {(REPO_ROOT / name).resolve() for name in GLOBAL_FILES}
+    result = {'blocks': {}, 'global': [], 'unmapped': []}
+    for file_path in files:
+        path = Path(file_path)
+        if not path.is_absolute():
+            path = REPO_ROOT / path
+        path = path.resolve()
+        if path in global_files:
+            result['global'].append(str(path))
+            continue
+        block_id = next((block_dirs[parent] for parent in path.parents if parent in block_dirs), None)
+        if block_id:
+            result['blocks'].setdefault(block_id, []).append(str(path))
+        else:
+            result['unmapped'].append(str(path))
+    return result
+
+
+def propagate_dependents(composer, changed_blocks: Iterable[str],
+                         within: Iterable[str] = None) -> Dict[str, str]:
+    """
+    沿 provides/requires 找出依賴變更積木的所有積木，回傳 {積木: 來源變更積木}
+
+    提供者變更可能改變消費者的安裝結果（例如套件或設定檔位置），因此消費者一併視為受影響。
+    指定 within 時只在該積木組合內傳播，例如基礎積木變更只影響以它為基礎的建構。
+    """
+    candidates = set(within) if within is not None else set(composer.blocks_registry)
+    dependents = {}
+    for block_id in candidates:
+        block_info = composer.blocks_registry.get(block_id)
+        if not block_info:
+            continue
+        for feature in block_info.get('requires', []):
+            for provider_id in composer.feature_index.get(feature, ()):
+                if provider_id != block_id and provider_id in candidates:
+                    dependents.setdefault(provider_id, []).append(block_id)
+
+    impacted = {}
+    queue = deque()
+    for block_id in changed_blocks:
+        if block_id in candidates and block_id not in impacted:
+            impacted[block_id] = block_id
+            queue.append(block_id)
+    while queue:
+        block_id = queue.popleft()
+        for consumer_id in sorted(dependents.get(block_id, ())):
+            if consumer_id not in impacted:
+                impacted[consumer_id] = impacted[block_id]
+                queue.append(consumer_id)
+    return impacted
+
+
+def load_build_definitions(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    讀取建構定義，回傳 [{'name', 'path', 'selections'}]
+
+    支援矩陣規格（blocks + base_blocks，每個基礎積木一組）與模板（blocks.enabled）。
+    """
+    definitions = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+        blocks = spec.get('blocks', [])
+        if isinstance(blocks, dict):
+            blocks = blocks.get('enabled', [])
+        name = spec.get('name') or spec.get('template_info', {}).get('id') or Path(path).stem
+        base_blocks = spec.get('base_blocks')
+        if base_blocks:
+            selections = [[base_block] + [b for b in blocks if b not in base_blocks] for base_block in base_blocks]
+        else:
+            selections = [list(blocks)]
+        definitions.append({'name': name, 'path': str(path), 'selections': selections})
+    return definitions
+
+
+def analyze_impact(composer, changed_files: Iterable[str],
+                   definitions: List[Dict[str, Any]] = None, build_index=None) -> Dict[str, Any]:
+    """
+    分析變更影響，回傳受影響的積木、需要重建的建構定義與過期的 AMI
+
+    每個建構只在自己的積木組合內傳播。中間層 AMI 快取以執行順序的前綴為鍵，第一個受影響的積木
+    之後的前綴雜湊都會改變，因此 rerun_blocks 為 execution_order 中從第一個受影響的位置起的所有積木
+    （之前未受影響的前綴可由快取直接提供）。
+    建構索引中記錄了 block_hashes 的產物會另外與目前的積木內容比對，
+    即使不在變更清單中，內容不同或積木已不存在的產物也會列為過期。
+    """
+    mapping = map_files_to_blocks(composer, changed_files)
+    changed_blocks = set(mapping['blocks'])
+    global_change = bool(mapping['global'])
+
+    stale_definitions = []
+    for definition in definitions or []:
+        for selection in definition['selections']:
+            impacted = propagate_dependents(composer, changed_blocks, within=selection)
+            if global_change or impacted:
+                # 無法排序的組合（例如積木已不存在）沿用定義中的順序
+                order = composer.validate_dependencies(selection)['execution_order'] or list(selection)
+                first = 0 if global_change else min(
+                    (position for position, block_id in enumerate(order) if block_id in impacted),
+                    default=0
+                )
+                stale_definitions.append({
+                    'name': definition['name'],
+                    'path': definition['path'],
+                    'blocks': selection,
+                    'rerun_blocks': order[first:]
+                })
+
+    stale_builds = []
+    current_hashes = {}
+    for fingerprint, record in sorted((build_index.records if build_index else {}).items()):
+        enabled = [b for b in record.get('enabled_blocks', '').split(',') if b]
+        drifted = set()
+        for block_id, recorded_hash in (record.get('block_hashes') or {}).items():
+            if block_id not in composer.blocks_registry:
+                drifted.add(block_id)
+                continue
+            if block_id not in current_hashes:
+                current_hashes[block_id] = composer.block_content_hash(block_id)
+            if current_hashes[block_id] != recorded_hash:
+                drifted.add(block_id)
+        reasons = sorted(drifted | (changed_blocks & set(enabled)))
+        if global_change or reasons:
+            stale_builds.append({
+                'fingerprint': fingerprint,
+                'ami_id': record.get('ami_id'),
+                'region': record.get('region'),
+                'environment': record.get('environment'),
+                'enabled_blocks': enabled,
+                'reasons': [
+                    f"{block_id}（已移除）" if block_id not in composer.blocks_registry else block_id
+                    for block_id in reasons
+                ] or ['global']
+            })
+
+    return {
+        'changed_blocks': {block_id: files for block_id, files in sorted(mapping['blocks'].items())},
+        'impacted_blocks': dict(sorted(propagate_dependents(composer, changed_blocks).items())),
+        'global_files': mapping['global'],
+        'unmapped_files': mapping['unmapped'],
+        'stale_definitions': stale_definitions,
+        'stale_builds': stale_builds,
+        'total_definitions': sum(len(d['selections']) for d in definitions or []),
+        'total_builds': len(build_index.records) if build_index else 0
+    }
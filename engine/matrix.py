@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+矩陣建構 - 將同一組積木展開為 環境 × 區域 × 基礎系統 的多個建構，並以有上限的工作池執行 packer
+"""
+
+import json
+import os
+import signal
+import subprocess
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Any, Dict, List
+
+from build_timing import TimingProfiler, write_timing_profile
+
+# 逾時時先送 SIGINT，讓 Packer 自行終止 EC2 實例並刪除暫時的金鑰對與安全群組，超過此秒數才強制結束
+INTERRUPT_GRACE_SECONDS = 300
+
+
+def read_manifest_artifacts(manifest_path: Path) -> List[str]:
+    """
+    回傳 packer-manifest.json 中最近一次執行（last_run_uuid）的產物
+
+    manifest post-processor 會把每次執行附加到既有的檔案，同一個目錄重跑時不可把先前的 AMI 算進來。
+    """
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    last_run = manifest.get('last_run_uuid')
+    return [
+        build['artifact_id'] for build in manifest.get('builds', [])
+        if build.get('artifact_id') and (last_run is None or build.get('packer_run_uuid') == last_run)
+    ]
+
+
+def run_packer(command: List[str], cwd: Path, log_file, timeout: float = None,
+               interrupt_grace: float = INTERRUPT_GRACE_SECONDS) -> int:
+    """執行 packer 並回傳結束代碼，逾時時先中斷、等待 Packer 清理資源，逾時回傳 -1"""
+    process = subprocess.Popen(command, cwd=cwd, stdout=log_file, stderr=subprocess.STDOUT)
+    try:
+        return process.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.send_signal(signal.SIGINT)
+        try:
+            process.wait(timeout=interrupt_grace)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        log_file.write(f"\n建構超過 {timeout} 秒，已中斷 packer\n".encode('utf-8'))
+        return -1
+
+
+def expand_matrix(composer, spec: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    依矩陣規格展開建構配置
+
+    spec 範例:
+        {
+          "name": "web",
+          "blocks": ["app-docker", "app-openresty"],
+          "environments": ["dev", "stg", "prod"],
+          "regions": ["ap-northeast-1", "us-east-1"],
+          "base_blocks": ["base-ubuntu-2004"],
+          "base_amis": {"base-ubuntu-2004": {"ap-northeast-1": "ami-..."}},
+          "parameters": {"instance_type": "t3.small"}
+        }
+
+    沒有 base_blocks 時 blocks 本身即為一組完整的積木組合（與 impact.load_build_definitions 一致）。
+    """
+    name = spec.get('name', 'matrix')
+    base_blocks = spec.get('base_blocks')
+    if base_blocks:
+        app_blocks = [
+            block_id for block_id in spec.get('blocks', [])
+            if composer.blocks_registry.get(block_id, {}).get('category') != 'base'
+        ]
+        selections = [(base_block, [base_block] + app_blocks) for base_block in base_blocks]
+    else:
+        selected = list(spec.get('blocks', []))
+        if not selected:
+            raise ValueError(f"矩陣規格 '{name}' 沒有指定 blocks")
+        base_block = next((block_id for block_id in selected
+                           if composer.blocks_registry.get(block_id, {}).get('category') == 'base'), None)
+        selections = [(base_block, selected)]
+    base_amis = spec.get('base_amis', {})
+
+    jobs = []
+    for environment in spec.get('environments', ['dev']):
+        for region in spec.get('regions', ['ap-northeast-1']):
+            for base_block, selected_blocks in selections:
+                parameters = dict(spec.get('parameters', {}))
+                parameters['region'] = region
+                parameters['base_ami_id'] = base_amis.get(base_block, {}).get(
+                    region, parameters.get('base_ami_id', '')
+                )
+                label = base_block or name
+                build_config = composer.generate_build_config(
+                    build_name=f"{name}-{label}",
+                    environment=environment,
+                    selected_blocks=selected_blocks,
+                    custom_scripts=spec.get('custom_scripts'),
+                    parameters=parameters
+                )
+                jobs.append({
+                    'id': f"{environment}-{region}-{label}",
+                    'environment': environment,
+                    'region': region,
+                    'base_block': base_block,
+                    'build_config': build_config
+                })
+    return jobs
+
+
+def prepare_jobs(composer, jobs: List[Dict[str, Any]], work_dir: str,
+                 packer_bin: str = "packer") -> List[Dict[str, Any]]:
+    """為每個建構寫出專屬模板，模板的變數預設值即為該建構的參數"""
+    work_dir = Path(work_dir)
+    for job in jobs:
+        job_dir = work_dir / job['id']
+        template_path = job_dir / "build.pkr.json"
+        composer.generate_packer_template(job['build_config'], template_path)
+        job['plan_steps'] = composer.build_plan_steps(job['build_config'])
+        job['cwd'] = str(job_dir)
+        job['command'] = [packer_bin, "build", "-machine-readable", template_path.name]
+    return jobs
+
+
+class PackerExecutor:
+    """
+    以有上限的工作池平行執行多個 packer 程序
+
+    每個 packer build 本身就是獨立的子程序，因此以執行緒監看子程序即可，
+    同時限制全域與每個區域的同時建構數量。
+    """
+
+    def __init__(self, max_workers: int = 4, per_region_limit: int = 2,
+                 region_limits: Dict[str, int] = None, timeout: float = None,
+                 interrupt_grace: float = INTERRUPT_GRACE_SECONDS):
+        self.max_workers = max_workers
+        self.per_region_limit = per_region_limit
+        self.region_limits = region_limits or {}
+        self.timeout = timeout
+        self.interrupt_grace = interrupt_grace
+
+    def _region_limit(self, region: str) -> int:
+        return self.region_limits.get(region, self.per_region_limit)
+
+    def _run_job(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """執行單一建構並收集結果"""
+        job_dir = Path(job['cwd'])
+        log_path = job_dir / "packer.log"
+        manifest_path = job_dir / "packer-manifest.json"
+        # 重用的工作目錄會留有先前執行的 manifest
+        if manifest_path.exists():
+            manifest_path.unlink()
+        started = time.perf_counter()
+        try:
+            with open(log_path, 'wb') as log_file:
+                returncode = run_packer(job['command'], job_dir, log_file, self.timeout, self.interrupt_grace)
+        except OSError as e:
+            log_path.write_text(f"無法執行 packer: {e}\n", encoding='utf-8')
+            returncode = -2
+
+        result = {
+            'id': job['id'],
+            'environment': job['environment'],
+            'region': job['region'],
+            'base_block': job['base_block'],
+            'fingerprint': job['build_config']['build_info']['fingerprint'],
+            'returncode': returncode,
+            'status': 'success' if returncode == 0 else 'failure',
+            'duration_seconds': round(time.perf_counter() - started, 3),
+            'log': str(log_path),
+            'artifacts': []
+        }
+
+        if returncode == 0 and manifest_path.exists():
+            result['manifest'] = str(manifest_path)
+            result['artifacts'] = read_manifest_artifacts(manifest_path)
+
+        if 'plan_steps' in job and log_path.exists():
+            profiler = TimingProfiler(job['plan_steps'])
+            with open(log_path, 'r', encoding='utf-8', errors='replace') as log_file:
+                for line in log_file:
+                    profiler.feed(line)
+            profile = profiler.finish()
+            # 記錄實例類型與磁碟吞吐量，供 build_estimator 換算不同實例的耗時
+            packer_vars = job.get('build_config', {}).get('packer_vars', {})
+            profile['instance_type'] = packer_vars.get('instance_type')
+            if 'root_volume_throughput' in packer_vars:
+                profile['volume_throughput'] = packer_vars['root_volume_throughput']
+            result['timing'] = str(write_timing_profile(profile, manifest_path))
+        return result
+
+    def run(self, jobs: List[Dict[str, Any]], on_result=None) -> List[Dict[str, Any]]:
+        """依區域上限排程所有建構，回傳依完成順序排列的結果"""
+        pending = list(jobs)
+        running = {}
+        region_usage: Dict[str, int] = {}
+        results = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                # 在全域與區域上限內盡量派發工作
+                for job in list(pending):
+                    if len(running) >= self.max_workers:
+                        break
+                    region = job['region']
+                    if region_usage.get(region, 0) >= self._region_limit(region):
+                        continue
+                    pending.remove(job)
+                    region_usage[region] = region_usage.get(region, 0) + 1
+                    running[pool.submit(self._run_job, job)] = job
+
+                if not running:
+                    # 剩餘的工作所屬區域上限為 0，無法排程
+                    for job in pending:
+                        results.append({
+                            'id': job['id'], 'environment': job['environment'],
+                            'region': job['region'], 'base_block': job['base_block'],
+                            'status': 'skipped', 'returncode': None, 'artifacts': []
+                        })
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    region_usage[job['region']] -= 1
+                    result = future.result()
+                    results.append(result)
+                    if on_result:
+                        on_result(result)
+        return results
+
+
+def write_matrix_manifest(results: List[Dict[str, Any]], output_path: str) -> Dict[str, Any]:
+    """彙整所有建構結果為單一 manifest"""
+    manifest = {
+        'total': len(results),
+        'succeeded': sum(1 for r in results if r['status'] == 'success'),
+        'failed': sum(1 for r in results if r['status'] == 'failure'),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'builds': sorted(results, key=lambda r: r['id'])
+    }
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = output_path.with_name(f"{output_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, output_path)
+    return manifest
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+"""
+離線套件包快取 - 依套件集合雜湊預先準備 .deb/.rpm 檔案包，讓實例不必在建構時從鏡像站下載
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import re
+import shutil
+import tarfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+from artifact_cache import JsonIndex
+
+PACKAGE_BUNDLE_PREFIX = "packages"
+
+# 實例上解壓套件包的目錄
+REMOTE_PACKAGE_DIR = "/tmp/package-bundle"
+
+_PACKAGE_SUFFIXES = {"apt": ".deb", "yum": ".rpm", "dnf": ".rpm"}
+
+
+def package_set_hash(package_plan: Dict[str, Any], os_info: Dict[str, Any]) -> str:
+    """計算套件集合雜湊: 相同的 OS、套件管理工具、倉庫與套件必定得到相同雜湊"""
+    canonical = {
+        'os_family': os_info.get('family', ''),
+        'os_version': str(os_info.get('version', '')),
+        'package_manager': package_plan['package_manager'],
+        'repositories': sorted(package_plan['repositories'], key=lambda r: r['name']),
+        'install': sorted(package_plan['install'])
+    }
+    return hashlib.sha256(
+        json.dumps(canonical, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    ).hexdigest()
+
+
+def render_prefetch_script(bundle: Dict[str, Any], package_manager: str) -> str:
+    """產生在實例上解開套件包的腳本，apt 的 deb 檔放入 archives 快取以取代下載"""
+    lines = [
+        "set -e",
+        f"echo '使用預先下載的套件包 {bundle['name']}'",
+        f"rm -rf {REMOTE_PACKAGE_DIR} && mkdir -p {REMOTE_PACKAGE_DIR}",
+        f"tar -xzf /tmp/{bundle['name']} -C {REMOTE_PACKAGE_DIR}"
+    ]
+    if package_manager == "apt":
+        lines.append(f"sudo cp {REMOTE_PACKAGE_DIR}/*.deb /var/cache/apt/archives/ 2>/dev/null || true")
+    return "\n".join(lines)
+
+
+def _deb_control(path: Path) -> Dict[str, str]:
+    """讀取 deb 檔（ar 封存）中 control.tar.* 的 control 欄位，只讀取封存成員的標頭與 control 本身"""
+    with open(path, 'rb') as f:
+        if f.read(8) != b"!<arch>\n":
+            return {}
+        while True:
+            header = f.read(60)
+            if len(header) < 60:
+                return {}
+            name = header[:16].decode('ascii', 'replace').strip().rstrip('/')
+            size = int(header[48:58].decode('ascii').strip())
+            if name.startswith("control.tar"):
+                data = f.read(size)
+                break
+            f.seek(size + size % 2, io.SEEK_CUR)
+
+    # tarfile 可解開 gz / xz / bz2 與未壓縮的 control.tar，zst 會在此拋出 tarfile.ReadError
+    with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+        member = next((m for m in archive.getmembers() if m.name.lstrip('./') == "control"), None)
+        if member is None:
+            return {}
+        text = archive.extractfile(member).read().decode('utf-8', 'replace')
+
+    fields = {}
+    key = None
+    for line in text.splitlines():
+        if line[:1] in (' ', '\t') and key:
+            fields[key] += ' ' + line.strip()
+        elif ':' in line:
+            key, value = line.split(':', 1)
+            fields[key] = value.strip()
+    return fields
+
+
+def _deb_relations(value: str) -> List[List[str]]:
+    """將 Depends 欄位轉成 [[替代套件...], ...]，去掉版本限制與 :any 等架構限定"""
+    groups = []
+    for group in value.split(','):
+        names = [re.split(r'[\s(\[]', alternative.strip(), maxsplit=1)[0].split(':', 1)[0]
+                 for alternative in group.split('|')]
+        names = [name for name in names if name]
+        if names:
+            groups.append(names)
+    return groups
+
+
+def _deb_metadata(path: Path) -> Tuple[str, List[str], List[List[str]]]:
+    fields = _deb_control(path)
+    if not fields.get('Package'):
+        raise ValueError("缺少 Package 欄位")
+    depends = _deb_relations(fields.get('Pre-Depends', '')) + _deb_relations(fields.get('Depends', ''))
+    provides = [names[0] for names in _deb_relations(fields.get('Provides', ''))]
+    return fields['Package'], provides, depends
+
+
+# rpm 標頭的標籤與資料型別
+_RPMTAG_NAME, _RPMTAG_PROVIDENAME, _RPMTAG_REQUIRENAME = 1000, 1047, 1049
+_RPM_STRING, _RPM_STRING_ARRAY, _RPM_I18NSTRING = 6, 8, 9
+_RPM_HEADER_MAGIC = b"\x8e\xad\xe8"
+
+
+def _rpm_header(f) -> Tuple[bytes, bytes]:
+    intro = f.read(16)
+    if len(intro) < 16 or intro[:3] != _RPM_HEADER_MAGIC:
+        raise ValueError("不是 rpm 標頭")
+    count, size = int.from_bytes(intro[8:12], 'big'), int.from_bytes(intro[12:16], 'big')
+    return f.read(count * 16), f.read(size)
+
+
+def _rpm_metadata(path: Path) -> Tuple[str, List[str], List[List[str]]]:
+    """讀取 rpm 檔的 Name / Provides / Requires：跳過 96 位元組的 lead 與簽章標頭，解析主標頭"""
+    with open(path, 'rb') as f:
+        f.seek(96)
+        index, store = _rpm_header(f)
+        # 簽章標頭的資料區補齊到 8 位元組
+        f.seek(-len(store) % 8, io.SEEK_CUR)
+        index, store = _rpm_header(f)
+
+    tags = {}
+    for offset in range(0, len(index), 16):
+        tag, data_type, data_offset, count = (
+            int.from_bytes(index[offset + i:offset + i + 4], 'big') for i in range(0, 16, 4)
+        )
+        if tag not in (_RPMTAG_NAME, _RPMTAG_PROVIDENAME, _RPMTAG_REQUIRENAME):
+            continue
+        if data_type not in (_RPM_STRING, _RPM_STRING_ARRAY, _RPM_I18NSTRING):
+            continue
+        values = store[data_offset:].split(b"\0", count if data_type != _RPM_STRING else 1)[:count]
+        tags[tag] = [value.decode('utf-8', 'replace') for value in values]
+    if not tags.get(_RPMTAG_NAME):
+        raise ValueError("缺少 Name 標籤")
+    # rpmlib(...) 是 rpm 本身提供的功能，不對應任何套件
+    requires = [[name] for name in tags.get(_RPMTAG_REQUIRENAME, []) if not name.startswith("rpmlib(")]
+    return tags[_RPMTAG_NAME][0], tags.get(_RPMTAG_PROVIDENAME, []), requires
+
+
+def _filename_package(filename: str, suffix: str) -> str:
+    """由檔名推得套件名稱: <name>_<version>_<arch>.deb 或 <name>-<version>-<release>.<arch>.rpm"""
+    if suffix == ".deb":
+        return filename.split('_', 1)[0]
+    return filename.rsplit('-', 2)[0]
+
+
+class DirectoryFetcher:
+    """
+    從本地鏡像目錄取得套件及其依賴的檔案
+
+    目錄可由 CI 以 apt-get download / dnf download --resolve 預先填入，
+    deb 檔名須為 <name>_<version>_<arch>.deb，rpm 檔名須為 <name>-<version>-<release>.<arch>.rpm。
+    同名套件有多個版本時取排序最後的檔案。依賴由各檔案的 Depends / Pre-Depends（deb）
+    或 Requires（rpm）展開，只收錄鏡像目錄中有提供者的依賴，其他依賴視為已在基礎映像中；
+    讀不到中繼資料的檔案（例如 control.tar.zst）以檔名判斷套件名稱，不展開其依賴。
+    """
+
+    def __init__(self, source_dir: str):
+        self.source_dir = Path(source_dir)
+
+    def _scan(self, suffix: str) -> Tuple[Dict[str, Path], Dict[str, str], Dict[str, List[List[str]]]]:
+        """回傳 (套件 → 檔案, 功能 → 提供者套件, 套件 → 依賴)"""
+        read_metadata = _deb_metadata if suffix == ".deb" else _rpm_metadata
+        available = sorted(p for p in self.source_dir.iterdir() if p.is_file()) if self.source_dir.is_dir() else []
+        files, providers, depends = {}, {}, {}
+        for path in available:
+            if not path.name.endswith(suffix):
+                continue
+            try:
+                name, provides, requires = read_metadata(path)
+            except (OSError, ValueError, EOFError, tarfile.TarError):
+                name, provides, requires = _filename_package(path.name, suffix), [], []
+            files[name] = path
+            depends[name] = requires
+            for feature in [name] + provides:
+                providers.setdefault(feature, name)
+        return files, providers, depends
+
+    def fetch(self, packages: List[str], package_manager: str) -> Tuple[List[Path], List[str]]:
+        """回傳 (要求的套件與其依賴的檔案, 找不到的套件)"""
+        suffix = _PACKAGE_SUFFIXES.get(package_manager, ".deb")
+        files, providers, depends = self._scan(suffix)
+        selected = []
+        missing = []
+        pending = []
+        for package in packages:
+            if package in files:
+                pending.append(package)
+            else:
+                missing.append(package)
+        seen = set(pending)
+        while pending:
+            package = pending.pop(0)
+            selected.append(package)
+            for alternatives in depends[package]:
+                if any(providers.get(name) in seen for name in alternatives):
+                    continue
+                provider = next((providers[name] for name in alternatives if name in providers), None)
+                if provider:
+                    seen.add(provider)
+                    pending.append(provider)
+        return sorted(files[package] for package in selected), missing
+
+
+def _add_file(archive: tarfile.TarFile, name: str, data: bytes):
+    """以固定的 metadata 加入檔案，確保相同內容產生相同的壓縮檔"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = "root"
+    archive.addfile(info, io.BytesIO(data))
+
+
+class PackageBundleCache(JsonIndex):
+    """
+    以套件集合雜湊為鍵的套件包快取，超過數量或容量上限時淘汰最久未使用的套件包
+
+    索引記錄於 <cache_dir>/index.json，套件包存放於同一目錄。
+    """
+
+    def __init__(self, cache_dir: str, max_bundles: int = 8, max_bytes: int = None):
+        self.cache_dir = Path(cache_dir)
+        self.max_bundles = max_bundles
+        self.max_bytes = max_bytes
+        super().__init__(self.cache_dir / "index.json")
+
+    def find(self, set_hash: str) -> Dict[str, Any]:
+        """查詢完整的套件包，檔案已不存在時視為未命中"""
+        record = self.get(set_hash)
+        if not record:
+            return None
+        if not record.get('complete') or not Path(record['path']).exists():
+            self.remove(set_hash)
+            return None
+        record['last_used'] = time.time()
+        self.put(set_hash, record)
+        return record
+
+    def stage(self, set_hash: str, package_plan: Dict[str, Any], fetcher) -> Dict[str, Any]:
+        """
+        取得或建立套件集合的套件包，回傳索引項目並標示 reused 與 evicted
+
+        缺少部分套件時仍會建立套件包（缺少的套件於實例上照常從鏡像站下載），
+        但不視為完整，下次會重新準備。
+        """
+        record = self.find(set_hash)
+        if record:
+            return dict(record, reused=True, evicted=[])
+
+        files, missing = fetcher.fetch(package_plan['install'], package_plan['package_manager'])
+        manifest = {
+            'set_hash': set_hash,
+            'package_manager': package_plan['package_manager'],
+            'packages': package_plan['install'],
+            'files': [],
+            'missing': missing
+        }
+
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.USTAR_FORMAT) as archive:
+            for path in files:
+                data = path.read_bytes()
+                manifest['files'].append({'name': path.name, 'sha256': hashlib.sha256(data).hexdigest()})
+                _add_file(archive, path.name, data)
+            _add_file(archive, "package-bundle.json",
+                      json.dumps(manifest, indent=2, ensure_ascii=False).encode('utf-8'))
+
+        gz_buffer = io.BytesIO()
+        with gzip.GzipFile(filename="", mode='wb', fileobj=gz_buffer, mtime=0) as gz:
+            gz.write(tar_buffer.getvalue())
+        data = gz_buffer.getvalue()
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        path = self.cache_dir / f"{PACKAGE_BUNDLE_PREFIX}-{set_hash[:16]}.tar.gz"
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+        now = time.time()
+        record = {
+            'name': path.name,
+            'path': str(path.resolve()),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'size': len(data),
+            'package_manager': package_plan['package_manager'],
+            'files': len(files),
+            'missing': missing,
+            'complete': not missing,
+            'created_at': now,
+            'last_used': now
+        }
+        self.put(set_hash, record)
+        evicted = self.evict(keep=set_hash)
+        return dict(record, reused=False, evicted=evicted)
+
+    def evict(self, keep: str = None) -> List[str]:
+        """依最久未使用的順序淘汰套件包，直到符合數量與容量上限，回傳被淘汰的雜湊"""
+        evicted = []
+        by_age = sorted(
+            (key for key in self.records if key != keep),
+            key=lambda key: self.records[key].get('last_used', 0)
+        )
+        for key in by_age:
+            total_size = sum(record.get('size', 0) for record in self.records.values())
+            over_count = self.max_bundles is not None and len(self.records) > self.max_bundles
+            over_size = self.max_bytes is not None and total_size > self.max_bytes
+            if not over_count and not over_size:
+                break
+            record = self.records.pop(key)
+            Path(record['path']).unlink(missing_ok=True)
+            evicted.append(key)
+        if evicted:
+            self.save()
+        return evicted
+
+    def clear(self):
+        """刪除所有套件包與索引"""
+        if self.cache_dir.exists():
+            shutil.rmtree(self.cache_dir)
+        self.records = {}
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+套件合併 - 將各積木在 block.yaml 宣告的套件與倉庫合併為單一倉庫設定步驟與單一安裝交易
+"""
+
+import re
+from pathlib import Path
+from typing import Any, Dict, List
+
+# 合併步驟在執行計畫中的積木名稱
+PACKAGES_BLOCK = "packages"
+
+# 積木腳本以此環境變數判斷套件是否改由合併步驟安裝
+PREINSTALLED_ENV = "BLOCK_PACKAGES_PREINSTALLED"
+
+# os_info 未指定 package_manager 時依 OS 家族推斷
+DEFAULT_PACKAGE_MANAGERS = {"debian": "apt", "rhel": "dnf", "amazon-linux": "yum"}
+
+_GUARD_START_RE = re.compile(r'^if \[ "\$\{' + PREINSTALLED_ENV + r'[:}]')
+_INVOCATION_RE = re.compile(
+    r'\b(?:apt-get|apt|yum|dnf)\s+(?:-\S+\s+)*(?:update|install|upgrade|makecache|groupinstall)\b'
+)
+# 會取得套件資料庫鎖的呼叫，同一時間只能有一個在執行
+_LOCKING_RE = re.compile(
+    r'\b(?:apt-get|apt|yum|dnf|amazon-linux-extras)\s+(?:-\S+\s+)*'
+    r'(?:update|install|reinstall|upgrade|remove|purge|autoremove|makecache|groupinstall)\b'
+    r'|\bdpkg\s+(?:-\S+\s+)*?(?:-i|--install|--configure|-r|--remove|-P|--purge)\b'
+    r'|\brpm\s+(?:-\S+\s+)*?(?:-[iUFe]\w*|--import)\b'
+)
+
+
+def package_manager_for(os_info: Dict[str, Any]) -> str:
+    """取得 OS 使用的套件管理工具"""
+    return os_info.get('package_manager') or DEFAULT_PACKAGE_MANAGERS.get(os_info.get('family'), 'apt')
+
+
+def count_guarded_invocations(script: str) -> int:
+    """計算腳本中被 BLOCK_PACKAGES_PREINSTALLED 條件包住的套件管理工具呼叫次數"""
+    count = 0
+    guarded = False
+    for line in script.splitlines():
+        if _GUARD_START_RE.match(line):
+            guarded = True
+        elif guarded and line.rstrip() == "fi":
+            guarded = False
+        elif guarded and not line.lstrip().startswith('#') and _INVOCATION_RE.search(line):
+            count += 1
+    return count
+
+
+def invokes_package_manager(script: str, preinstalled: bool = False) -> bool:
+    """
+    判斷腳本是否會呼叫套件管理工具
+
+    preinstalled 為真時（已有合併安裝步驟）略過被 BLOCK_PACKAGES_PREINSTALLED 條件包住的呼叫。
+    """
+    guarded = False
+    for line in script.splitlines():
+        if _GUARD_START_RE.match(line):
+            guarded = True
+        elif guarded and line.rstrip() == "fi":
+            guarded = False
+        elif line.lstrip().startswith('#') or (guarded and preinstalled):
+            continue
+        elif _LOCKING_RE.search(line):
+            return True
+    return False
+
+
+def collect_packages(blocks: List[Dict[str, Any]], os_family: str) -> Dict[str, Any]:
+    """
+    依執行順序合併各積木宣告的倉庫與套件
+
+    blocks 為 [{'id', 'packages'}]，packages 為 block.yaml 中 packages.<os_family> 的內容。
+    倉庫依名稱去重，套件依首次出現的順序去重。
+    """
+    repositories = []
+    repository_names = set()
+    packages = []
+    seen_packages = set()
+    contributors = []
+
+    for block in blocks:
+        section = block.get('packages') or {}
+        if not section:
+            continue
+        contributors.append(block['id'])
+        for repository in section.get('repositories', []):
+            if repository['name'] in repository_names:
+                continue
+            repository_names.add(repository['name'])
+            repositories.append(dict(repository))
+        for package in section.get('install', []):
+            if package not in seen_packages:
+                seen_packages.add(package)
+                packages.append(package)
+
+    return {
+        'os_family': os_family,
+        'blocks': contributors,
+        'repositories': repositories,
+        'install': packages
+    }
+
+
+def _apt_repository_lines(repository: Dict[str, Any]) -> List[str]:
+    keyring = f"/etc/apt/keyrings/{repository['name']}.gpg"
+    lines = []
+    if repository.get('key_url'):
+        lines.append(f"curl -fsSL {repository['key_url']} | sudo gpg --dearmor --yes -o {keyring}")
+    lines.append(
+        f"echo \"{repository['source']}\" | sudo tee /etc/apt/sources.list.d/{repository['name']}.list > /dev/null"
+    )
+    return lines
+
+
+def render_repository_script(plan: Dict[str, Any], manager: str, refresh: bool) -> str:
+    """產生一次設定所有倉庫的腳本，apt 只在最後更新一次套件索引"""
+    lines = ["set -e", f"echo '設定 {len(plan['repositories'])} 個套件倉庫...'"]
+    if manager == "apt":
+        lines.append("export DEBIAN_FRONTEND=noninteractive")
+        if plan['repositories']:
+            # 一般的 Ubuntu 映像已內建這些工具，只有精簡映像才需要先安裝
+            lines.append(
+                "if ! command -v curl > /dev/null 2>&1 || ! command -v gpg > /dev/null 2>&1 "
+                "|| ! command -v lsb_release > /dev/null 2>&1; then"
+            )
+            lines.append("  sudo apt-get update && sudo apt-get install -y ca-certificates curl gnupg lsb-release")
+            lines.append("fi")
+            lines.append("sudo mkdir -m 0755 -p /etc/apt/keyrings")
+        for repository in plan['repositories']:
+            lines.extend(_apt_repository_lines(repository))
+        if refresh:
+            lines.append("sudo apt-get update")
+    else:
+        if manager == "dnf":
+            config_manager = "dnf config-manager"
+            check = "sudo dnf config-manager --help > /dev/null 2>&1 || sudo dnf install -y dnf-plugins-core"
+        else:
+            config_manager = "yum-config-manager"
+            check = "command -v yum-config-manager > /dev/null 2>&1 || sudo yum install -y yum-utils"
+        if plan['repositories']:
+            lines.append(check)
+        for repository in plan['repositories']:
+            lines.append(f"sudo {config_manager} --add-repo {repository['repo_url']}")
+    return "\n".join(lines)
+
+
+def render_install_script(plan: Dict[str, Any], manager: str, local_dir: str = None) -> str:
+    """
+    產生以單一交易安裝所有套件的腳本
+
+    指定 local_dir 時，yum/dnf 會在同一交易中一併安裝該目錄下預先下載的 rpm 檔；
+    apt 則由預先放入 /var/cache/apt/archives 的 deb 檔自動取代下載。
+    """
+    lines = ["set -e", f"echo '安裝 {len(plan['install'])} 個套件（{', '.join(plan['blocks'])}）...'"]
+    if manager == "apt":
+        lines.append("export DEBIAN_FRONTEND=noninteractive")
+        lines.append("sudo apt-get install -y " + " ".join(plan['install']))
+    elif local_dir:
+        lines.append(f"set -- {local_dir}/*.rpm")
+        lines.append('[ -e "$1" ] || set --')
+        lines.append(f'sudo {manager} install -y "$@" ' + " ".join(plan['install']))
+    else:
+        lines.append(f"sudo {manager} install -y " + " ".join(plan['install']))
+    return "\n".join(lines)
+
+
+def plan_invocations(plan: Dict[str, Any], manager: str, refresh: bool,
+                     scripts: List[str]) -> Dict[str, int]:
+    """比較合併前（積木腳本中被取代的呼叫）與合併後的套件管理工具呼叫次數"""
+    before = 0
+    for script in scripts:
+        try:
+            before += count_guarded_invocations(Path(script).read_text(encoding='utf-8'))
+        except OSError:
+            continue
+    after = 1 if plan['install'] else 0
+    if manager == "apt" and refresh:
+        after += 1
+    return {'before': before, 'after': after, 'removed': max(before - after, 0)}
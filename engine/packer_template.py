@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Packer 模板產生器 - 依照解析後的執行計畫輸出只包含所需積木的建構模板（HCL2 JSON 語法）
+"""
+
+import json
+from pathlib import Path
+from typing import Any, Dict, List
+
+from package_plan import PACKAGES_BLOCK, PREINSTALLED_ENV
+from script_bundle import REMOTE_BUNDLE_DIR
+
+# 與 builder.pkr.hcl 相同的 plugin 版本需求
+REQUIRED_PLUGINS = {
+    "amazon": {
+        "version": ">= 1.2.0",
+        "source": "github.com/hashicorp/amazon"
+    }
+}
+
+SOURCE_NAME = "amazon-ebs.dynamic"
+
+# 各 OS 家族官方 AMI 的根磁碟裝置名稱
+ROOT_DEVICE_NAMES = {"debian": "/dev/sda1", "rhel": "/dev/sda1", "amazon-linux": "/dev/xvda"}
+
+# gp3 的基準 IOPS，足以支撐 500 MB/s 以下的吞吐量
+GP3_BASELINE_IOPS = 3000
+
+
+def _variable_type(value: Any) -> str:
+    """依預設值推斷 Packer 變數型別"""
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, list):
+        return "list(string)"
+    return "string"
+
+
+def _environment_vars(os_family: str, packages_preinstalled: bool = False) -> List[str]:
+    """依 OS 家族與是否已合併安裝套件產生 shell provisioner 的環境變數"""
+    environment_vars = []
+    if os_family == "debian":
+        environment_vars.append("DEBIAN_FRONTEND=noninteractive")
+    if packages_preinstalled:
+        environment_vars.append(f"{PREINSTALLED_ENV}=1")
+    return environment_vars
+
+
+def _group_steps(steps: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+    """將同一個積木、同一階段連續的腳本步驟合併為一組，對應一個 provisioner"""
+    groups = []
+    for step in steps:
+        if (groups and 'inline' not in step and 'inline' not in groups[-1][0]
+                and groups[-1][0]['block'] == step['block']
+                and groups[-1][0]['phase'] == step['phase']):
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+    return groups
+
+
+def _shell_provisioner(steps: List[Dict[str, Any]], os_family: str,
+                       packages_preinstalled: bool = False) -> Dict[str, Any]:
+    """產生單一積木的 shell provisioner"""
+    if 'inline' in steps[0]:
+        return {"shell": {"inline": [steps[0]['inline']]}}
+
+    provisioner = {}
+    environment_vars = _environment_vars(os_family, packages_preinstalled)
+    if environment_vars:
+        provisioner["environment_vars"] = environment_vars
+    if any(step.get('expect_disconnect') for step in steps):
+        provisioner["expect_disconnect"] = True
+    provisioner["scripts"] = [step['script'] for step in steps]
+    return {"shell": provisioner}
+
+
+def _bundle_provisioners(bundle: Dict[str, Any], plan_steps: List[Dict[str, Any]],
+                         os_family: str) -> List[Dict[str, Any]]:
+    """
+    以單次上傳 + 單次執行取代逐一上傳每支腳本
+
+    腳本包有預期會中斷 SSH 連線的段時（見 script_bundle.plan_segments），每段各用一個 provisioner，
+    與逐一執行時相同，只有該段設定 expect_disconnect。各段在實例上以背景行程執行，
+    連線中斷後由下一個 provisioner 等待上一段結束並確認結束代碼，不會略過失敗或未完成的步驟。
+    """
+    remote_archive = f"/tmp/{bundle['name']}"
+    remote_dir = REMOTE_BUNDLE_DIR
+    unpack = [
+        f"sudo rm -rf {remote_dir} && sudo mkdir -p {remote_dir} && sudo chown \"$(id -u):$(id -g)\" {remote_dir}",
+        f"tar -xzf {remote_archive} -C {remote_dir} && rm -f {remote_archive}"
+    ]
+    # 執行器的日誌與狀態不應留在 AMI 中
+    remove = f"sudo rm -rf {remote_dir}"
+    environment_vars = _environment_vars(
+        os_family, any(step['block'] == PACKAGES_BLOCK for step in plan_steps)
+    )
+
+    def shell(inline: List[str], expect_disconnect: bool = False) -> Dict[str, Any]:
+        provisioner = {"inline": inline}
+        if environment_vars:
+            provisioner["environment_vars"] = environment_vars
+        if expect_disconnect:
+            provisioner["expect_disconnect"] = True
+        return {"shell": provisioner}
+
+    provisioners = [{"file": {"source": bundle['path'], "destination": remote_archive}}]
+    segments = bundle.get('segments') or [{'id': 1, 'disconnect': False}]
+    if len(segments) == 1:
+        provisioners.append(shell(unpack + [f"bash {remote_dir}/run.sh", remove]))
+        return provisioners
+
+    previous = None
+    for segment in segments:
+        inline = list(unpack) if previous is None else []
+        if previous and previous['disconnect']:
+            inline.append(f"bash {remote_dir}/run.sh --await {previous['id']}")
+        inline.append(f"bash {remote_dir}/run.sh --start {segment['id']}")
+        provisioners.append(shell(inline, segment['disconnect']))
+        previous = segment
+    if previous['disconnect']:
+        provisioners.append(shell([f"bash {remote_dir}/run.sh --await {previous['id']}", remove]))
+    else:
+        provisioners[-1]['shell']['inline'].append(remove)
+    return provisioners
+
+
+def render_packer_template(build_config: Dict[str, Any],
+                           plan_steps: List[Dict[str, Any]],
+                           bundle: Dict[str, Any] = None) -> Dict[str, Any]:
+    """
+    依建構配置與執行計畫產生 Packer 模板
+
+    plan_steps 為 BlockComposer.build_plan_steps() 的結果，已依解析後的順序排列，
+    腳本路徑也已依 OS 家族代入，因此模板中不再需要 except 條件或 OS 推斷。
+    指定 bundle（script_bundle.build_script_bundle() 的結果）時，所有步驟改由
+    上傳一次的腳本包與其執行器完成。
+    """
+    packer_vars = build_config['packer_vars']
+    os_family = build_config['os_info']['family']
+
+    variables = {}
+    for name, value in packer_vars.items():
+        variables[name] = {"type": _variable_type(value), "default": value}
+
+    locals_block = {
+        "timestamp": "${formatdate(\"YYYYMMDD-HHmmss\", timestamp())}",
+        "build_name": "${var.build_name != \"\" ? var.build_name : \"dynamic\"}",
+        "ami_name": "${var.env}-${local.build_name}-${local.timestamp}"
+    }
+
+    source = {
+        "region": "${var.region}",
+        "instance_type": "${var.instance_type}",
+        "ami_name": "${local.ami_name}",
+        "source_ami": "${var.base_ami_id}",
+        "ssh_username": "${var.ssh_username}",
+        "ssh_timeout": "20m",
+        "tags": {
+            "Name": "${local.ami_name}",
+            "Environment": "${var.env}",
+            "BuildType": "Dynamic",
+            "PackerBuild": "true",
+            "BuildDate": "{{isotime \"2006-01-02\"}}",
+            "Owner": "${var.owner}",
+            "EnabledBlocks": "${join(\",\", var.enabled_blocks)}"
+        }
+    }
+
+    # 自動挑選實例時一併設定根磁碟容量與 gp3 吞吐量
+    if 'root_volume_throughput' in packer_vars:
+        source["launch_block_device_mappings"] = [{
+            "device_name": ROOT_DEVICE_NAMES.get(os_family, "/dev/sda1"),
+            "volume_type": "gp3",
+            "volume_size": "${var.root_volume_size}",
+            "throughput": "${var.root_volume_throughput}",
+            "iops": GP3_BASELINE_IOPS,
+            "delete_on_termination": True
+        }]
+
+    provisioners = [{
+        "shell": {
+            "inline": [
+                "echo 'Debug Info: Enabled Blocks List'",
+                "echo 'Enabled blocks: ${join(\",\", var.enabled_blocks)}'",
+                f"echo 'OS Family: {os_family}'"
+            ]
+        }
+    }]
+
+    # 離線套件包須在解開它的步驟之前上傳
+    for step in plan_steps:
+        if step.get('package_bundle'):
+            provisioners.append({"file": {
+                "source": step['package_bundle'],
+                "destination": f"/tmp/{Path(step['package_bundle']).name}"
+            }})
+
+    if bundle:
+        provisioners.extend(_bundle_provisioners(bundle, plan_steps, os_family))
+    else:
+        packages_preinstalled = any(step['block'] == PACKAGES_BLOCK for step in plan_steps)
+        for group in _group_steps(plan_steps):
+            provisioners.append(_shell_provisioner(group, os_family, packages_preinstalled))
+
+    return {
+        "packer": {"required_plugins": REQUIRED_PLUGINS},
+        "variable": variables,
+        "locals": locals_block,
+        "source": {"amazon-ebs": {"dynamic": source}},
+        "build": {
+            "name": "dynamic-build",
+            "sources": [f"source.{SOURCE_NAME}"],
+            "provisioner": provisioners,
+            "post-processor": [
+                {
+                    "manifest": {
+                        "output": "packer-manifest.json",
+                        "strip_path": True,
+                        "custom_data": {
+                            "environment": "${var.env}",
+                            "build_type": "dynamic",
+                            "enabled_blocks": "${join(\",\", var.enabled_blocks)}",
+                            "owner": "${var.owner}",
+                            "fingerprint": "${var.build_fingerprint}",
+                            "block_hashes": json.dumps(build_config['build_info'].get('block_hashes', {}),
+                                                       sort_keys=True, separators=(',', ':')),
+                            "build_time": "${timestamp()}"
+                        }
+                    }
+                },
+                {
+                    "shell-local": {
+                        "inline": ["echo 'Build completed successfully'"]
+                    }
+                }
+            ]
+        }
+    }
+
+
+def write_packer_template(template: Dict[str, Any], output_path: str) -> Path:
+    """寫出模板檔案，副檔名應為 .pkr.json 以便 Packer 辨識"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(template, f, indent=2, ensure_ascii=False)
+        f.write("\n")
+    return output_path
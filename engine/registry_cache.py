@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+積木註冊表快取 - 將解析後的 block.yaml 持久化，啟動時只重新解析有變更的檔案
+"""
+
+import hashlib
+import json
+import os
+import sys
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple
+
+# 快取格式版本，格式變更時遞增以捨棄舊快取
+CACHE_FORMAT_VERSION = 1
+
+_yaml_loader = None
+
+
+def yaml_loader_name(load: bool = True) -> str:
+    """回傳目前使用的 YAML loader 名稱，load 為 False 且尚未載入 yaml 時回傳 None"""
+    if not load and _yaml_loader is None:
+        return None
+    return _get_yaml_loader().__name__
+
+
+def _get_yaml_loader():
+    """延遲載入 yaml，優先使用 C 版本的 loader"""
+    global _yaml_loader
+    if _yaml_loader is None:
+        import yaml
+        _yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    return _yaml_loader
+
+
+def _parse_yaml(raw: bytes) -> Dict[str, Any]:
+    """以最快的可用 loader 解析 YAML"""
+    import yaml
+    return yaml.load(raw, Loader=_get_yaml_loader())
+
+
+def parse_block_file(path: Path) -> Tuple[Dict[str, Any], str]:
+    """解析 block.yaml，回傳 (設定內容, 內容雜湊)"""
+    raw = Path(path).read_bytes()
+    return _parse_yaml(raw), hashlib.sha256(raw).hexdigest()
+
+
+class RegistryCache:
+    """以檔案 mtime/size/內容雜湊為鍵的 block.yaml 解析結果快取"""
+
+    def __init__(self, cache_file: str):
+        self.cache_file = Path(cache_file)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.stats = {'hits': 0, 'rehashed': 0, 'parsed': 0, 'removed': 0}
+        self._dirty = False
+        self._read_snapshot()
+
+    def _read_snapshot(self):
+        """讀取磁碟上的快取快照，格式不符時視為空快取"""
+        try:
+            with open(self.cache_file, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        if snapshot.get('version') == CACHE_FORMAT_VERSION:
+            self.entries = snapshot.get('entries', {})
+
+    def load(self, path: Path) -> Tuple[Dict[str, Any], str]:
+        """取得 block.yaml 的解析結果，僅在內容變更時重新解析"""
+        key = str(Path(path).resolve())
+        stat = os.stat(key)
+        entry = self.entries.get(key)
+
+        if entry and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+            self.stats['hits'] += 1
+            return entry['config'], entry['sha256']
+
+        raw = Path(key).read_bytes()
+        digest = hashlib.sha256(raw).hexdigest()
+
+        if entry and entry['sha256'] == digest:
+            # 只有 mtime 變動（例如重新 checkout），內容相同不需重新解析
+            self.stats['rehashed'] += 1
+            config = entry['config']
+        else:
+            self.stats['parsed'] += 1
+            config = _parse_yaml(raw)
+
+        self.entries[key] = {
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': digest,
+            'config': config
+        }
+        self._dirty = True
+        return config, digest
+
+    def prune(self, seen_paths: Iterable[Path]):
+        """移除已不存在於積木目錄中的快取項目"""
+        seen = {str(Path(p).resolve()) for p in seen_paths}
+        for key in list(self.entries):
+            if key not in seen:
+                del self.entries[key]
+                self.stats['removed'] += 1
+                self._dirty = True
+
+    def save(self):
+        """將快取以原子方式寫回磁碟，寫入失敗時不影響建構流程"""
+        if not self._dirty:
+            return
+
+        snapshot = {'version': CACHE_FORMAT_VERSION, 'entries': self.entries}
+        tmp_file = self.cache_file.with_name(f"{self.cache_file.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_file, self.cache_file)
+            self._dirty = False
+        except (OSError, TypeError, ValueError) as e:
+            print(f"⚠️ 無法寫入積木快取 {self.cache_file}: {e}", file=sys.stderr)
+            try:
+                tmp_file.unlink()
+            except OSError:
+                pass
+
+    def clear(self):
+        """清除記憶體與磁碟上的快取"""
+        self.entries = {}
+        self._dirty = False
+        try:
+            self.cache_file.unlink()
+        except OSError:
+            pass
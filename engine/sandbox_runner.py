@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+本地沙箱執行 - 不啟動 EC2，在 chroot 或容器的 rootfs 中依執行計畫跑積木腳本並記錄每支腳本的耗時
+"""
+
+import json
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from package_plan import PACKAGES_BLOCK, PREINSTALLED_ENV
+
+# 沙箱內的工作目錄，不放在 /tmp 以免被清理腳本刪除
+SANDBOX_MOUNT = "/block-sandbox"
+
+# chroot 後端掛載到 rootfs 的虛擬檔案系統
+CHROOT_MOUNTS = (("/dev", "--rbind"), ("/proc", "-t proc"))
+
+# 以記錄呼叫並回傳成功的替身取代的指令
+PACKAGE_STUBS = ("apt-get", "apt", "yum", "dnf", "snap", "add-apt-repository", "yum-config-manager")
+SERVICE_STUBS = ("systemctl", "service", "cloud-init", "reboot", "shutdown")
+
+# 各 OS 家族的預設容器映像，{version} 代入基礎積木的 OS 版本
+DEFAULT_IMAGES = {
+    "debian": "ubuntu:{version}",
+    "amazon-linux": "amazonlinux:{version}",
+    "rhel": "rockylinux:{version}"
+}
+
+# 失敗時保留在結果中的輸出行數
+OUTPUT_TAIL_LINES = 20
+
+_SUDO_STUB = """#!/bin/sh
+# 沙箱中的 sudo: 略過選項後以目前使用者執行指令
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -u|-g|-p|-C|-h|-U|-r|-t|-T) shift 2 ;;
+    --) shift; break ;;
+    -*) shift ;;
+    *) break ;;
+  esac
+done
+[ $# -eq 0 ] && exit 0
+exec "$@"
+"""
+
+_COMMAND_STUB = """#!/bin/sh
+# 沙箱替身: 記錄呼叫後回傳成功
+printf '%s\\t%s\\n' "${SANDBOX_STEP:-0}" "$(basename "$0") $*" >> "${SANDBOX_LOG:-/dev/null}"
+exit 0
+"""
+
+
+def default_image(os_info: Dict[str, Any]) -> str:
+    """依 OS 家族與版本取得預設的容器映像"""
+    template = DEFAULT_IMAGES.get(os_info.get('family'), DEFAULT_IMAGES['debian'])
+    return template.format(version=os_info.get('version') or 'latest')
+
+
+def _step_filename(index: int, step: Dict[str, Any]) -> str:
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '-', f"{step['block']}-{step['step']}")
+    return f"{index:03d}-{name}.sh"
+
+
+def prepare_workspace(work_dir: Path, plan_steps: List[Dict[str, Any]],
+                      stub_commands: List[str]) -> List[Dict[str, Any]]:
+    """在工作目錄寫出步驟腳本與替身指令，回傳步驟項目"""
+    for name in ("steps", "bin", "home", "logs"):
+        (work_dir / name).mkdir(parents=True, exist_ok=True)
+    (work_dir / "bin" / "sudo").write_text(_SUDO_STUB, encoding='utf-8')
+    for command in stub_commands:
+        (work_dir / "bin" / command).write_text(_COMMAND_STUB, encoding='utf-8')
+    (work_dir / "stub-calls.log").write_text("", encoding='utf-8')
+
+    entries = []
+    for index, step in enumerate(plan_steps, 1):
+        filename = _step_filename(index, step)
+        if 'inline' in step:
+            content = f"#!/bin/bash\nset -e\n{step['inline']}\n"
+        else:
+            content = Path(step['script']).read_text(encoding='utf-8')
+        (work_dir / "steps" / filename).write_text(content, encoding='utf-8')
+        entries.append({'index': index, 'step': step, 'file': filename})
+
+    for path in list((work_dir / "bin").iterdir()) + list((work_dir / "steps").iterdir()):
+        path.chmod(0o755)
+    return entries
+
+
+class ChrootBackend:
+    """
+    在 rootfs（例如 debootstrap 的輸出或解開的容器映像）中以 chroot 執行，需要 root 權限
+
+    工作目錄複製到 <rootfs>/block-sandbox 並掛載 /dev 與 /proc，結束後卸載並移除。
+    """
+
+    name = "chroot"
+
+    def __init__(self, rootfs: str):
+        self.rootfs = Path(rootfs).resolve()
+        self.work_dir = None
+        self.mounted = []
+
+    def start(self, work_dir: Path):
+        if os.geteuid() != 0:
+            raise RuntimeError("chroot 後端需要 root 權限")
+        if not (self.rootfs / "bin").exists() and not (self.rootfs / "usr" / "bin").exists():
+            raise RuntimeError(f"{self.rootfs} 不是有效的 rootfs")
+        target = self.rootfs / SANDBOX_MOUNT.lstrip('/')
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.copytree(work_dir, target, symlinks=True)
+        self.work_dir = work_dir
+        # 模擬已開機完成的實例，避免等待 cloud-init 的腳本卡住
+        boot_finished = self.rootfs / "var/lib/cloud/instance/boot-finished"
+        boot_finished.parent.mkdir(parents=True, exist_ok=True)
+        boot_finished.touch()
+
+        for source, options in CHROOT_MOUNTS:
+            mount_point = self.rootfs / source.lstrip('/')
+            mount_point.mkdir(parents=True, exist_ok=True)
+            if os.path.ismount(mount_point):
+                continue
+            completed = subprocess.run(
+                ["mount", *options.split(), source if options.startswith("--") else "proc", str(mount_point)],
+                capture_output=True, text=True
+            )
+            if completed.returncode != 0:
+                self.stop()
+                raise RuntimeError(f"無法掛載 {mount_point}: {completed.stderr.strip()}")
+            self.mounted.append(mount_point)
+
+    def sandbox_path(self, relative: str) -> str:
+        return f"{SANDBOX_MOUNT}/{relative}"
+
+    def run(self, script: str, env: Dict[str, str], timeout: float):
+        return subprocess.run(
+            ["chroot", str(self.rootfs), "/bin/bash", "-c",
+             f"cd {shlex.quote(env['HOME'])} && exec bash {shlex.quote(script)}"],
+            env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True,
+            errors='replace', timeout=timeout
+        )
+
+    def stop(self):
+        for mount_point in reversed(self.mounted):
+            subprocess.run(["umount", "--recursive", "--lazy", str(mount_point)], capture_output=True)
+        self.mounted = []
+        target = self.rootfs / SANDBOX_MOUNT.lstrip('/')
+        if target.exists():
+            if (target / "stub-calls.log").exists():
+                shutil.copy2(target / "stub-calls.log", self.work_dir / "stub-calls.log")
+            shutil.rmtree(target, ignore_errors=True)
+
+
+class ContainerBackend:
+    """
+    在 docker 或 podman 容器中執行，所有步驟共用同一個容器以保留前面步驟的變更
+
+    工作目錄掛載到容器內的 /block-sandbox（SANDBOX_MOUNT），結束後刪除容器。
+    """
+
+    name = "container"
+
+    def __init__(self, image: str, runtime: str = None):
+        self.image = image
+        self.runtime = runtime or next((name for name in ("docker", "podman") if shutil.which(name)), None)
+        self.container_id = None
+
+    def start(self, work_dir: Path):
+        if not self.runtime:
+            raise RuntimeError("找不到 docker 或 podman")
+        completed = subprocess.run(
+            [self.runtime, "run", "-d", "--rm", "-v", f"{work_dir}:{SANDBOX_MOUNT}",
+             self.image, "sleep", "infinity"],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            raise RuntimeError(f"無法啟動容器 {self.image}: {completed.stderr.strip()}")
+        self.container_id = completed.stdout.strip()
+        subprocess.run(
+            [self.runtime, "exec", self.container_id, "sh", "-c",
+             "mkdir -p /var/lib/cloud/instance && touch /var/lib/cloud/instance/boot-finished"],
+            capture_output=True
+        )
+
+    def sandbox_path(self, relative: str) -> str:
+        return f"{SANDBOX_MOUNT}/{relative}"
+
+    def run(self, script: str, env: Dict[str, str], timeout: float):
+        command = [self.runtime, "exec", "-w", env['HOME']]
+        for key, value in env.items():
+            command += ["-e", f"{key}={value}"]
+        command += [self.container_id, "bash", script]
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              text=True, errors='replace', timeout=timeout)
+
+    def stop(self):
+        if self.container_id:
+            subprocess.run([self.runtime, "rm", "-f", self.container_id], capture_output=True)
+            self.container_id = None
+
+
+def _read_stub_calls(path: Path) -> Dict[int, List[str]]:
+    calls = {}
+    try:
+        lines = path.read_text(encoding='utf-8', errors='replace').splitlines()
+    except OSError:
+        return calls
+    for line in lines:
+        index, _, command = line.partition("\t")
+        if index.isdigit():
+            calls.setdefault(int(index), []).append(command)
+    return calls
+
+
+def run_plan(plan_steps: List[Dict[str, Any]], backend, os_family: str = "debian",
+             stub_packages: bool = True, extra_stubs: List[str] = None,
+             timeout: float = 600, keep_going: bool = False, work_dir: str = None,
+             on_result=None) -> Dict[str, Any]:
+    """
+    在沙箱中依序執行計畫步驟，回傳每個步驟的結束代碼、耗時與替身指令呼叫
+
+    預設與 run.sh 相同，任一步驟失敗即停止；keep_going 時繼續執行其餘步驟。
+    """
+    stubs = list(SERVICE_STUBS) + list(extra_stubs or [])
+    if stub_packages:
+        stubs += list(PACKAGE_STUBS)
+    cleanup = work_dir is None
+    work_path = Path(work_dir or tempfile.mkdtemp(prefix="block-sandbox-")).resolve()
+    entries = prepare_workspace(work_path, plan_steps, stubs)
+
+    results = []
+    started = time.perf_counter()
+    backend.start(work_path)
+    try:
+        base_env = {
+            'PATH': ":".join([backend.sandbox_path("bin"), "/usr/local/sbin", "/usr/local/bin",
+                              "/usr/sbin", "/usr/bin", "/sbin", "/bin"]),
+            'HOME': backend.sandbox_path("home"),
+            'LANG': "C.UTF-8",
+            'TERM': "dumb",
+            'SANDBOX_LOG': backend.sandbox_path("stub-calls.log")
+        }
+        if os_family == "debian":
+            base_env['DEBIAN_FRONTEND'] = "noninteractive"
+        if any(step['block'] == PACKAGES_BLOCK for step in plan_steps):
+            base_env[PREINSTALLED_ENV] = "1"
+
+        stopped = False
+        for entry in entries:
+            step = entry['step']
+            result = {
+                'index': entry['index'],
+                'block': step['block'],
+                'step': step['step'],
+                'phase': step['phase'],
+                'status': 'skipped',
+                'exit_code': None,
+                'seconds': 0.0
+            }
+            if stopped:
+                results.append(result)
+                continue
+
+            env = dict(base_env, SANDBOX_STEP=str(entry['index']))
+            step_started = time.perf_counter()
+            try:
+                completed = backend.run(backend.sandbox_path(f"steps/{entry['file']}"), env, timeout)
+                output = completed.stdout or ""
+                result['exit_code'] = completed.returncode
+                result['status'] = 'success' if completed.returncode == 0 else 'failed'
+            except subprocess.TimeoutExpired as e:
+                output = e.stdout if isinstance(e.stdout, str) else (e.stdout or b"").decode(errors='replace')
+                result['status'] = 'timeout'
+            result['seconds'] = round(time.perf_counter() - step_started, 3)
+            (work_path / "logs" / f"{entry['file'][:-3]}.log").write_text(output, encoding='utf-8')
+            if result['status'] != 'success':
+                result['output_tail'] = output.splitlines()[-OUTPUT_TAIL_LINES:]
+                stopped = not keep_going
+            results.append(result)
+            if on_result:
+                on_result(result)
+    finally:
+        backend.stop()
+
+    stub_calls = _read_stub_calls(work_path / "stub-calls.log")
+    for result in results:
+        result['stub_calls'] = stub_calls.get(result['index'], [])
+
+    report = {
+        'backend': backend.name,
+        'os_family': os_family,
+        'total_seconds': round(time.perf_counter() - started, 3),
+        'succeeded': sum(1 for r in results if r['status'] == 'success'),
+        'failed': sum(1 for r in results if r['status'] in ('failed', 'timeout')),
+        'skipped': sum(1 for r in results if r['status'] == 'skipped'),
+        'steps': results,
+        'work_dir': None if cleanup else str(work_path)
+    }
+    if cleanup:
+        shutil.rmtree(work_path, ignore_errors=True)
+    return report
+
+
+def write_sandbox_report(report: Dict[str, Any], output_path: str) -> Path:
+    """寫出沙箱執行結果"""
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    return output_path
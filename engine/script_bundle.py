@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+腳本包產生器 - 將執行計畫的所有腳本打包成單一內容定址的壓縮檔，並附上執行器
+"""
+
+import gzip
+import hashlib
+import io
+import json
+import re
+import shlex
+import tarfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+from package_plan import PACKAGES_BLOCK, invokes_package_manager
+
+BUNDLE_PREFIX = "blocks-bundle"
+
+# 腳本包在實例上解開的位置；基礎積木的清理腳本會執行 rm -rf /tmp/*，執行器的狀態目錄不可放在 /tmp
+REMOTE_BUNDLE_DIR = "/var/lib/block-bundle"
+
+# 並行執行器依序處理的階段；同一階段內 main 依依賴、validate 彼此獨立並行，其他階段依序執行
+RUNNER_PHASES = ("main", "custom", "validate", "cleanup")
+PARALLEL_PHASES = ("main", "validate")
+
+# 並行執行器輪詢單元狀態的間隔秒數
+POLL_INTERVAL = 0.2
+
+# 並行執行器整體的逾時秒數，可在實例上以 BLOCK_BUNDLE_TIMEOUT 環境變數覆蓋
+RUN_TIMEOUT = 3 * 3600
+
+
+def _step_filename(index: int, step: Dict[str, Any]) -> str:
+    """產生腳本在包內的檔名，保留執行序號方便除錯"""
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '-', f"{step['block']}-{step['step']}")
+    return f"{index:03d}-{name}.sh"
+
+
+def plan_segments(entries: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    在預期會中斷 SSH 連線的步驟前後切分執行段，並在每個步驟記錄所屬的段
+
+    同一積木連續的 expect_disconnect 步驟自成一段，由設定 expect_disconnect 的 provisioner 執行；
+    下一段由新的 provisioner（新的 SSH 連線）執行，例如加入 docker 群組後需要重新登入才會生效。
+    """
+    segments = []
+    for entry in entries:
+        disconnect = bool(entry.get('expect_disconnect'))
+        last = segments[-1] if segments else None
+        if last is None or last['disconnect'] != disconnect or (disconnect and last['block'] != entry['block']):
+            last = {'id': len(segments) + 1, 'block': entry['block'], 'disconnect': disconnect}
+            segments.append(last)
+        entry['segment'] = last['id']
+    return [{'id': segment['id'], 'disconnect': segment['disconnect']} for segment in segments]
+
+
+def _segment_lines(segment_ids: List[int], init: List[str] = (), resume: List[str] = ()) -> List[str]:
+    """
+    產生分段執行的輔助函式與參數處理
+
+    run.sh 不帶參數時依序執行所有段；--start <段> 以 setsid 在背景執行該段（SSH 中斷也不會被終止），
+    並等待其結束；--await <段> 只等待先前啟動的段結束，並接著輸出尚未輸出的日誌。
+    每段的結束代碼寫入 segments/<段>.rc，下一個 provisioner 以 --await 確認上一段確實成功。
+    init 只在第一段或完整執行時執行，resume 在之後的段開始前執行。
+    """
+    last = segment_ids[-1]
+    lines = [
+        'SEGMENT_DIR="${BUNDLE_DIR}/segments"',
+        f'SEGMENT_TIMEOUT="${{BLOCK_BUNDLE_TIMEOUT:-{RUN_TIMEOUT}}}"',
+        "",
+        "# 在新的 session 中執行一段，日誌與結束代碼寫入 SEGMENT_DIR",
+        "start_segment() {",
+        '    local segment="$1"',
+        '    mkdir -p "${SEGMENT_DIR}"',
+        '    setsid nohup bash "${BUNDLE_DIR}/run.sh" --segment "${segment}" \\',
+        '        > "${SEGMENT_DIR}/${segment}.log" 2>&1 < /dev/null &',
+        '    await_segment "${segment}"',
+        "}",
+        "",
+        "# 輸出該段尚未輸出的日誌，直到結束代碼出現；段已不在執行卻沒有結束代碼時失敗",
+        "await_segment() {",
+        '    local segment="$1" offset=0 size done pid',
+        '    local log="${SEGMENT_DIR}/${segment}.log" started',
+        "    started=$(date +%s)",
+        '    [ -f "${SEGMENT_DIR}/${segment}.offset" ] && offset=$(cat "${SEGMENT_DIR}/${segment}.offset")',
+        "    while :; do",
+        '        if [ ! -d "${SEGMENT_DIR}" ]; then',
+        '            echo "==> 狀態目錄 ${SEGMENT_DIR} 已被刪除，無法確認第 ${segment} 段的結果" >&2',
+        "            return 1",
+        "        fi",
+        '        done=0',
+        '        [ -f "${SEGMENT_DIR}/${segment}.rc" ] && done=1',
+        '        if [ -f "${log}" ]; then',
+        '            size=$(wc -c < "${log}")',
+        '            if [ "${size}" -gt "${offset}" ]; then',
+        '                tail -c +"$((offset + 1))" "${log}" | head -c "$((size - offset))"',
+        '                offset="${size}"',
+        '                echo "${offset}" > "${SEGMENT_DIR}/${segment}.offset"',
+        "            fi",
+        "        fi",
+        '        if [ "${done}" -eq 1 ]; then',
+        '            return "$(cat "${SEGMENT_DIR}/${segment}.rc")"',
+        "        fi",
+        '        pid=$(cat "${SEGMENT_DIR}/${segment}.pid" 2>/dev/null)',
+        '        if [ -n "${pid}" ] && ! kill -0 "${pid}" 2>/dev/null && [ ! -f "${SEGMENT_DIR}/${segment}.rc" ]; then',
+        '            echo "==> 第 ${segment} 段已結束但沒有寫出結束代碼" >&2',
+        "            return 1",
+        "        fi",
+        '        if [ -z "${pid}" ] && [ "$(( $(date +%s) - started ))" -ge 60 ]; then',
+        '            echo "==> 第 ${segment} 段沒有啟動" >&2',
+        "            return 1",
+        "        fi",
+        '        if [ "$(( $(date +%s) - started ))" -ge "${SEGMENT_TIMEOUT}" ]; then',
+        '            echo "==> 等待第 ${segment} 段超過 ${SEGMENT_TIMEOUT} 秒" >&2',
+        "            return 1",
+        "        fi",
+        f"        sleep {POLL_INTERVAL}",
+        "    done",
+        "}",
+        "",
+        'case "${1:-}" in',
+        "    --start)",
+        '        start_segment "$2"',
+        "        exit $?",
+        "        ;;",
+        "    --await)",
+        '        await_segment "$2"',
+        "        exit $?",
+        "        ;;",
+        "    --segment)",
+        '        SEGMENT="$2"',
+        '        echo "$$" > "${SEGMENT_DIR}/${SEGMENT}.pid"',
+        '        trap \'rc=$?; echo "${rc}" > "${SEGMENT_DIR}/${SEGMENT}.tmp" && mv "${SEGMENT_DIR}/${SEGMENT}.tmp" "${SEGMENT_DIR}/${SEGMENT}.rc"\' EXIT',
+    ]
+    if init or resume:
+        lines.append('        if [ "${SEGMENT}" = "1" ]; then')
+        lines.extend("            " + line for line in init or [":"])
+        lines.append("        else")
+        lines.extend("            " + line for line in resume or [":"])
+        lines.append("        fi")
+    lines.extend([
+        '        "segment_${SEGMENT}"',
+        f'        [ "${{SEGMENT}}" = "{last}" ] && echo "==> 全部 ${{TOTAL}} 個步驟執行完成"',
+        "        exit 0",
+        "        ;;",
+        "esac",
+        ""
+    ])
+    lines.extend(init)
+    lines.extend(f"segment_{segment_id}" for segment_id in segment_ids)
+    return lines
+
+
+def _segment_functions(body_by_segment: Dict[int, List[str]]) -> List[str]:
+    lines = []
+    for segment_id, body in body_by_segment.items():
+        lines.append(f"segment_{segment_id}() {{")
+        lines.extend("    " + line for line in body)
+        lines.append("}")
+        lines.append("")
+    return lines
+
+
+def render_runner(entries: List[Dict[str, Any]], segments: List[Dict[str, Any]] = None) -> str:
+    """
+    產生在實例上依序執行每個步驟的 run.sh，任一步驟失敗即停止
+
+    指定 segments（plan_segments() 的結果）且超過一段時，run.sh 另外支援分段執行（見 _segment_lines）。
+    """
+    lines = [
+        "#!/bin/bash",
+        "# 由 block-composer.py 產生的積木執行器，請勿手動修改",
+        "set -uo pipefail",
+        "",
+        'BUNDLE_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"',
+        f"TOTAL={len(entries)}",
+        "",
+        "run_step() {",
+        '    local index="$1" block="$2" step="$3" script="$4"',
+        "    local started rc",
+        "    started=$(date +%s)",
+        '    echo "==> [${index}/${TOTAL}] ${block}: ${step} 開始"',
+        '    bash "${BUNDLE_DIR}/steps/${script}"',
+        "    rc=$?",
+        '    if [ "${rc}" -ne 0 ]; then',
+        '        echo "==> [${index}/${TOTAL}] ${block}: ${step} 失敗 (exit ${rc})" >&2',
+        '        exit "${rc}"',
+        "    fi",
+        '    echo "==> [${index}/${TOTAL}] ${block}: ${step} 完成 ($(( $(date +%s) - started ))s)"',
+        "}",
+        ""
+    ]
+    calls = {}
+    for entry in entries:
+        args = [str(entry['index']), entry['block'], entry['step'], entry['file']]
+        calls.setdefault(entry.get('segment', 1), []).append(
+            "run_step " + " ".join(shlex.quote(arg) for arg in args)
+        )
+    if segments and len(segments) > 1:
+        lines.extend(_segment_functions(calls))
+        lines.extend(_segment_lines(list(calls)))
+    else:
+        lines.extend(line for segment_calls in calls.values() for line in segment_calls)
+    lines.append("")
+    lines.append('echo "==> 全部 ${TOTAL} 個步驟執行完成"')
+    return "\n".join(lines) + "\n"
+
+
+def plan_units(entries: List[Dict[str, Any]],
+               dependencies: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+    """
+    將步驟分組為並行執行器的執行單元
+
+    主要安裝階段每個積木的連續步驟為一個單元，依 dependencies 等待上游積木的單元；
+    驗證階段每個步驟各自為一個彼此獨立的單元；自定義腳本與清理階段的單元依序串接。
+    """
+    units = []
+    main_units = {}
+    for entry in entries:
+        phase = entry['phase']
+        previous = units[-1] if units else None
+        if (phase == 'main' and previous and previous['phase'] == 'main'
+                and previous['block'] == entry['block']):
+            previous['entries'].append(entry)
+            continue
+
+        unit_id = len(units) + 1
+        if phase == 'main':
+            label = entry['block']
+            after = [main_units[block_id] for block_id in dependencies.get(entry['block'], [])
+                     if block_id in main_units]
+            main_units[entry['block']] = unit_id
+        else:
+            label = f"{entry['block']}/{entry['step']}"
+            after = []
+            if phase not in PARALLEL_PHASES and previous and previous['phase'] == phase:
+                after = [previous['id']]
+        units.append({
+            'id': unit_id,
+            'label': label,
+            'block': entry['block'],
+            'phase': phase,
+            'after': after,
+            'entries': [entry]
+        })
+    return units
+
+
+def plan_unit_segments(units: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    依單元的依賴切分並行執行器的執行段，並在每個步驟記錄所屬的段
+
+    只有依賴 expect_disconnect 單元的單元需要等到下一段（新的 SSH 連線）；彼此獨立的單元不論是否會中斷連線，
+    都在同一段內並行執行，含有會中斷連線單元的段由設定 expect_disconnect 的 provisioner 執行。
+    主要安裝階段之後的單元排在所有會中斷連線的單元之後的段。
+    """
+    segment_of = {}
+    main_end = 1
+    for unit in units:
+        disconnect = any(entry.get('expect_disconnect') for entry in unit['entries'])
+        if unit['phase'] == 'main':
+            segment = max([segment_of[dep] + units[dep - 1]['disconnect'] for dep in unit['after']] or [1])
+            main_end = max(main_end, segment + disconnect)
+        else:
+            segment = main_end
+        unit['disconnect'] = disconnect
+        segment_of[unit['id']] = segment
+        for entry in unit['entries']:
+            entry['segment'] = segment
+    return [
+        {'id': segment_id,
+         'disconnect': any(unit['disconnect'] for unit in units if segment_of[unit['id']] == segment_id)}
+        for segment_id in sorted(set(segment_of.values()))
+    ]
+
+
+def render_concurrent_runner(entries: List[Dict[str, Any]], units: List[Dict[str, Any]],
+                             workers: int, segments: List[Dict[str, Any]] = None) -> str:
+    """
+    產生並行執行彼此獨立積木的 run.sh
+
+    每個單元的輸出寫入 logs/<單元>.log，完成後依計畫順序加上 [積木] 前綴輸出；
+    開始/完成標記即時輸出，供時間剖析使用。會呼叫套件管理工具的步驟以 flock 互斥。
+    任一單元失敗後不再啟動新單元，等待執行中的單元結束後以該單元的結束代碼停止。
+    狀態目錄被刪除或超過 RUN_TIMEOUT 時終止執行中的單元並失敗，不會無限期輪詢。
+    指定超過一段的 segments 時，每段只執行該段的單元，之後的段從狀態目錄讀回先前單元的結束代碼。
+    """
+    init = ['rm -rf "${LOG_DIR}" "${STATE_DIR}" && mkdir -p "${LOG_DIR}" "${STATE_DIR}"']
+    lines = [
+        "#!/bin/bash",
+        "# 由 block-composer.py 產生的積木執行器，請勿手動修改",
+        "set -uo pipefail",
+        "",
+        'BUNDLE_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"',
+        f"TOTAL={len(entries)}",
+        f"WORKERS={workers}",
+        'LOG_DIR="${BUNDLE_DIR}/logs"',
+        'STATE_DIR="${BUNDLE_DIR}/state"',
+        'PACKAGE_LOCK="${BUNDLE_DIR}/packages.lock"',
+        f'RUN_TIMEOUT="${{BLOCK_BUNDLE_TIMEOUT:-{RUN_TIMEOUT}}}"',
+        'DEADLINE=$(( $(date +%s) + RUN_TIMEOUT ))',
+        "",
+        "# 標記直接寫到原本的輸出，積木本身的輸出先寫入各自的日誌",
+        "exec 3>&1 4>&2",
+        "",
+        "UNIT_LABELS=(''" + "".join(" " + shlex.quote(unit['label']) for unit in units) + ")",
+        "UNIT_DEPS=(''" + "".join(" " + shlex.quote(" ".join(str(d) for d in unit['after']))
+                              for unit in units) + ")",
+        "UNIT_PIDS=()",
+        "UNIT_RCS=()",
+        "UNIT_FLUSHED=()",
+        "",
+        "run_step() {",
+        '    local index="$1" block="$2" step="$3" script="$4" locked="$5"',
+        "    local started rc",
+        "    started=$(date +%s)",
+        '    echo "==> [${index}/${TOTAL}] ${block}: ${step} 開始" >&3',
+        '    if [ "${locked}" = "1" ]; then',
+        '        flock "${PACKAGE_LOCK}" bash "${BUNDLE_DIR}/steps/${script}"',
+        "    else",
+        '        bash "${BUNDLE_DIR}/steps/${script}"',
+        "    fi",
+        "    rc=$?",
+        '    if [ "${rc}" -ne 0 ]; then',
+        '        echo "==> [${index}/${TOTAL}] ${block}: ${step} 失敗 (exit ${rc})" >&4',
+        '        return "${rc}"',
+        "    fi",
+        '    echo "==> [${index}/${TOTAL}] ${block}: ${step} 完成 ($(( $(date +%s) - started ))s)" >&3',
+        "}",
+        ""
+    ]
+    for unit in units:
+        lines.append(f"unit_{unit['id']}() {{")
+        calls = []
+        for entry in unit['entries']:
+            args = [str(entry['index']), entry['block'], entry['step'], entry['file'],
+                    "1" if entry.get('locked') else "0"]
+            calls.append("    run_step " + " ".join(shlex.quote(arg) for arg in args))
+        lines.append(" || return\n".join(calls))
+        lines.append("}")
+        lines.append("")
+
+    lines.extend([
+        "start_unit() {",
+        '    local unit="$1"',
+        "    (",
+        '        "unit_${unit}"',
+        "        rc=$?",
+        '        echo "${rc}" > "${STATE_DIR}/${unit}.tmp" && mv "${STATE_DIR}/${unit}.tmp" "${STATE_DIR}/${unit}.rc"',
+        '        exit "${rc}"',
+        '    ) > "${LOG_DIR}/${unit}.log" 2>&1 &',
+        "    UNIT_PIDS[${unit}]=$!",
+        "}",
+        "",
+        "flush_log() {",
+        '    local unit="$1"',
+        '    if [ -f "${LOG_DIR}/${unit}.log" ]; then',
+        '        awk -v prefix="[${UNIT_LABELS[${unit}]}] " \'{ print prefix $0 }\' "${LOG_DIR}/${unit}.log"',
+        "    fi",
+        "    UNIT_FLUSHED[${unit}]=1",
+        "}",
+        "",
+        "# 終止所有執行中的單元",
+        "abort_units() {",
+        "    local unit",
+        "    for unit in $*; do",
+        '        if [ -n "${UNIT_PIDS[${unit}]:-}" ]; then',
+        '            kill "${UNIT_PIDS[${unit}]}" 2>/dev/null',
+        '            wait "${UNIT_PIDS[${unit}]}" 2>/dev/null',
+        '            UNIT_PIDS[${unit}]=""',
+        "        fi",
+        "    done",
+        "}",
+        "",
+        "# 參數為依計畫順序排列的單元編號，上游單元皆成功後才啟動，同時最多 WORKERS 個",
+        "run_units() {",
+        '    local order="$*" pending="$*" remaining unit dep ready running=0 failed=0',
+        "    while :; do",
+        '        if [ ! -d "${STATE_DIR}" ]; then',
+        '            echo "==> 狀態目錄 ${STATE_DIR} 已被刪除，無法追蹤執行中的單元" >&4',
+        "            abort_units ${order}",
+        "            return 1",
+        "        fi",
+        '        if [ "$(date +%s)" -ge "${DEADLINE}" ]; then',
+        '            echo "==> 執行超過 ${RUN_TIMEOUT} 秒，終止執行中的單元" >&4',
+        "            abort_units ${order}",
+        "            return 1",
+        "        fi",
+        "        for unit in ${order}; do",
+        '            [ -n "${UNIT_PIDS[${unit}]:-}" ] || continue',
+        '            if [ -f "${STATE_DIR}/${unit}.rc" ]; then',
+        '                wait "${UNIT_PIDS[${unit}]}"',
+        '                UNIT_RCS[${unit}]=$(cat "${STATE_DIR}/${unit}.rc")',
+        '            elif ! kill -0 "${UNIT_PIDS[${unit}]}" 2>/dev/null; then',
+        "                # 單元已結束卻沒有寫出狀態檔，改用子行程的結束代碼",
+        '                wait "${UNIT_PIDS[${unit}]}"',
+        "                UNIT_RCS[${unit}]=$?",
+        '                echo "==> ${UNIT_LABELS[${unit}]} 沒有寫出狀態檔 (exit ${UNIT_RCS[${unit}]})" >&4',
+        "            else",
+        "                continue",
+        "            fi",
+        '            UNIT_PIDS[${unit}]=""',
+        "            running=$((running - 1))",
+        '            if [ "${UNIT_RCS[${unit}]}" -ne 0 ] && [ "${failed}" -eq 0 ]; then',
+        '                failed="${UNIT_RCS[${unit}]}"',
+        "            fi",
+        "        done",
+        "        for unit in ${order}; do",
+        '            [ -n "${UNIT_RCS[${unit}]:-}" ] || break',
+        '            [ -n "${UNIT_FLUSHED[${unit}]:-}" ] || flush_log "${unit}"',
+        "        done",
+        "",
+        '        if [ "${failed}" -eq 0 ]; then',
+        '            remaining=""',
+        "            for unit in ${pending}; do",
+        "                ready=1",
+        "                for dep in ${UNIT_DEPS[${unit}]}; do",
+        '                    if [ "${UNIT_RCS[${dep}]:-}" != "0" ]; then',
+        "                        ready=0",
+        "                        break",
+        "                    fi",
+        "                done",
+        '                if [ "${ready}" -eq 1 ] && [ "${running}" -lt "${WORKERS}" ]; then',
+        '                    start_unit "${unit}"',
+        "                    running=$((running + 1))",
+        "                else",
+        '                    remaining="${remaining} ${unit}"',
+        "                fi",
+        "            done",
+        '            pending="${remaining}"',
+        "        fi",
+        '        [ "${running}" -gt 0 ] || break',
+        f"        sleep {POLL_INTERVAL}",
+        "    done",
+        "",
+        "    # 失敗時其後已完成的單元仍需輸出日誌",
+        "    for unit in ${order}; do",
+        '        if [ -n "${UNIT_RCS[${unit}]:-}" ] && [ -z "${UNIT_FLUSHED[${unit}]:-}" ]; then',
+        '            flush_log "${unit}"',
+        "        fi",
+        "    done",
+        '    if [ "${failed}" -ne 0 ]; then',
+        '        return "${failed}"',
+        "    fi",
+        '    if [ -n "${pending// /}" ]; then',
+        '        echo "==> 無法排程的單元:${pending}" >&4',
+        "        return 1",
+        "    fi",
+        "}",
+        ""
+    ])
+    segment_of = {unit['id']: unit['entries'][0].get('segment', 1) for unit in units}
+    calls = {}
+    for segment_id in sorted(set(segment_of.values())):
+        for phase in RUNNER_PHASES:
+            unit_ids = [str(unit['id']) for unit in units
+                        if unit['phase'] == phase and segment_of[unit['id']] == segment_id]
+            if unit_ids:
+                calls.setdefault(segment_id, []).append(f"run_units {' '.join(unit_ids)} || exit $?")
+
+    if segments and len(segments) > 1:
+        lines.extend([
+            "# 之後的段在新的行程中執行，先讀回先前單元的結束代碼作為依賴條件",
+            "load_unit_states() {",
+            "    local rc_file unit",
+            '    for rc_file in "${STATE_DIR}"/*.rc; do',
+            '        [ -f "${rc_file}" ] || continue',
+            '        unit=$(basename "${rc_file}" .rc)',
+            '        UNIT_RCS[${unit}]=$(cat "${rc_file}")',
+            "        UNIT_FLUSHED[${unit}]=1",
+            "    done",
+            "}",
+            ""
+        ])
+        lines.extend(_segment_functions(calls))
+        lines.extend(_segment_lines(list(calls), init, ['mkdir -p "${LOG_DIR}" "${STATE_DIR}"', "load_unit_states"]))
+    else:
+        lines.extend(init)
+        lines.extend(line for segment_calls in calls.values() for line in segment_calls)
+    lines.append("")
+    lines.append('echo "==> 全部 ${TOTAL} 個步驟執行完成"')
+    return "\n".join(lines) + "\n"
+
+
+def _add_file(archive: tarfile.TarFile, name: str, data: bytes, mode: int = 0o644):
+    """以固定的 metadata 加入檔案，確保相同內容產生相同的壓縮檔"""
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = mode
+    info.mtime = 0
+    info.uid = info.gid = 0
+    info.uname = info.gname = "root"
+    archive.addfile(info, io.BytesIO(data))
+
+
+def build_script_bundle(plan_steps: List[Dict[str, Any]], output_dir: str,
+                        dependencies: Dict[str, List[str]] = None, workers: int = 1) -> Dict[str, Any]:
+    """
+    將執行計畫打包成 blocks-bundle-<sha256>.tar.gz
+
+    檔名取自壓縮檔內容的雜湊，內容相同時直接重用既有的檔案。
+    workers 大於 1 時產生並行執行器，dependencies 為主要安裝階段 {積木: [上游積木]}。
+    回傳的 segments 供 packer_template 為每段產生一個 provisioner。
+    """
+    concurrent = workers > 1
+    preinstalled = any(step['block'] == PACKAGES_BLOCK for step in plan_steps)
+    entries = []
+    files = {}
+    for index, step in enumerate(plan_steps, 1):
+        filename = _step_filename(index, step)
+        if 'inline' in step:
+            data = f"#!/bin/bash\nset -e\n{step['inline']}\n".encode('utf-8')
+        else:
+            data = Path(step['script']).read_bytes()
+        files[f"steps/{filename}"] = data
+        entry = {
+            'index': index,
+            'block': step['block'],
+            'step': step['step'],
+            'phase': step['phase'],
+            'file': filename
+        }
+        if concurrent:
+            entry['locked'] = invokes_package_manager(data.decode('utf-8', errors='replace'), preinstalled)
+        if step.get('expect_disconnect'):
+            entry['expect_disconnect'] = True
+        entries.append(entry)
+
+    # 沒有會中斷連線的步驟時維持單一段，產生的執行器與先前相同；
+    # 依序執行時段為計畫中連續的步驟，並行執行時依單元的依賴切分
+    units = plan_units(entries, dependencies or {}) if concurrent else None
+    segments = [{'id': 1, 'disconnect': False}]
+    if any(entry.get('expect_disconnect') for entry in entries):
+        segments = plan_unit_segments(units) if concurrent else plan_segments(entries)
+    if len(segments) == 1:
+        for entry in entries:
+            entry.pop('segment', None)
+
+    if concurrent:
+        runner = render_concurrent_runner(entries, units, workers, segments)
+        plan = {
+            'steps': entries,
+            'workers': workers,
+            'units': [{key: unit[key] for key in ('id', 'label', 'phase', 'after')} for unit in units]
+        }
+    else:
+        runner = render_runner(entries, segments)
+        plan = {'steps': entries}
+    if len(segments) > 1:
+        plan['segments'] = segments
+    plan = json.dumps(plan, indent=2, ensure_ascii=False).encode('utf-8')
+
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode='w', format=tarfile.USTAR_FORMAT) as archive:
+        _add_file(archive, "run.sh", runner.encode('utf-8'), 0o755)
+        _add_file(archive, "plan.json", plan)
+        for name in sorted(files):
+            _add_file(archive, name, files[name], 0o755)
+
+    gz_buffer = io.BytesIO()
+    with gzip.GzipFile(filename="", mode='wb', fileobj=gz_buffer, mtime=0) as gz:
+        gz.write(tar_buffer.getvalue())
+    data = gz_buffer.getvalue()
+
+    digest = hashlib.sha256(data).hexdigest()
+    name = f"{BUNDLE_PREFIX}-{digest[:16]}.tar.gz"
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    path = output_dir / name
+    reused = path.exists()
+    if not reused:
+        tmp_path = path.with_suffix('.tmp')
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+    return {
+        'name': name,
+        'path': str(path.resolve()),
+        'sha256': digest,
+        'size': len(data),
+        'steps': len(entries),
+        'workers': workers,
+        'segments': segments,
+        'reused': reused
+    }
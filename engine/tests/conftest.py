@@ -0,0 +1,29 @@
+"""engine 模組為扁平結構並以 sys.path 互相匯入，測試前先把 engine 目錄加入路徑"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+ENGINE_DIR = Path(__file__).resolve().parent.parent
+BLOCKS_DIR = ENGINE_DIR.parent / "blocks"
+if str(ENGINE_DIR) not in sys.path:
+    sys.path.insert(0, str(ENGINE_DIR))
+
+
+def load_block_composer():
+    """block-composer.py 的檔名含連字號，無法直接 import"""
+    module = sys.modules.get("block_composer")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("block_composer", ENGINE_DIR / "block-composer.py")
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["block_composer"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def composer():
+    """以 repo 內的積木建立組合器，不讀寫註冊表快取"""
+    return load_block_composer().BlockComposer(str(BLOCKS_DIR), use_cache=False)
@@ -0,0 +1,119 @@
+"""以替身 EC2 client 測試 AMI 保留規則與清理"""
+
+from datetime import datetime, timezone
+
+from ami_cleanup import CleanupExecutor, RetentionPolicy, build_cleanup_plan
+
+
+class ClientError(Exception):
+    """模擬 botocore ClientError 的 response 結構"""
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class Paginator:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def paginate(self, **kwargs):
+        self.calls.append(kwargs)
+        return self.pages(**kwargs)
+
+
+class StubEc2:
+    """依 Filters 的 tag: 條件列出 AMI，describe_images 每頁 2 筆；前幾次刪除快照回傳 InUse"""
+
+    def __init__(self, images, instances=(), snapshot_in_use=0):
+        self.images = {image['ImageId']: image for image in images}
+        self.instances = list(instances)
+        self.snapshot_in_use = snapshot_in_use
+        self.deregistered = []
+        self.deleted_snapshots = []
+        self.paginators = {'describe_images': Paginator(self._image_pages),
+                           'describe_instances': Paginator(self._instance_pages)}
+
+    def get_paginator(self, name):
+        return self.paginators[name]
+
+    def _image_pages(self, Owners, Filters):
+        wanted = {f['Name'][4:]: f['Values'][0] for f in Filters if f['Name'].startswith('tag:')}
+        matched = [
+            image for image in self.images.values()
+            if all({t['Key']: t['Value'] for t in image['Tags']}.get(k) == v for k, v in wanted.items())
+        ]
+        return [{'Images': matched[i:i + 2]} for i in range(0, len(matched), 2)]
+
+    def _instance_pages(self, Filters):
+        image_ids = next(f['Values'] for f in Filters if f['Name'] == 'image-id')
+        instances = [{'InstanceId': i, 'ImageId': a} for i, a in self.instances if a in image_ids]
+        return [{'Reservations': [{'Instances': instances}]}]
+
+    def deregister_image(self, ImageId):
+        self.deregistered.append(ImageId)
+
+    def delete_snapshot(self, SnapshotId):
+        if self.snapshot_in_use:
+            self.snapshot_in_use -= 1
+            raise ClientError("InvalidSnapshot.InUse")
+        self.deleted_snapshots.append(SnapshotId)
+
+
+NOW = datetime(2024, 3, 1, tzinfo=timezone.utc)
+
+
+def image(image_id, day, blocks="base-ubuntu-2004,app-docker", packer=True):
+    tags = [{'Key': 'EnabledBlocks', 'Value': blocks}, {'Key': 'Environment', 'Value': 'prod'}]
+    if packer:
+        tags.append({'Key': 'PackerBuild', 'Value': 'true'})
+    return {
+        'ImageId': image_id, 'Name': image_id, 'CreationDate': f"2024-02-{day:02d}T00:00:00.000Z",
+        'Tags': tags,
+        'BlockDeviceMappings': [{'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': f"snap-{image_id}"}}]
+    }
+
+
+def test_plan_keeps_latest_per_group_and_skips_in_use():
+    ec2 = StubEc2(
+        [image("ami-1", 1), image("ami-2", 2), image("ami-3", 3), image("ami-4", 4),
+         image("ami-other", 1, blocks="base-ubuntu-2004"), image("ami-manual", 1, packer=False)],
+        instances=[("i-1", "ami-2")]
+    )
+    plan = build_cleanup_plan(ec2, "us-east-1", RetentionPolicy(keep_latest=2), now=NOW)
+
+    assert plan['images_scanned'] == 5
+    assert plan['groups'] == 2
+    assert [entry['image_id'] for entry in plan['delete']] == ["ami-1"]
+    assert [entry['image_id'] for entry in plan['in_use']] == ["ami-2"]
+    assert plan['in_use'][0]['instances'] == ["i-1"]
+    assert sorted(entry['image_id'] for entry in plan['keep']) == ["ami-3", "ami-4", "ami-other"]
+    assert plan['snapshots'] == 1
+
+
+def test_max_age_respects_min_keep():
+    ec2 = StubEc2([image("ami-1", 1), image("ami-2", 2)])
+    plan = build_cleanup_plan(ec2, "us-east-1", RetentionPolicy(keep_latest=5, max_age_days=10), now=NOW)
+    assert [entry['image_id'] for entry in plan['delete']] == ["ami-1"]
+    assert [entry['image_id'] for entry in plan['keep']] == ["ami-2"]
+
+
+def test_execute_retries_snapshot_in_use():
+    ec2 = StubEc2([image("ami-1", 1), image("ami-2", 2)], snapshot_in_use=2)
+    plan = build_cleanup_plan(ec2, "us-east-1", RetentionPolicy(keep_latest=1), now=NOW)
+    sleeps = []
+    results = CleanupExecutor(ec2, sleep=sleeps.append).run(plan)
+
+    assert ec2.deregistered == ["ami-1"]
+    assert ec2.deleted_snapshots == ["snap-ami-1"]
+    assert results[0]['status'] == 'success'
+    assert len(sleeps) == 2
+
+
+def test_execute_reports_partial_success():
+    ec2 = StubEc2([image("ami-1", 1), image("ami-2", 2)], snapshot_in_use=10)
+    plan = build_cleanup_plan(ec2, "us-east-1", RetentionPolicy(keep_latest=1), now=NOW)
+    results = CleanupExecutor(ec2, retries=1, sleep=lambda seconds: None).run(plan)
+    assert results[0]['status'] == 'partial_success'
+    assert results[0]['failed_snapshots'][0]['error'] == "InvalidSnapshot.InUse"
@@ -0,0 +1,75 @@
+"""以替身 EC2 client 測試 AMI 發佈與跨區域複製"""
+
+from ami_cleanup import DEFAULT_FILTER_TAGS
+from ami_publish import compute_publish_tags, publish_image
+
+
+class StubEc2:
+    """記錄 create_tags / copy_image 呼叫的 EC2 替身，副本第一次查詢為 pending、之後為 available"""
+
+    def __init__(self, region, images, calls):
+        self.region = region
+        self.images = images
+        self.calls = calls
+
+    def create_tags(self, Resources, Tags):
+        self.calls.append(('create_tags', self.region, Resources, len(Tags)))
+        for image_id in Resources:
+            image = self.images[image_id]
+            tags = {tag['Key']: tag['Value'] for tag in image.get('Tags', [])}
+            tags.update({tag['Key']: tag['Value'] for tag in Tags})
+            image['Tags'] = [{'Key': key, 'Value': value} for key, value in tags.items()]
+
+    def describe_images(self, ImageIds):
+        images = []
+        for image_id in ImageIds:
+            image = self.images[image_id]
+            images.append(dict(image))
+            image['State'] = 'available'
+        return {'Images': images}
+
+    def copy_image(self, SourceRegion, SourceImageId, Name, Description):
+        self.calls.append(('copy_image', self.region, SourceImageId))
+        image_id = f"ami-{self.region}"
+        self.images[image_id] = {'ImageId': image_id, 'Name': Name, 'State': 'pending'}
+        return {'ImageId': image_id}
+
+
+def build_config():
+    return {
+        'packer_vars': {'owner': 'platform'},
+        'blocks': {'execution_order': ['base-ubuntu-2004', 'app-docker']},
+        'build_info': {'environment': 'prod', 'fingerprint': 'abc'},
+        'os_info': {'family': 'debian'}
+    }
+
+
+def test_copies_carry_source_and_publish_tags():
+    images = {
+        'ami-source': {
+            'ImageId': 'ami-source', 'Name': 'web-20240101', 'State': 'available',
+            'Tags': [{'Key': 'PackerBuild', 'Value': 'true'}, {'Key': 'Name', 'Value': 'web-20240101'},
+                     {'Key': 'BuildType', 'Value': 'Dynamic'},
+                     {'Key': 'aws:cloudformation:stack-name', 'Value': 'x'}]
+        }
+    }
+    calls = []
+    tags = compute_publish_tags(build_config(), {'base-ubuntu-2004': 'base', 'app-docker': 'application'},
+                                {'JenkinsBuild': '42'})
+    manifest = publish_image(lambda region: StubEc2(region, images, calls), 'ap-northeast-1',
+                             'ami-source', tags, ['us-east-1', 'ap-northeast-1', 'us-east-1'],
+                             poll_interval=0)
+
+    assert manifest['regions'] == {'ap-northeast-1': 'ami-source', 'us-east-1': 'ami-us-east-1'}
+    assert manifest['failed'] == []
+    assert [call[0] for call in calls] == ['create_tags', 'copy_image', 'create_tags']
+
+    copy_tags = {tag['Key']: tag['Value'] for tag in images['ami-us-east-1']['Tags']}
+    for key, value in DEFAULT_FILTER_TAGS.items():
+        assert copy_tags[key] == value
+    assert copy_tags['Name'] == 'web-20240101'
+    assert copy_tags['BuildType'] == 'Dynamic'
+    assert copy_tags['Environment'] == 'prod'
+    assert copy_tags['JenkinsBuild'] == '42'
+    assert copy_tags['Applications'] == 'docker'
+    assert not any(key.startswith('aws:') for key in copy_tags)
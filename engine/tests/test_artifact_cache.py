@@ -0,0 +1,42 @@
+"""以 FakeAmiStore 測試中間層 AMI 快取與建構索引"""
+
+import json
+
+from artifact_cache import AmiLayerCache, BuildIndex, FakeAmiStore
+
+
+def test_longest_prefix_skips_deleted_ami(tmp_path):
+    store = FakeAmiStore(str(tmp_path / "amis.json"))
+    cache = AmiLayerCache(str(tmp_path / "layers.json"))
+    base = store.create_image("ami-base", ["base-ubuntu-2004"], "h1")
+    docker = store.create_image(base, ["base-ubuntu-2004", "app-docker"], "h2")
+    cache.register("h1", base, ["base-ubuntu-2004"])
+    cache.register("h2", docker, ["base-ubuntu-2004", "app-docker"])
+
+    assert cache.find_longest_prefix(["h1", "h2", "h3"], store) == (2, cache.get("h2"))
+
+    store.remove(docker)
+    depth, record = cache.find_longest_prefix(["h1", "h2", "h3"], store)
+    assert (depth, record['ami_id']) == (1, base)
+    # 已不存在的 AMI 從索引移除，並寫回磁碟
+    assert AmiLayerCache(str(tmp_path / "layers.json")).get("h2") is None
+
+
+def test_fake_store_ids_are_deterministic(tmp_path):
+    first = FakeAmiStore(str(tmp_path / "a.json")).create_image("ami-base", ["x"], "h1")
+    second = FakeAmiStore(str(tmp_path / "b.json")).create_image("ami-base", ["x"], "h1")
+    assert first == second
+    assert first != FakeAmiStore(str(tmp_path / "c.json")).create_image("ami-base", ["x"], "h2")
+
+
+def test_ingest_manifest_requires_fingerprint(tmp_path):
+    manifest = tmp_path / "packer-manifest.json"
+    manifest.write_text(json.dumps({'builds': [
+        {'artifact_id': 'us-east-1:ami-1', 'packer_run_uuid': 'r1',
+         'custom_data': {'fingerprint': 'f1', 'environment': 'prod'}},
+        {'artifact_id': 'us-east-1:ami-2', 'custom_data': {}}
+    ]}), encoding='utf-8')
+    index = BuildIndex(str(tmp_path / "index.json"))
+    assert index.ingest_manifest(str(manifest)) == 1
+    assert index.find('f1')['ami_id'] == 'ami-1'
+    assert index.find('f1')['region'] == 'us-east-1'
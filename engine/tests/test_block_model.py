@@ -0,0 +1,45 @@
+"""積木模型與舊版 block.yaml 正規化"""
+
+from block_model import normalize_block_definition
+
+
+def test_legacy_dependencies_become_after():
+    block = normalize_block_definition({
+        'name': 'my-app', 'dependencies': ['base-ubuntu-2004'], 'variables': {'port': 8080}
+    }, 'my-app', 'custom')
+    assert block['id'] == 'custom-my-app'
+    assert block['name'] == 'my-app'
+    assert block['after'] == ['base-ubuntu-2004']
+    assert block['parameters'] == [{'name': 'port', 'type': 'integer', 'default': 8080}]
+    assert block['schema'] == 'legacy'
+
+
+def test_legacy_id_follows_category_prefix():
+    block = normalize_block_definition({'name': 'tool'}, 'tool', 'applications')
+    assert (block['id'], block['category']) == ('app-tool', 'application')
+    assert normalize_block_definition({'name': 'x', 'id': 'custom-x'}, 'x', 'custom')['id'] == 'custom-x'
+
+
+def test_readme_example_selection_validates(composer):
+    # README 與 builder.pkr.hcl 使用的範例組合
+    selection = ["base-ubuntu-2004", "app-docker", "custom-my-app", "config-security"]
+    result = composer.validate_dependencies(selection)
+    assert result['valid'], result
+    assert result['execution_order'].index("base-ubuntu-2004") < result['execution_order'].index("custom-my-app")
+
+
+def test_legacy_block_runs_after_listed_block(composer):
+    result = composer.validate_dependencies(["custom-my-app", "base-ubuntu-2004"])
+    assert result['valid']
+    assert result['execution_layers'] == [["base-ubuntu-2004"], ["custom-my-app"]]
+
+
+def test_legacy_base_dependency_falls_back_to_selected_base(composer):
+    result = composer.validate_dependencies(["custom-my-app", "base-amazon-linux-2"])
+    assert result['execution_layers'] == [["base-amazon-linux-2"], ["custom-my-app"]]
+
+
+def test_legacy_block_waits_in_bundle_plan(composer):
+    config = composer.generate_build_config("t", "dev", ["base-ubuntu-2004", "app-docker", "custom-my-app"])
+    dependencies = composer.plan_step_dependencies(config, composer.build_plan_steps(config))
+    assert "base-ubuntu-2004" in dependencies["custom-my-app"]
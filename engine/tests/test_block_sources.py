@@ -0,0 +1,72 @@
+"""多來源積木倉庫: git 鏡像、快取命中與重新取得"""
+
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from block_sources import BlockStore, resolve_sources
+from conftest import ENGINE_DIR
+
+GIT_ENV = dict(os.environ, GIT_AUTHOR_NAME="test", GIT_AUTHOR_EMAIL="test@example.com",
+               GIT_COMMITTER_NAME="test", GIT_COMMITTER_EMAIL="test@example.com")
+
+
+def git(*args, cwd):
+    return subprocess.run(["git", *args], cwd=cwd, env=GIT_ENV, check=True,
+                          capture_output=True, text=True).stdout.strip()
+
+
+def commit_block(work_dir, version):
+    block_dir = work_dir / "blocks" / "applications" / "tool"
+    block_dir.mkdir(parents=True, exist_ok=True)
+    (block_dir / "block.yaml").write_text(f'block:\n  id: "app-tool"\n  version: "{version}"\n', encoding='utf-8')
+    git("add", "-A", cwd=work_dir)
+    git("commit", "--quiet", "-m", version, cwd=work_dir)
+    git("push", "--quiet", "origin", "HEAD:refs/heads/main", cwd=work_dir)
+    return git("rev-parse", "HEAD", cwd=work_dir)
+
+
+def make_remote(tmp_path):
+    remote = tmp_path / "remote.git"
+    git("init", "--quiet", "--bare", "--initial-branch=main", str(remote), cwd=tmp_path)
+    work_dir = tmp_path / "work"
+    git("clone", "--quiet", str(remote), str(work_dir), cwd=tmp_path)
+    return remote, work_dir
+
+
+def test_git_source_mirror_hit_and_refresh(tmp_path):
+    remote, work_dir = make_remote(tmp_path)
+    first = commit_block(work_dir, "1.0")
+    sources = [{'name': "team", 'type': "git", 'url': str(remote), 'ref': "main", 'subdir': "blocks"}]
+
+    store = BlockStore(str(tmp_path / "store"))
+    [root] = resolve_sources(sources, store)
+    assert store.stats == {'hits': 0, 'fetched': 1}
+    assert root['path'] == str(tmp_path / "store" / "objects" / f"git-{first}" / "blocks")
+    assert '"1.0"' in (Path(root["path"]) / "applications/tool/block.yaml").read_text(encoding='utf-8')
+
+    # 索引中已有鏡像時不連線，即使遠端已有新的 commit
+    second = commit_block(work_dir, "2.0")
+    store = BlockStore(str(tmp_path / "store"))
+    assert resolve_sources(sources, store)[0]['path'] == root['path']
+    assert store.stats == {'hits': 1, 'fetched': 0}
+
+    [root] = resolve_sources(sources, store, refresh=True)
+    assert store.stats == {'hits': 1, 'fetched': 1}
+    assert f"git-{second}" in root['path']
+    assert store.prune() == [f"git-{first}"]
+
+
+def test_cli_reports_unresolvable_sources(tmp_path):
+    sources_file = tmp_path / "sources.json"
+    sources_file.write_text(json.dumps({'sources': [
+        {'name': "missing", 'type': "git", 'url': str(tmp_path / "missing.git")}
+    ]}), encoding='utf-8')
+    result = subprocess.run([sys.executable, "block-composer.py", "validate", "base-ubuntu-2004"],
+                            cwd=ENGINE_DIR, env=dict(os.environ, BLOCK_SOURCES=str(sources_file)),
+                            capture_output=True, text=True)
+    assert result.returncode == 1
+    assert result.stderr.startswith("❌ 積木來源解析失敗")
+    assert "Traceback" not in result.stderr
@@ -0,0 +1,109 @@
+"""以 FakeBuilder 測試建構請求的合併與同時建構上限"""
+
+import asyncio
+import sys
+
+from artifact_cache import BuildIndex
+from build_broker import BuildBroker, FakeBuilder, PackerBuilder, simulate
+
+DOCKER = ["base-ubuntu-2004", "app-docker"]
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_identical_requests_share_one_build(composer):
+    builder = FakeBuilder(duration=0.05)
+    broker = BuildBroker(composer, builder)
+    requests = [
+        {'blocks': DOCKER, 'environment': 'prod', 'build_name': 'a'},
+        # 順序、重複積木與建構名稱不影響指紋
+        {'blocks': ["app-docker", "base-ubuntu-2004", "app-docker"], 'environment': 'prod', 'build_name': 'b'},
+        {'blocks': DOCKER, 'environment': 'prod'},
+        {'blocks': DOCKER, 'environment': 'dev'}
+    ]
+    report = run(simulate(broker, requests))
+
+    assert builder.builds == 2
+    assert report['stats']['coalesced'] == 2
+    results = report['results']
+    assert [result['coalesced'] for result in results] == [False, True, True, False]
+    assert len({result['artifact_id'] for result in results[:3]}) == 1
+    assert results[3]['artifact_id'] != results[0]['artifact_id']
+
+
+def test_finished_build_is_not_coalesced_again(composer):
+    builder = FakeBuilder(duration=0.01)
+    broker = BuildBroker(composer, builder)
+    run(broker.submit({'blocks': DOCKER}))
+    result = run(broker.submit({'blocks': DOCKER}))
+    assert builder.builds == 2
+    assert result['coalesced'] is False
+    assert broker.inflight == {}
+
+
+def test_global_and_region_limits(composer):
+    builder = FakeBuilder(duration=0.05)
+    broker = BuildBroker(composer, builder, max_concurrent=3, per_region_limit=2,
+                         region_limits={'us-west-2': 1})
+    regions = ["ap-northeast-1", "us-east-1", "us-west-2"]
+    requests = [
+        {'blocks': DOCKER, 'environment': f"env{index}", 'region': region}
+        for index in range(4) for region in regions
+    ]
+    report = run(simulate(broker, requests))
+
+    assert builder.builds == 12
+    assert report['stats']['succeeded'] == 12
+    assert builder.max_running == 3
+    assert builder.max_running_by_region['ap-northeast-1'] <= 2
+    assert builder.max_running_by_region['us-east-1'] <= 2
+    assert builder.max_running_by_region['us-west-2'] == 1
+
+
+def test_invalid_request_is_rejected(composer):
+    builder = FakeBuilder(duration=0.01)
+    result = run(BuildBroker(composer, builder).submit({'blocks': ["app-docker"]}))
+    assert result['status'] == 'rejected'
+    assert builder.builds == 0
+
+
+def test_index_hit_skips_build(composer, tmp_path):
+    index = BuildIndex(str(tmp_path / "build-index.json"))
+    builder = FakeBuilder(duration=0.01)
+    broker = BuildBroker(composer, builder, build_index=index)
+    first = run(broker.submit({'blocks': DOCKER}))
+    second = run(broker.submit({'blocks': DOCKER}))
+
+    assert builder.builds == 1
+    assert second['status'] == 'reused'
+    assert second['artifact_id'] == first['artifact_id']
+
+
+def fake_packer(tmp_path, mode):
+    """寫出假的 packer 執行檔，與 test_matrix 相同以附加方式寫 manifest"""
+    from test_matrix import FAKE_PACKER
+    script = tmp_path / "packer"
+    script.write_text(f"#!{sys.executable}\nimport sys\nsys.argv[1:] = [{mode!r}]\n" + FAKE_PACKER,
+                      encoding='utf-8')
+    script.chmod(0o755)
+    return str(script)
+
+
+def test_packer_builder_ignores_previous_manifest(composer, tmp_path):
+    config = composer.generate_build_config("t", "dev", DOCKER)
+    work_dir = str(tmp_path / "work")
+    first = run(PackerBuilder(composer, work_dir, fake_packer(tmp_path, "ami-old")).build(config))
+    second = run(PackerBuilder(composer, work_dir, fake_packer(tmp_path, "ami-new")).build(config))
+    assert first['artifact_id'] == "us-east-1:ami-old"
+    assert second['artifact_id'] == "us-east-1:ami-new"
+
+
+def test_packer_builder_interrupts_on_timeout(composer, tmp_path):
+    config = composer.generate_build_config("t", "dev", DOCKER)
+    builder = PackerBuilder(composer, str(tmp_path / "work"), fake_packer(tmp_path, "hang"),
+                            timeout=1, interrupt_grace=10)
+    result = run(builder.build(config))
+    assert result['returncode'] == -1
+    assert list((tmp_path / "work").glob("*/interrupted"))
@@ -0,0 +1,47 @@
+"""自動挑選實例: 歷史剖析與 Packer 變數"""
+
+import json
+import os
+import re
+import subprocess
+import sys
+
+from conftest import ENGINE_DIR
+
+SELECTION = ["base-ubuntu-2004", "app-docker"]
+AUTO = {"instance_type": "auto", "target_minutes": 30}
+
+
+def slow_history(tmp_path):
+    """在 t3.micro 上每個積木都花了 20 分鐘的歷史剖析"""
+    profile = {'instance_type': "t3.micro", 'blocks': {block_id: {'seconds': 1200} for block_id in SELECTION}}
+    (tmp_path / "packer-timing.json").write_text(json.dumps(profile), encoding='utf-8')
+    return tmp_path
+
+
+def test_auto_instance_uses_timing_history(composer, tmp_path):
+    from build_timing import load_profiles
+    assert composer.generate_build_config("t", "dev", SELECTION, parameters=AUTO)['packer_vars'][
+        'instance_type'] == "t3.micro"
+
+    composer.timing_history = load_profiles([str(slow_history(tmp_path))])
+    estimate = composer.generate_build_config("t", "dev", SELECTION, parameters=AUTO)['build_info']['estimate']
+    assert estimate['instance_type'] != "t3.micro"
+    assert estimate['seconds'] <= 30 * 60
+
+
+def test_estimate_cli_reads_history_env(tmp_path):
+    command = [sys.executable, "block-composer.py", "estimate", "--select", "--target-minutes", "30"] + SELECTION
+    env = dict(os.environ, BLOCK_TIMING_HISTORY=str(slow_history(tmp_path)))
+    env.pop("BLOCK_SOURCES", None)
+    selected = subprocess.run(command, cwd=ENGINE_DIR, env=env, capture_output=True, text=True, check=True)
+    assert selected.stdout.strip() not in ("", "t3.micro")
+
+
+def test_auto_packer_vars_are_declared_in_builder_template(composer):
+    declared = set(re.findall(r'^variable "(\w+)"', (ENGINE_DIR / "builder.pkr.hcl").read_text(encoding='utf-8'),
+                              re.MULTILINE))
+    config = composer.generate_build_config("t", "dev", SELECTION, parameters=AUTO)
+    command = composer.generate_packer_command(config)
+    assert {"root_volume_size", "root_volume_throughput"} <= declared
+    assert "-var=\"root_volume_throughput=" in command
@@ -0,0 +1,98 @@
+"""建構時間剖析: 解析 Packer machine-readable 日誌並與歷史比較"""
+
+import json
+
+from build_timing import compare_profiles, load_profiles, parse_machine_readable_line, profile_log
+
+PLAN_STEPS = [
+    {'block': "base-os", 'step': "update", 'script': "/blocks/base/os/update.sh"},
+    {'block': "app-a", 'step': "install", 'script': "/blocks/application/a/install.sh"},
+    {'block': "app-b", 'step': "install", 'script': "/blocks/application/b/install.sh"},
+]
+
+
+def ui(timestamp, message):
+    return f"{timestamp},amazon-ebs,ui,say,==> amazon-ebs: {message}\n"
+
+
+def test_parse_line_unescapes_data():
+    assert parse_machine_readable_line("12,amazon-ebs,ui,say,a%!(PACKER_COMMA) b\\nc\n") == (
+        12, "amazon-ebs", "ui", ["say", "a, b\nc"])
+    assert parse_machine_readable_line("==> amazon-ebs: plain output") is None
+
+
+def test_shell_provisioners_map_to_blocks():
+    profile = profile_log([
+        ui(100, "Launching a source AWS instance..."),
+        ui(130, "Provisioning with shell script: /tmp/update.sh"),
+        ui(150, "Provisioning with shell script: /tmp/install.sh"),
+        ui(190, "Provisioning with shell script: /tmp/install.sh"),
+        ui(200, "Stopping the source instance..."),
+        "not a machine-readable line\n",
+        ui(260, "AMI: ami-123"),
+    ], PLAN_STEPS)
+    assert profile['total_seconds'] == 160 and profile['lines'] == 6
+    # 同檔名的 install.sh 依序指派給不同積木
+    assert profile['blocks'] == {
+        'base-os': {'seconds': 20, 'steps': {'update': 20}},
+        'app-a': {'seconds': 40, 'steps': {'install': 40}},
+        'app-b': {'seconds': 10, 'steps': {'install': 10}},
+    }
+    assert profile['overhead'] == {'launch': 30, 'finalize': 60}
+    assert profile['failed_step'] is None
+
+
+def test_overlapping_bundle_markers_and_failure():
+    profile = profile_log([
+        ui(0, "Launching a source AWS instance..."),
+        ui(20, "Uploading /tmp/bundle => /tmp/block-bundle"),
+        ui(30, "==> [1/3] base-os: update 開始"),
+        ui(50, "==> [1/3] base-os: update 完成"),
+        ui(50, "==> [2/3] app-a: install 開始"),
+        ui(55, "==> [3/3] app-b: install 開始"),
+        ui(80, "==> [3/3] app-b: install 失敗"),
+        ui(90, "==> [2/3] app-a: install 完成"),
+        ui(100, "Creating AMI block-test"),
+    ], PLAN_STEPS)
+    assert profile['blocks'] == {
+        'base-os': {'seconds': 20, 'steps': {'update': 20}},
+        'app-a': {'seconds': 40, 'steps': {'install': 40}},
+        'app-b': {'seconds': 25, 'steps': {'install': 25}},
+    }
+    assert profile['overhead'] == {'launch': 20, 'upload': 10, 'finalize': 10}
+    assert profile['failed_step'] == ["app-b", "install"]
+
+
+def test_unfinished_marker_closes_at_end_of_log():
+    profile = profile_log([
+        ui(0, "Launching a source AWS instance..."),
+        ui(10, "==> [1/1] app-a: install 開始"),
+        ui(70, "Build 'amazon-ebs' errored"),
+    ], PLAN_STEPS)
+    assert profile['blocks'] == {'app-a': {'seconds': 60, 'steps': {'install': 60}}}
+    assert profile['overhead'] == {'launch': 10}
+
+
+def test_compare_profiles_against_history_median(tmp_path):
+    def profile(**seconds):
+        return {'blocks': {block_id: {'seconds': value} for block_id, value in seconds.items()}}
+
+    history = [profile(a=100, b=100), profile(a=110, b=100), profile(a=300)]
+    current = profile(a=150, b=128, c=999)
+    assert compare_profiles(current, history) == [{
+        'block': "a", 'seconds': 150, 'baseline_seconds': 110, 'delta_seconds': 40, 'samples': 3
+    }]
+    # b 超過門檻比例但增加不足 min_seconds
+    assert [r['block'] for r in compare_profiles(current, history, min_seconds=10)] == ["a", "b"]
+
+    nested = tmp_path / "history" / "2024"
+    nested.mkdir(parents=True)
+    for index, item in enumerate(history):
+        (nested / f"{index}.json").write_text(json.dumps(item), encoding='utf-8')
+    (nested / "broken.json").write_text("{", encoding='utf-8')
+    (nested / "other.json").write_text(json.dumps({'builds': []}), encoding='utf-8')
+    current_path = nested / "current.json"
+    current_path.write_text(json.dumps(current), encoding='utf-8')
+
+    assert load_profiles([str(tmp_path / "history")], exclude=str(current_path)) == history
+    assert load_profiles([str(current_path)]) == [current]
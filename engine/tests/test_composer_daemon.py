@@ -0,0 +1,117 @@
+"""組合器常駐服務: JSON-RPC 錯誤處理、客戶端呼叫與 block.yaml 變更後重新載入"""
+
+import json
+import socket
+import threading
+
+import pytest
+
+import composer_client
+from composer_client import ComposerClient
+from composer_daemon import (INVALID_PARAMS, INVALID_REQUEST, METHOD_NOT_FOUND, PARSE_ERROR, SERVER_ERROR,
+                             ComposerServer, ComposerService)
+from test_dependencies import make_composer, write_block
+
+
+def write_registry(root):
+    write_block(root, "base", "base-os", provides=["linux-os"], order=1)
+    write_block(root, "application", "app-a", requires=["linux-os", "tls"])
+
+
+def set_requires(root, requires):
+    block_yaml = root / "application" / "app-a" / "block.yaml"
+    block = json.loads(block_yaml.read_text(encoding='utf-8'))
+    block['block']['requires'] = requires
+    block_yaml.write_text(json.dumps(block), encoding='utf-8')
+
+
+@pytest.fixture
+def server(tmp_path):
+    write_registry(tmp_path)
+    # reload_interval 設為很大，只有 reload 請求會重新載入
+    server = ComposerServer(str(tmp_path / "d.sock"), ComposerService(make_composer(tmp_path), 3600))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join(5)
+
+
+def error_code(service, line):
+    return service.handle_line(line)['error']['code']
+
+
+def test_service_error_responses(tmp_path):
+    write_registry(tmp_path)
+    service = ComposerService(make_composer(tmp_path), 3600)
+    assert error_code(service, b"{not json") == PARSE_ERROR
+    assert error_code(service, b'{"id": 1}') == INVALID_REQUEST
+    assert error_code(service, b'{"id": 1, "method": "nope"}') == METHOD_NOT_FOUND
+    assert error_code(service, b'{"id": 1, "method": "validate", "params": []}') == INVALID_PARAMS
+    assert error_code(service, b'{"id": 1, "method": "validate", "params": {"bogus": 1}}') == INVALID_PARAMS
+    assert error_code(service, b'{"id": 1, "method": "compose", "params": {"blocks": ["app-nope"]}}') == SERVER_ERROR
+
+    response = service.handle_line(b'{"jsonrpc": "2.0", "id": 7, "method": "ping"}')
+    assert response['id'] == 7 and response['result']['pong'] is True
+    requests = service.stats()['requests']
+    assert requests['validate'] == dict(requests['validate'], count=2, errors=2)
+    assert requests['ping']['errors'] == 0
+
+
+def test_client_pipelines_requests_and_reload_picks_up_changes(server, tmp_path):
+    with ComposerClient(server.socket_path) as client:
+        assert not client.call("validate", blocks=["base-os", "app-a"])['valid']
+        version = client.call("ping")['registry_version']
+
+        set_requires(tmp_path, ["linux-os"])
+        # 未到 reload_interval，仍使用已載入的註冊表
+        assert not client.call("validate", blocks=["base-os", "app-a"])['valid']
+        reloaded = client.call("reload")
+        assert reloaded['changed'] and reloaded['registry_version'] != version
+        assert client.call("validate", blocks=["app-a", "base-os"])['valid']
+        assert client.call("reload")['changed'] is False
+
+        with pytest.raises(ValueError, match="未知的方法"):
+            client.call("nope")
+        stats = client.call("stats")
+        assert stats['blocks'] == 2
+        assert stats['reloads']['checks'] == 2 and stats['reloads']['changed'] == 1
+        assert stats['requests']['validate']['count'] == 3
+
+
+def test_shutdown_request_stops_server(tmp_path):
+    write_registry(tmp_path)
+    socket_path = tmp_path / "d.sock"
+    server = ComposerServer(str(socket_path), ComposerService(make_composer(tmp_path)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    with ComposerClient(str(socket_path)) as client:
+        assert client.call("shutdown") == {'stopping': True}
+    thread.join(5)
+    assert not thread.is_alive()
+    server.server_close()
+    assert not socket_path.exists()
+
+
+def test_stale_socket_is_replaced_and_live_socket_is_refused(server, tmp_path):
+    with pytest.raises(RuntimeError, match="已有常駐服務"):
+        ComposerServer(server.socket_path, ComposerService(make_composer(tmp_path)))
+
+    stale_path = str(tmp_path / "stale.sock")
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(stale_path)
+    stale.close()
+    replacement = ComposerServer(stale_path, ComposerService(make_composer(tmp_path)))
+    replacement.server_close()
+
+
+def test_client_cli(server, tmp_path, capsys, monkeypatch):
+    monkeypatch.setenv(composer_client.SOCKET_ENV, server.socket_path)
+    assert composer_client.main(["validate", "base-os", "app-a"]) == 1
+    assert json.loads(capsys.readouterr().out)['valid'] is False
+    assert composer_client.main(["--params", '{"category": "base"}', "query"]) == 0
+    assert json.loads(capsys.readouterr().out)['count'] == 1
+
+    assert composer_client.main(["--socket", str(tmp_path / "missing.sock"), "ping"]) == 2
+    assert "無法連線到常駐服務" in capsys.readouterr().out
@@ -0,0 +1,59 @@
+"""依賴驗證: 缺少的功能、循環依賴與分層排序"""
+
+import json
+
+from conftest import load_block_composer
+
+
+def write_block(root, category, block_id, provides=(), requires=(), order=50, **fields):
+    block_dir = root / category / block_id
+    block_dir.mkdir(parents=True)
+    block = dict(fields, id=block_id, name=block_id, category=category, provides=list(provides),
+                 requires=list(requires), execution_order=order)
+    # JSON 是 YAML 的子集，直接以 JSON 寫出
+    (block_dir / "block.yaml").write_text(json.dumps({'block': block}), encoding='utf-8')
+
+
+def make_composer(tmp_path):
+    return load_block_composer().BlockComposer(str(tmp_path), use_cache=False)
+
+
+def test_missing_provider_names_candidates(composer):
+    result = composer.validate_dependencies(["app-docker"])
+    assert not result['valid']
+    assert result['errors'] == [
+        "積木 'app-docker' 需要以下功能但未提供: linux-os"
+        "（linux-os 可由 base-amazon-linux-2, base-ubuntu-2004 提供）"
+    ]
+    assert result['execution_order'] == []
+
+
+def test_unknown_block_is_reported(composer):
+    result = composer.validate_dependencies(["base-ubuntu-2004", "app-nope"])
+    assert result['errors'] == ["積木 'app-nope' 不存在"]
+
+
+def test_cycle_is_detected(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1)
+    write_block(tmp_path, "application", "app-a", provides=["a"], requires=["linux-os", "b"])
+    write_block(tmp_path, "application", "app-b", provides=["b"], requires=["linux-os", "a"])
+    result = make_composer(tmp_path).validate_dependencies(["base-os", "app-a", "app-b"])
+    assert not result['valid']
+    assert result['errors'] == ["積木之間存在循環依賴: app-a, app-b"]
+
+
+def test_layers_are_deterministic(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1)
+    write_block(tmp_path, "application", "app-z", provides=["z"], requires=["linux-os"], order=40)
+    write_block(tmp_path, "application", "app-y", provides=["y"], requires=["linux-os"], order=40)
+    write_block(tmp_path, "application", "app-x", provides=["x"], requires=["linux-os"], order=60)
+    write_block(tmp_path, "configuration", "config-w", requires=["x", "y"], order=10)
+    composer = make_composer(tmp_path)
+
+    expected = [["base-os"], ["app-y", "app-z", "app-x"], ["config-w"]]
+    # 同層依 execution_order、再依 ID 排序，與選擇的順序無關
+    for selection in (["config-w", "app-x", "app-z", "app-y", "base-os"],
+                      ["base-os", "app-y", "app-x", "config-w", "app-z"]):
+        result = composer.validate_dependencies(selection)
+        assert result['execution_layers'] == expected
+        assert result['execution_order'] == [block_id for layer in expected for block_id in layer]
@@ -0,0 +1,42 @@
+"""建構指紋: 相同內容必定相同，任何影響產物的變更都會改變"""
+
+from conftest import load_block_composer
+from test_dependencies import make_composer, write_block
+
+WEB = ["base-ubuntu-2004", "app-docker", "app-openresty"]
+PARAMETERS = {"region": "us-east-1", "base_ami_id": "ami-123"}
+
+
+def fingerprint(composer, selection=WEB, name="web", environment="dev", parameters=PARAMETERS):
+    return composer.generate_build_config(name, environment, selection, parameters=dict(parameters))[
+        'build_info']['fingerprint']
+
+
+def test_fingerprint_ignores_selection_order_and_build_name(composer):
+    expected = fingerprint(composer)
+    assert fingerprint(composer, ["app-openresty", "app-docker", "base-ubuntu-2004", "app-docker"]) == expected
+    assert fingerprint(composer, name="another-name") == expected
+    assert fingerprint(load_block_composer().BlockComposer(composer.blocks_path, use_cache=False)) == expected
+
+
+def test_fingerprint_changes_with_build_inputs(composer):
+    expected = fingerprint(composer)
+    changed = [
+        fingerprint(composer, environment="prod"),
+        fingerprint(composer, WEB[:2]),
+        fingerprint(composer, parameters=dict(PARAMETERS, region="ap-northeast-1")),
+        fingerprint(composer, parameters=dict(PARAMETERS, base_ami_id="ami-456")),
+        fingerprint(composer, parameters=dict(PARAMETERS, block_parameters={"app-openresty": {"port": 8080}})),
+    ]
+    assert expected not in changed and len(set(changed)) == len(changed)
+
+
+def test_fingerprint_follows_script_content(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1, scripts={"update": "update.sh"})
+    script = tmp_path / "base" / "base-os" / "update.sh"
+    script.write_text("#!/bin/bash\napt-get update\n", encoding='utf-8')
+    before = fingerprint(make_composer(tmp_path), ["base-os"])
+    assert fingerprint(make_composer(tmp_path), ["base-os"]) == before
+
+    script.write_text("#!/bin/bash\napt-get update -q\n", encoding='utf-8')
+    assert fingerprint(make_composer(tmp_path), ["base-os"]) != before
@@ -0,0 +1,37 @@
+"""變更影響分析的重新執行範圍"""
+
+from impact import REPO_ROOT, analyze_impact, map_files_to_blocks
+
+WEB = {'name': 'web', 'path': 'web.json',
+       'selections': [["base-ubuntu-2004", "app-docker", "app-openresty", "config-security"]]}
+
+
+def test_rerun_starts_at_first_changed_position(composer):
+    order = composer.validate_dependencies(WEB['selections'][0])['execution_order']
+    report = analyze_impact(composer, [str(REPO_ROOT / "blocks/applications/openresty/block.yaml")], [WEB])
+
+    [definition] = report['stale_definitions']
+    # 中間層快取以前綴為鍵，排在 app-openresty 之後的積木即使不依賴它也要重新執行
+    assert definition['rerun_blocks'] == order[order.index("app-openresty"):]
+    assert "config-security" in definition['rerun_blocks']
+    assert "base-ubuntu-2004" not in definition['rerun_blocks']
+
+
+def test_global_change_reruns_everything(composer):
+    order = composer.validate_dependencies(WEB['selections'][0])['execution_order']
+    report = analyze_impact(composer, [str(REPO_ROOT / "engine/script_bundle.py")], [WEB])
+    assert report['stale_definitions'][0]['rerun_blocks'] == order
+
+
+def test_unrelated_change_leaves_definition(composer):
+    report = analyze_impact(composer, [str(REPO_ROOT / "blocks/custom/my-app/block.yaml")], [WEB])
+    assert report['stale_definitions'] == []
+
+
+def test_relative_paths_resolve_against_repo_root(composer, monkeypatch, tmp_path):
+    # CLI 由 engine/ 執行，--files 仍以 repo 根目錄為基準
+    monkeypatch.chdir(tmp_path)
+    mapping = map_files_to_blocks(composer, ["blocks/applications/openresty/block.yaml",
+                                             "engine/script_bundle.py"])
+    assert list(mapping['blocks']) == ["app-openresty"]
+    assert mapping['global'] == [str(REPO_ROOT / "engine/script_bundle.py")]
@@ -0,0 +1,92 @@
+"""矩陣展開，以及以假的 packer 執行檔測試 PackerExecutor"""
+
+import json
+import sys
+import textwrap
+
+import pytest
+
+from matrix import PackerExecutor, expand_matrix, read_manifest_artifacts
+
+# 模擬 manifest post-processor：附加到既有的 packer-manifest.json，並更新 last_run_uuid
+FAKE_PACKER = textwrap.dedent('''\
+    import json, os, signal, sys, time
+    mode = sys.argv[1]
+    if mode == "hang":
+        def interrupted(signum, frame):
+            open("interrupted", "w").close()
+            sys.exit(1)
+        signal.signal(signal.SIGINT, interrupted)
+        time.sleep(60)
+    manifest = {"builds": []}
+    if os.path.exists("packer-manifest.json"):
+        with open("packer-manifest.json") as f:
+            manifest = json.load(f)
+    run_uuid = "run-%d" % len(manifest["builds"])
+    manifest["builds"].append({"artifact_id": "us-east-1:" + mode, "packer_run_uuid": run_uuid})
+    manifest["last_run_uuid"] = run_uuid
+    with open("packer-manifest.json", "w") as f:
+        json.dump(manifest, f)
+''')
+
+
+def test_spec_without_base_blocks_is_one_selection(composer):
+    jobs = expand_matrix(composer, {
+        'name': "web", 'blocks': ["base-ubuntu-2004", "app-docker"], 'regions': ["us-east-1", "ap-northeast-1"]
+    })
+    assert [job['id'] for job in jobs] == ["dev-us-east-1-base-ubuntu-2004", "dev-ap-northeast-1-base-ubuntu-2004"]
+    assert jobs[0]['build_config']['blocks']['enabled'] == ["base-ubuntu-2004", "app-docker"]
+
+
+def test_base_blocks_expand_per_base(composer):
+    jobs = expand_matrix(composer, {
+        'blocks': ["base-ubuntu-2004", "app-docker"], 'base_blocks': ["base-ubuntu-2004", "base-amazon-linux-2"]
+    })
+    assert [job['base_block'] for job in jobs] == ["base-ubuntu-2004", "base-amazon-linux-2"]
+    assert jobs[1]['build_config']['blocks']['enabled'] == ["base-amazon-linux-2", "app-docker"]
+
+
+def test_spec_without_blocks_is_rejected(composer):
+    with pytest.raises(ValueError):
+        expand_matrix(composer, {'name': "empty"})
+
+
+def make_job(tmp_path, mode):
+    script = tmp_path / "fake_packer.py"
+    script.write_text(FAKE_PACKER, encoding='utf-8')
+    job_dir = tmp_path / "job"
+    job_dir.mkdir(exist_ok=True)
+    return {
+        'id': 'job', 'environment': 'dev', 'region': 'us-east-1', 'base_block': 'base-ubuntu-2004',
+        'build_config': {'build_info': {'fingerprint': 'f' * 64}},
+        'cwd': str(job_dir), 'command': [sys.executable, str(script), mode]
+    }
+
+
+def test_rerun_reports_only_new_artifacts(tmp_path):
+    executor = PackerExecutor()
+    first = executor._run_job(make_job(tmp_path, "ami-old"))
+    second = executor._run_job(make_job(tmp_path, "ami-new"))
+    assert first['artifacts'] == ["us-east-1:ami-old"]
+    assert second['artifacts'] == ["us-east-1:ami-new"]
+
+
+def test_manifest_filtered_by_last_run(tmp_path):
+    manifest_path = tmp_path / "packer-manifest.json"
+    manifest_path.write_text(json.dumps({
+        'last_run_uuid': 'b',
+        'builds': [
+            {'artifact_id': 'us-east-1:ami-old', 'packer_run_uuid': 'a'},
+            {'artifact_id': 'us-east-1:ami-new', 'packer_run_uuid': 'b'}
+        ]
+    }), encoding='utf-8')
+    assert read_manifest_artifacts(manifest_path) == ["us-east-1:ami-new"]
+
+
+def test_timeout_interrupts_before_kill(tmp_path):
+    executor = PackerExecutor(timeout=1, interrupt_grace=10)
+    result = executor._run_job(make_job(tmp_path, "hang"))
+    assert result['returncode'] == -1
+    assert result['status'] == 'failure'
+    assert (tmp_path / "job" / "interrupted").exists()
+    assert "已中斷 packer" in (tmp_path / "job" / "packer.log").read_text(encoding='utf-8')
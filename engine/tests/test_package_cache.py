@@ -0,0 +1,107 @@
+"""以假的套件檔測試離線套件包的依賴展開"""
+
+import io
+import struct
+import tarfile
+
+from package_cache import DirectoryFetcher, PackageBundleCache
+
+
+def make_deb(directory, name, depends="", provides=""):
+    """寫出只含 control 的 deb 檔（ar 封存 + control.tar.gz）"""
+    control = f"Package: {name}\nVersion: 1.0\nArchitecture: amd64\n"
+    if depends:
+        control += f"Depends: {depends}\n"
+    if provides:
+        control += f"Provides: {provides}\n"
+    control_tar = io.BytesIO()
+    with tarfile.open(fileobj=control_tar, mode='w:gz') as archive:
+        data = control.encode('utf-8')
+        info = tarfile.TarInfo("./control")
+        info.size = len(data)
+        archive.addfile(info, io.BytesIO(data))
+
+    members = [("debian-binary", b"2.0\n"), ("control.tar.gz", control_tar.getvalue()),
+               ("data.tar.gz", b"")]
+    ar = b"!<arch>\n"
+    for member, data in members:
+        ar += f"{member:<16}{0:<12}{0:<6}{0:<6}{'100644':<8}{len(data):<10}`\n".encode('ascii')
+        ar += data + (b"\n" if len(data) % 2 else b"")
+    path = directory / f"{name}_1.0_amd64.deb"
+    path.write_bytes(ar)
+    return path
+
+
+def make_rpm(directory, name, requires=(), provides=()):
+    """寫出只含 lead、空簽章標頭與 Name / Provides / Requires 標籤的 rpm 檔"""
+    def header(entries):
+        index, store = b"", b""
+        for tag, data_type, values in entries:
+            index += struct.pack(">iiii", tag, data_type, len(store), len(values))
+            store += b"".join(value.encode('utf-8') + b"\0" for value in values)
+        return b"\x8e\xad\xe8\x01\0\0\0\0" + struct.pack(">ii", len(entries), len(store)) + index + store
+
+    signature = header([])
+    main = header([(1000, 6, [name]), (1047, 8, [name] + list(provides)),
+                   (1049, 8, ["rpmlib(CompressedFileNames)"] + list(requires))])
+    path = directory / f"{name}-1.0-1.x86_64.rpm"
+    path.write_bytes(b"\xed\xab\xee\xdb" + b"\0" * 92 + signature + b"\0" * (-len(signature) % 8) + main)
+    return path
+
+
+def test_deb_dependencies_are_bundled(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    make_deb(mirror, "docker-ce", depends="containerd.io (>= 1.4.1), iptables, libc6:any")
+    make_deb(mirror, "containerd.io", depends="libseccomp2 | libseccomp-dev")
+    make_deb(mirror, "libseccomp2")
+    make_deb(mirror, "unrelated")
+
+    files, missing = DirectoryFetcher(str(mirror)).fetch(["docker-ce", "jq"], "apt")
+    assert sorted(path.name for path in files) == [
+        "containerd.io_1.0_amd64.deb", "docker-ce_1.0_amd64.deb", "libseccomp2_1.0_amd64.deb"
+    ]
+    # iptables 與 libc6 不在鏡像目錄中，視為基礎映像已有
+    assert missing == ["jq"]
+
+
+def test_deb_virtual_package_resolved_by_provides(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    make_deb(mirror, "nginx", depends="httpd-base")
+    make_deb(mirror, "nginx-common", provides="httpd-base")
+
+    files, missing = DirectoryFetcher(str(mirror)).fetch(["nginx"], "apt")
+    assert [path.name for path in files] == ["nginx-common_1.0_amd64.deb", "nginx_1.0_amd64.deb"]
+    assert missing == []
+
+
+def test_rpm_dependencies_are_bundled(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    make_rpm(mirror, "docker", requires=["containerd", "libc.so.6()(64bit)"])
+    make_rpm(mirror, "containerd", requires=["runc"])
+    make_rpm(mirror, "runc")
+    make_rpm(mirror, "unrelated")
+
+    files, missing = DirectoryFetcher(str(mirror)).fetch(["docker"], "yum")
+    assert sorted(path.name for path in files) == [
+        "containerd-1.0-1.x86_64.rpm", "docker-1.0-1.x86_64.rpm", "runc-1.0-1.x86_64.rpm"
+    ]
+    assert missing == []
+
+
+def test_bundle_contains_dependency(tmp_path):
+    mirror = tmp_path / "mirror"
+    mirror.mkdir()
+    make_deb(mirror, "docker-ce", depends="containerd.io")
+    make_deb(mirror, "containerd.io")
+    plan = {'package_manager': 'apt', 'install': ['docker-ce']}
+
+    cache = PackageBundleCache(str(tmp_path / "cache"))
+    record = cache.stage("a" * 64, plan, DirectoryFetcher(str(mirror)))
+    with tarfile.open(record['path']) as archive:
+        names = archive.getnames()
+    assert "containerd.io_1.0_amd64.deb" in names
+    assert record['files'] == 2
+    assert record['complete']
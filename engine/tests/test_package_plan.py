@@ -0,0 +1,69 @@
+"""套件合併: 跨積木去重、OS 家族、條件包住的呼叫與產生的腳本"""
+
+from package_plan import (collect_packages, count_guarded_invocations, invokes_package_manager,
+                          plan_invocations, render_install_script)
+
+GUARDED = """#!/bin/bash
+set -e
+if [ "${BLOCK_PACKAGES_PREINSTALLED:-0}" != "1" ]; then
+  sudo apt-get update
+  # sudo apt-get install -y ignored
+  sudo apt-get install -y -q docker-ce
+fi
+sudo apt-get install -y jq
+"""
+
+
+def test_packages_merge_in_first_seen_order():
+    plan = collect_packages([
+        {'id': "base", 'packages': {'install': ["curl", "git"]}},
+        {'id': "none", 'packages': None},
+        {'id': "docker", 'packages': {'repositories': [{'name': "docker", 'source': "deb x"}],
+                                      'install': ["docker-ce", "curl"]}},
+        {'id': "compose", 'packages': {'repositories': [{'name': "docker", 'source': "deb y"}],
+                                       'install': ["git", "docker-compose-plugin"]}},
+    ], "debian")
+    assert plan['blocks'] == ["base", "docker", "compose"]
+    assert plan['install'] == ["curl", "git", "docker-ce", "docker-compose-plugin"]
+    # 倉庫依名稱去重，保留第一個宣告
+    assert plan['repositories'] == [{'name': "docker", 'source': "deb x"}]
+
+
+def test_plan_uses_packages_of_the_os_family(composer):
+    blocks = ["app-docker", "config-security"]
+    debian = composer.plan_packages(composer.generate_build_config("t", "dev", ["base-ubuntu-2004"] + blocks))
+    amazon = composer.plan_packages(composer.generate_build_config("t", "dev", ["base-amazon-linux-2"] + blocks))
+    assert debian['package_manager'] == "apt" and "fail2ban" in debian['install']
+    assert debian['refresh'] and [repo['name'] for repo in debian['repositories']] == ["docker"]
+    # 這些積木都沒有宣告 amazon-linux 的套件，不產生合併步驟
+    assert amazon is None
+
+
+def test_guard_regex_counts_only_guarded_calls():
+    assert count_guarded_invocations(GUARDED) == 2
+    assert invokes_package_manager(GUARDED)
+    # 合併步驟已安裝時，只剩條件外的 jq 會取得套件資料庫鎖
+    assert invokes_package_manager(GUARDED, preinstalled=True)
+    assert not invokes_package_manager(GUARDED.replace("sudo apt-get install -y jq", "jq --version"),
+                                       preinstalled=True)
+
+
+def test_install_script_is_one_transaction():
+    plan = {'blocks': ["a", "b"], 'install': ["curl", "git"]}
+    apt = render_install_script(plan, "apt")
+    assert apt.splitlines()[-1] == "sudo apt-get install -y curl git"
+    dnf = render_install_script(plan, "dnf", local_dir="/tmp/pkgs")
+    assert dnf.splitlines()[-3:] == ["set -- /tmp/pkgs/*.rpm", '[ -e "$1" ] || set --',
+                                     'sudo dnf install -y "$@" curl git']
+
+
+def test_invocations_compare_block_scripts_with_plan(tmp_path):
+    script = tmp_path / "install.sh"
+    script.write_text(GUARDED, encoding='utf-8')
+    plan = {'install': ["docker-ce"]}
+    assert plan_invocations(plan, "apt", True, [str(script), str(tmp_path / "missing.sh")]) == {
+        'before': 2, 'after': 2, 'removed': 0
+    }
+    assert plan_invocations(plan, "yum", True, [str(script), str(script)]) == {
+        'before': 4, 'after': 1, 'removed': 3
+    }
@@ -0,0 +1,61 @@
+"""建構專用 Packer 模板的內容"""
+
+import json
+
+from packer_template import render_packer_template
+from script_bundle import REMOTE_BUNDLE_DIR, build_script_bundle
+
+
+def render(composer, selection, bundle_dir=None, parameters=None):
+    config = composer.generate_build_config("t", "dev", selection, parameters=parameters)
+    steps = composer.build_plan_steps(config)
+    bundle = build_script_bundle(steps, str(bundle_dir)) if bundle_dir else None
+    return config, render_packer_template(config, steps, bundle)
+
+
+def shell_provisioners(template):
+    return [p['shell'] for p in template['build']['provisioner'] if 'shell' in p]
+
+
+def test_template_contains_only_selected_blocks(composer):
+    config, template = render(composer, ["base-ubuntu-2004", "app-docker"])
+    scripts = [script for shell in shell_provisioners(template) for script in shell.get('scripts', [])]
+    assert scripts and not any("openresty" in script or "security" in script for script in scripts)
+    assert scripts.index(next(s for s in scripts if "/docker/" in s)) > scripts.index(
+        next(s for s in scripts if "/ubuntu-2004/" in s))
+
+    docker = next(shell for shell in shell_provisioners(template)
+                  if any("/docker/scripts/debian/" in script for script in shell.get('scripts', [])))
+    assert docker['expect_disconnect'] is True
+    # 已有合併的套件步驟，積木腳本以環境變數略過自己的安裝
+    assert docker['environment_vars'] == ["DEBIAN_FRONTEND=noninteractive", "BLOCK_PACKAGES_PREINSTALLED=1"]
+
+    assert template['variable']['enabled_blocks'] == {
+        'type': "list(string)", 'default': ["base-ubuntu-2004", "app-docker"]
+    }
+    custom_data = template['build']['post-processor'][0]['manifest']['custom_data']
+    assert json.loads(custom_data['block_hashes']) == config['build_info']['block_hashes']
+    assert "launch_block_device_mappings" not in template['source']['amazon-ebs']['dynamic']
+
+
+def test_bundle_runs_each_segment_in_its_own_provisioner(composer, tmp_path):
+    config, template = render(composer, ["base-ubuntu-2004", "app-docker"], bundle_dir=tmp_path)
+    provisioners = template['build']['provisioner']
+    uploads = [p['file'] for p in provisioners if 'file' in p]
+    assert len(uploads) == 1 and uploads[0]['source'].startswith(str(tmp_path))
+
+    run_sh = f"bash {REMOTE_BUNDLE_DIR}/run.sh"
+    shells = shell_provisioners(template)[1:]
+    assert [shell['inline'][-1] for shell in shells[:-1]] == [f"{run_sh} --start 1", f"{run_sh} --start 2"]
+    assert [shell.get('expect_disconnect', False) for shell in shells] == [False, True, False]
+    # 中斷連線的段之後，下一個 provisioner 先確認它的結束代碼
+    assert shells[2]['inline'] == [f"{run_sh} --await 2", f"{run_sh} --start 3", f"sudo rm -rf {REMOTE_BUNDLE_DIR}"]
+
+
+def test_auto_instance_sets_root_volume(composer):
+    config, template = render(composer, ["base-amazon-linux-2", "app-docker"],
+                              parameters={'instance_type': "auto"})
+    [mapping] = template['source']['amazon-ebs']['dynamic']['launch_block_device_mappings']
+    assert mapping['device_name'] == "/dev/xvda"
+    assert mapping['throughput'] == "${var.root_volume_throughput}"
+    assert template['variable']['root_volume_size']['default'] == config['packer_vars']['root_volume_size']
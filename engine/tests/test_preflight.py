@@ -0,0 +1,32 @@
+"""建構前靜態檢查的 OS 支援判斷"""
+
+
+def test_os_agnostic_block_with_other_packages_only_warns(composer):
+    # config-security 沒有 os_support，只宣告了 debian 的套件
+    result = composer.preflight(["base-amazon-linux-2", "config-security"])
+    assert not any("OS 家族" in error for error in result['errors'])
+    assert any("config-security" in warning and "amazon-linux" in warning for warning in result['warnings'])
+
+
+def test_block_without_matching_os_support_is_error(composer):
+    composer.blocks_registry["custom-my-app"]["os_support"] = [
+        entry for entry in composer.blocks_registry["custom-my-app"]["os_support"] if entry['os_family'] != "amazon-linux"
+    ]
+    result = composer.preflight(["base-amazon-linux-2", "custom-my-app"])
+    assert "積木 'custom-my-app' 不支援 OS 家族 'amazon-linux'（支援: debian, rhel）" in result['errors']
+
+
+def test_unlisted_os_version_warns(composer):
+    composer.blocks_registry["custom-my-app"]["os_support"][0]['os_versions'] = ["22.04"]
+    result = composer.preflight(["base-ubuntu-2004", "custom-my-app"])
+    assert "積木 'custom-my-app' 未列出 debian 20.04 的支援" in result['warnings']
+
+
+def test_second_base_block_checked_by_os_info(composer):
+    result = composer.preflight(["base-ubuntu-2004", "base-amazon-linux-2", "app-docker"])
+    # 以其中一個基礎積木的 os_info 決定 OS，另一個基礎積木的 os_info 不符
+    other = "base-ubuntu-2004" if result['os_info']['family'] == "amazon-linux" else "base-amazon-linux-2"
+    assert [error for error in result['errors'] if "不支援 OS 家族" in error] == [
+        f"積木 '{other}' 不支援 OS 家族 '{result['os_info']['family']}'"
+        f"（支援: {composer.blocks_registry[other]['os_info']['family']}）"
+    ]
@@ -0,0 +1,63 @@
+"""積木註冊表快取: 以解析後路徑為鍵，依 mtime/size/內容雜湊決定是否重新解析"""
+
+import json
+import os
+
+from registry_cache import CACHE_FORMAT_VERSION, RegistryCache
+
+
+def write_yaml(path, version):
+    path.write_text(f'block:\n  id: "app-x"\n  version: "{version}"\n', encoding='utf-8')
+
+
+def test_key_is_resolved_path(tmp_path, monkeypatch):
+    block_yaml = tmp_path / "block.yaml"
+    write_yaml(block_yaml, "1")
+    cache = RegistryCache(str(tmp_path / "cache.json"))
+    config, digest = cache.load(block_yaml)
+    assert config['block']['version'] == "1"
+
+    monkeypatch.chdir(tmp_path)
+    assert cache.load("block.yaml") == (config, digest)
+    assert list(cache.entries) == [str(block_yaml.resolve())]
+    assert cache.stats == {'hits': 1, 'rehashed': 0, 'parsed': 1, 'removed': 0}
+
+
+def test_mtime_only_change_is_rehashed_not_parsed(tmp_path):
+    block_yaml = tmp_path / "block.yaml"
+    write_yaml(block_yaml, "1")
+    cache = RegistryCache(str(tmp_path / "cache.json"))
+    cache.load(block_yaml)
+
+    stat = block_yaml.stat()
+    os.utime(block_yaml, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    cache.load(block_yaml)
+    assert cache.stats['rehashed'] == 1
+
+    write_yaml(block_yaml, "2")
+    assert cache.load(block_yaml)[0]['block']['version'] == "2"
+    assert cache.stats == {'hits': 0, 'rehashed': 1, 'parsed': 2, 'removed': 0}
+
+
+def test_snapshot_roundtrip_prune_and_version(tmp_path):
+    kept, removed = tmp_path / "kept.yaml", tmp_path / "removed.yaml"
+    write_yaml(kept, "1")
+    write_yaml(removed, "1")
+    cache_file = tmp_path / "cache.json"
+    cache = RegistryCache(str(cache_file))
+    cache.load(kept)
+    cache.load(removed)
+    cache.prune([kept])
+    cache.save()
+    assert cache.stats['removed'] == 1
+
+    reopened = RegistryCache(str(cache_file))
+    assert list(reopened.entries) == [str(kept.resolve())]
+    reopened.load(kept)
+    assert reopened.stats['hits'] == 1
+
+    # 格式版本不同的快照整份捨棄
+    snapshot = json.loads(cache_file.read_text(encoding='utf-8'))
+    snapshot['version'] = CACHE_FORMAT_VERSION + 1
+    cache_file.write_text(json.dumps(snapshot), encoding='utf-8')
+    assert RegistryCache(str(cache_file)).entries == {}
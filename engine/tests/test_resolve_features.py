@@ -0,0 +1,46 @@
+"""依功能自動挑選積木組合"""
+
+from test_dependencies import make_composer, write_block
+
+UBUNTU = {'family': "debian", 'version': "20.04"}
+
+
+def test_repo_features_resolve_to_minimal_selection(composer):
+    result = composer.resolve_features(["docker", "web-server"], "base-ubuntu-2004")
+    assert result['valid'], result['errors']
+    assert sorted(result['selected_blocks']) == ["app-docker", "app-openresty", "base-ubuntu-2004"]
+    assert result['execution_layers'][0] == ["base-ubuntu-2004"]
+
+
+def test_greedy_prefers_block_covering_more_features(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1, os_info=UBUNTU)
+    write_block(tmp_path, "application", "app-a", provides=["a"], requires=["linux-os"])
+    write_block(tmp_path, "application", "app-b", provides=["b"], requires=["linux-os"])
+    write_block(tmp_path, "application", "app-ab", provides=["a", "b"], requires=["linux-os"])
+    result = make_composer(tmp_path).resolve_features(["a", "b"], "base-os")
+    assert result['selected_blocks'] == ["base-os", "app-ab"]
+
+
+def test_requires_of_chosen_blocks_are_resolved(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1, os_info=UBUNTU)
+    write_block(tmp_path, "application", "app-web", provides=["web"], requires=["linux-os", "runtime"])
+    write_block(tmp_path, "application", "app-runtime", provides=["runtime"], requires=["linux-os"])
+    result = make_composer(tmp_path).resolve_features(["web"], "base-os")
+    assert result['valid']
+    assert result['execution_layers'] == [["base-os"], ["app-runtime"], ["app-web"]]
+
+
+def test_providers_must_support_the_base_os(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1, os_info=UBUNTU)
+    write_block(tmp_path, "application", "app-rhel-only", provides=["db"], requires=["linux-os"],
+                os_support=[{'os_family': "rhel", 'os_versions': ["9"]}])
+    write_block(tmp_path, "application", "app-old-ubuntu", provides=["db"], requires=["linux-os"],
+                os_support=[{'os_family': "debian", 'os_versions': ["18.04"]}])
+    result = make_composer(tmp_path).resolve_features(["db"], "base-os")
+    assert not result['valid']
+    assert result['errors'] == ["功能 'db' 沒有支援 debian 20.04 的積木可提供"]
+
+
+def test_unknown_base_block(composer):
+    result = composer.resolve_features(["docker"], "base-nope")
+    assert result['errors'] == ["積木 'base-nope' 不存在"]
@@ -0,0 +1,141 @@
+"""本地沙箱: 工作目錄、替身指令與後端的呼叫方式"""
+
+import subprocess
+
+import pytest
+
+import sandbox_runner
+from package_plan import PACKAGES_BLOCK, PREINSTALLED_ENV
+from sandbox_runner import SANDBOX_MOUNT, ChrootBackend, ContainerBackend, prepare_workspace, run_plan
+
+
+class HostBackend:
+    """直接在主機上執行步驟，沙箱路徑即工作目錄中的實際路徑"""
+
+    name = "host"
+
+    def __init__(self):
+        self.work_dir = None
+        self.stopped = False
+
+    def start(self, work_dir):
+        self.work_dir = work_dir
+
+    def sandbox_path(self, relative):
+        return str(self.work_dir / relative)
+
+    def run(self, script, env, timeout):
+        return subprocess.run(["bash", script], cwd=env['HOME'], env=env, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True, timeout=timeout)
+
+    def stop(self):
+        self.stopped = True
+
+
+def step(block, name, inline, phase="install"):
+    return {'block': block, 'step': name, 'phase': phase, 'inline': inline}
+
+
+def test_prepare_workspace_writes_steps_and_stubs(tmp_path):
+    script = tmp_path / "install.sh"
+    script.write_text("#!/bin/bash\necho from-file\n", encoding='utf-8')
+    plan = [step("app-a", "configure nginx", "echo inline"),
+            {'block': "app-b", 'step': "install", 'phase': "install", 'script': str(script)}]
+    entries = prepare_workspace(tmp_path / "work", plan, ["apt-get"])
+
+    assert [entry['file'] for entry in entries] == ["001-app-a-configure-nginx.sh", "002-app-b-install.sh"]
+    steps_dir = tmp_path / "work" / "steps"
+    assert (steps_dir / entries[0]['file']).read_text(encoding='utf-8') == "#!/bin/bash\nset -e\necho inline\n"
+    assert (steps_dir / entries[1]['file']).read_text(encoding='utf-8') == script.read_text(encoding='utf-8')
+    assert sorted(p.name for p in (tmp_path / "work" / "bin").iterdir()) == ["apt-get", "sudo"]
+    assert (tmp_path / "work" / "bin" / "sudo").stat().st_mode & 0o111
+
+
+def test_run_plan_records_stub_calls_and_stops_on_failure(tmp_path):
+    plan = [
+        step(PACKAGES_BLOCK, "install", "sudo -u root -E apt-get install -y nginx\n"
+                                        f"echo preinstalled=${PREINSTALLED_ENV}"),
+        step("app-a", "enable", "systemctl enable nginx\necho $DEBIAN_FRONTEND"),
+        step("app-b", "broken", "echo about to fail\nexit 3"),
+        step("app-c", "never", "touch never-ran"),
+    ]
+    backend = HostBackend()
+    seen = []
+    report = run_plan(plan, backend, work_dir=str(tmp_path), on_result=seen.append)
+
+    assert backend.stopped and report['backend'] == "host" and report['work_dir'] == str(tmp_path)
+    assert [r['status'] for r in report['steps']] == ["success", "success", "failed", "skipped"]
+    assert (report['succeeded'], report['failed'], report['skipped']) == (2, 1, 1)
+    assert [r['stub_calls'] for r in report['steps']] == [
+        ["apt-get install -y nginx"], ["systemctl enable nginx"], [], []
+    ]
+    assert report['steps'][2]['exit_code'] == 3
+    assert report['steps'][2]['output_tail'] == ["about to fail"]
+    assert len(seen) == 3
+
+    logs = tmp_path / "logs"
+    assert (logs / f"001-{PACKAGES_BLOCK}-install.log").read_text(encoding='utf-8') == "preinstalled=1\n"
+    assert (logs / "002-app-a-enable.log").read_text(encoding='utf-8') == "noninteractive\n"
+    assert not (tmp_path / "home" / "never-ran").exists()
+
+
+def test_run_plan_keep_going_and_temporary_workspace(tmp_path):
+    plan = [step("app-a", "fail", "exit 1"), step("app-b", "yum", "yum install -y git")]
+    report = run_plan(plan, HostBackend(), os_family="rhel", stub_packages=False,
+                      extra_stubs=["git"], keep_going=True)
+    assert [r['status'] for r in report['steps']] == ["failed", "failed"]
+    # 未替換套件管理指令時 yum 不在替身中
+    assert report['steps'][1]['stub_calls'] == []
+    assert report['work_dir'] is None
+
+
+def test_container_backend_commands(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_run(command, **kwargs):
+        calls.append(command)
+        return subprocess.CompletedProcess(command, 0, stdout="abc123\n", stderr="")
+
+    monkeypatch.setattr(sandbox_runner.subprocess, "run", fake_run)
+    backend = ContainerBackend("ubuntu:20.04", runtime="podman")
+    backend.start(tmp_path)
+    assert calls[0] == ["podman", "run", "-d", "--rm", "-v", f"{tmp_path}:{SANDBOX_MOUNT}",
+                        "ubuntu:20.04", "sleep", "infinity"]
+    assert backend.sandbox_path("bin") == f"{SANDBOX_MOUNT}/bin"
+
+    backend.run(f"{SANDBOX_MOUNT}/steps/001-a.sh", {'HOME': f"{SANDBOX_MOUNT}/home", 'A': "1"}, 5)
+    assert calls[2] == ["podman", "exec", "-w", f"{SANDBOX_MOUNT}/home", "-e", f"HOME={SANDBOX_MOUNT}/home",
+                        "-e", "A=1", "abc123", "bash", f"{SANDBOX_MOUNT}/steps/001-a.sh"]
+    backend.stop()
+    backend.stop()
+    assert calls[3:] == [["podman", "rm", "-f", "abc123"]]
+
+
+def test_container_backend_requires_runtime(tmp_path):
+    backend = ContainerBackend("ubuntu:20.04")
+    backend.runtime = None
+    with pytest.raises(RuntimeError, match="docker 或 podman"):
+        backend.start(tmp_path)
+
+
+def test_chroot_backend_checks_and_cleanup(tmp_path, monkeypatch):
+    rootfs = tmp_path / "rootfs"
+    rootfs.mkdir()
+    backend = ChrootBackend(str(rootfs))
+    monkeypatch.setattr(sandbox_runner.os, "geteuid", lambda: 1000)
+    with pytest.raises(RuntimeError, match="root 權限"):
+        backend.start(tmp_path)
+    monkeypatch.setattr(sandbox_runner.os, "geteuid", lambda: 0)
+    with pytest.raises(RuntimeError, match="不是有效的 rootfs"):
+        backend.start(tmp_path)
+
+    # 結束時將替身呼叫記錄複製回工作目錄並移除 rootfs 中的複本
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    target = rootfs / SANDBOX_MOUNT.lstrip('/')
+    target.mkdir()
+    (target / "stub-calls.log").write_text("1\tapt-get update\n", encoding='utf-8')
+    backend.work_dir = work_dir
+    backend.stop()
+    assert not target.exists()
+    assert (work_dir / "stub-calls.log").read_text(encoding='utf-8') == "1\tapt-get update\n"
@@ -0,0 +1,186 @@
+"""腳本包的執行段切分與執行器"""
+
+import json
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from script_bundle import build_script_bundle
+
+needs_tools = pytest.mark.skipif(
+    not all(shutil.which(tool) for tool in ("bash", "setsid", "nohup", "flock")),
+    reason="需要 bash、setsid、nohup 與 flock"
+)
+
+WEB = ["base-ubuntu-2004", "app-docker", "app-openresty", "config-security"]
+
+
+def build_bundle(composer, selection, tmp_path, workers, extra_dependencies=None):
+    config = composer.generate_build_config("t", "dev", selection)
+    steps = composer.build_plan_steps(config)
+    dependencies = composer.plan_step_dependencies(config, steps)
+    for block_id, upstream in (extra_dependencies or {}).items():
+        dependencies[block_id] = dependencies[block_id] + upstream
+    bundle = build_script_bundle(steps, str(tmp_path), dependencies, workers)
+    with tarfile.open(bundle['path']) as archive:
+        plan = json.load(archive.extractfile("plan.json"))
+    return bundle, plan
+
+
+def stub_step(block, step, command="true", phase="main", disconnect=False):
+    """以 inline 腳本代替積木腳本，執行時把自己記錄到 BUNDLE_LOG"""
+    return {'block': block, 'step': step, 'phase': phase, 'expect_disconnect': disconnect,
+            'inline': f'echo "{block}/{step}" >> "$BUNDLE_LOG"\n{command}'}
+
+
+def unpack(steps, tmp_path, dependencies=None, workers=1):
+    bundle = build_script_bundle(steps, str(tmp_path / "out"), dependencies, workers)
+    bundle_dir = tmp_path / "bundle"
+    with tarfile.open(bundle['path']) as archive:
+        archive.extractall(bundle_dir)
+    return bundle, bundle_dir
+
+
+def run_bundle(bundle_dir, tmp_path, *args):
+    log = tmp_path / "steps.log"
+    result = subprocess.run(["bash", str(bundle_dir / "run.sh"), *args], capture_output=True, text=True,
+                            env={'PATH': "/usr/bin:/bin", 'BUNDLE_LOG': str(log)}, timeout=60)
+    return result, log.read_text().split() if log.exists() else []
+
+
+def segment_blocks(plan):
+    segments = {}
+    for step in plan['steps']:
+        if step['phase'] == 'main':
+            segments.setdefault(step.get('segment', 1), set()).add(step['block'])
+    return segments
+
+
+def test_sequential_runner_splits_at_each_disconnecting_block(composer, tmp_path):
+    bundle, plan = build_bundle(composer, WEB, tmp_path, workers=1)
+    assert [segment['disconnect'] for segment in bundle['segments']] == [False, True, False, True, False]
+
+
+def test_concurrent_runner_shares_segment_between_independent_blocks(composer, tmp_path):
+    bundle, plan = build_bundle(composer, WEB, tmp_path, workers=4)
+    # 三個積木只依賴基礎積木與套件步驟，即使 app-docker、config-security 會中斷連線也在同一段並行
+    assert segment_blocks(plan) == {
+        1: {"base-ubuntu-2004", "packages", "app-docker", "app-openresty", "config-security"}
+    }
+    assert bundle['segments'] == [{'id': 1, 'disconnect': True}, {'id': 2, 'disconnect': False}]
+    assert {step['phase'] for step in plan['steps'] if step['segment'] == 2} == {"validate", "cleanup"}
+
+
+def test_dependent_of_disconnecting_block_waits_for_next_segment(composer, tmp_path):
+    bundle, plan = build_bundle(composer, WEB, tmp_path, workers=4,
+                                extra_dependencies={"app-openresty": ["app-docker"]})
+    segments = segment_blocks(plan)
+    assert "app-docker" in segments[1] and "config-security" in segments[1]
+    assert segments[2] == {"app-openresty"}
+    assert [segment['disconnect'] for segment in bundle['segments']] == [True, False]
+
+
+@needs_tools
+def test_runner_executes_steps_in_plan_order(tmp_path):
+    steps = [stub_step("base", "update"), stub_step("app", "install"), stub_step("app", "validate", phase="validate")]
+    bundle, bundle_dir = unpack(steps, tmp_path)
+    result, executed = run_bundle(bundle_dir, tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert executed == ["base/update", "app/install", "app/validate"]
+    assert "==> [2/3] app: install 完成" in result.stdout
+    assert result.stdout.rstrip().endswith("==> 全部 3 個步驟執行完成")
+
+
+@needs_tools
+def test_runner_stops_at_first_failure(tmp_path):
+    steps = [stub_step("base", "update"), stub_step("app", "install", "exit 7"), stub_step("app", "configure")]
+    bundle, bundle_dir = unpack(steps, tmp_path)
+    result, executed = run_bundle(bundle_dir, tmp_path)
+    assert result.returncode == 7
+    assert executed == ["base/update", "app/install"]
+    assert "==> [2/3] app: install 失敗 (exit 7)" in result.stderr
+    assert "全部" not in result.stdout
+
+
+@needs_tools
+def test_segments_run_detached_and_are_awaited(tmp_path):
+    steps = [stub_step("base", "update"), stub_step("docker", "install", disconnect=True),
+             stub_step("app", "install")]
+    bundle, bundle_dir = unpack(steps, tmp_path)
+    assert [segment['disconnect'] for segment in bundle['segments']] == [False, True, False]
+
+    # 每個 provisioner: 等待上一段結束並確認結束代碼，再於新的 session 啟動下一段
+    executed = []
+    for segment in (1, 2, 3):
+        if segment > 1:
+            result, executed = run_bundle(bundle_dir, tmp_path, "--await", str(segment - 1))
+            assert result.returncode == 0, result.stderr
+        result, executed = run_bundle(bundle_dir, tmp_path, "--start", str(segment))
+        assert result.returncode == 0, result.stderr
+        assert (bundle_dir / "segments" / f"{segment}.rc").read_text().strip() == "0"
+    assert executed == ["base/update", "docker/install", "app/install"]
+    assert "==> 全部 3 個步驟執行完成" in result.stdout
+
+
+@needs_tools
+def test_failed_segment_fails_the_await(tmp_path):
+    steps = [stub_step("docker", "install", "exit 3", disconnect=True), stub_step("app", "install")]
+    bundle, bundle_dir = unpack(steps, tmp_path)
+    result, executed = run_bundle(bundle_dir, tmp_path, "--start", "1")
+    assert result.returncode == 3
+    # 之後的 provisioner 重新連線後也會看到同樣的失敗，不會繼續下一段
+    result, executed = run_bundle(bundle_dir, tmp_path, "--await", "1")
+    assert result.returncode == 3
+    assert executed == ["docker/install"]
+
+
+@needs_tools
+def test_concurrent_runner_orders_units_by_dependencies(tmp_path):
+    steps = [stub_step("base", "update"),
+             stub_step("slow", "install", 'sleep 1; echo "slow/done" >> "$BUNDLE_LOG"; echo installed'),
+             stub_step("fast", "install"), stub_step("after-slow", "install")]
+    dependencies = {"slow": ["base"], "fast": ["base"], "after-slow": ["slow"]}
+    bundle, bundle_dir = unpack(steps, tmp_path, dependencies, workers=4)
+    result, executed = run_bundle(bundle_dir, tmp_path)
+    assert result.returncode == 0, result.stderr
+    # fast 與 slow 同時執行，after-slow 等到 slow 完成才開始
+    assert executed[0] == "base/update"
+    assert executed.index("fast/install") < executed.index("slow/done") < executed.index("after-slow/install")
+    # 單元的輸出依計畫順序加上 [單元] 前綴輸出
+    assert "[slow] installed" in result.stdout
+    assert result.stdout.rstrip().endswith("==> 全部 4 個步驟執行完成")
+
+
+@needs_tools
+def test_concurrent_runner_stops_scheduling_after_failure(tmp_path):
+    steps = [stub_step("base", "update"), stub_step("broken", "install", "exit 5"),
+             stub_step("slow", "install", 'sleep 1; echo "slow/done" >> "$BUNDLE_LOG"'),
+             stub_step("after-broken", "install"), stub_step("broken", "validate", phase="validate")]
+    dependencies = {"broken": ["base"], "slow": ["base"], "after-broken": ["broken"]}
+    bundle, bundle_dir = unpack(steps, tmp_path, dependencies, workers=4)
+    result, executed = run_bundle(bundle_dir, tmp_path)
+    # 已在執行的單元會跑完，之後不再啟動新單元，並以失敗單元的結束代碼停止
+    assert result.returncode == 5
+    assert "slow/done" in executed
+    assert "after-broken/install" not in executed and "broken/validate" not in executed
+    assert "==> [2/5] broken: install 失敗 (exit 5)" in result.stderr
+
+
+@needs_tools
+def test_package_manager_steps_hold_the_lock(tmp_path):
+    # 含有套件管理工具呼叫的步驟以 flock 互斥，彼此不會重疊
+    locked = ': apt-get install -y stub; echo "{0}/start" >> "$BUNDLE_LOG"; sleep 0.5; echo "{0}/end" >> "$BUNDLE_LOG"'
+    steps = [stub_step("base", "update"), stub_step("one", "install", locked.format("one")),
+             stub_step("two", "install", locked.format("two")), stub_step("free", "install", "sleep 0.2")]
+    dependencies = {"one": ["base"], "two": ["base"], "free": ["base"]}
+    bundle, bundle_dir = unpack(steps, tmp_path, dependencies, workers=4)
+    plan = json.loads((bundle_dir / "plan.json").read_text())
+    assert [step['locked'] for step in plan['steps']] == [False, True, True, False]
+
+    result, executed = run_bundle(bundle_dir, tmp_path)
+    assert result.returncode == 0, result.stderr
+    marks = [line for line in executed if line.endswith(("/start", "/end"))]
+    assert marks in (["one/start", "one/end", "two/start", "two/end"],
+                     ["two/start", "two/end", "one/start", "one/end"])
@@ -0,0 +1,56 @@
+"""validate-batch 的 LRU 驗證快取: 命中、淘汰與註冊表變更後失效"""
+
+import json
+
+from conftest import BLOCKS_DIR, load_block_composer
+from test_dependencies import write_block
+
+
+def make_composer(blocks_path, size):
+    return load_block_composer().BlockComposer(str(blocks_path), use_cache=False, validation_cache_size=size)
+
+
+def test_same_set_in_any_order_hits_the_cache():
+    composer = make_composer(BLOCKS_DIR, 4)
+    results = list(composer.validate_batch([
+        ["base-ubuntu-2004", "app-docker"],
+        {'id': "again", 'blocks': ["app-docker", "base-ubuntu-2004", "app-docker"]},
+        "not-a-list"
+    ]))
+    assert composer.validation_cache_stats == {'hits': 1, 'misses': 1}
+    assert [result['id'] for result in results] == [0, "again", 2]
+    assert results[1]['execution_order'] == results[0]['execution_order']
+    assert results[2]['errors'] == ["輸入格式錯誤: 需要積木 ID 列表"]
+
+    # 回傳副本，修改結果不影響快取
+    results[0]['execution_order'].clear()
+    assert composer.validate_dependencies_cached(["base-ubuntu-2004", "app-docker"])['execution_order']
+
+
+def test_least_recently_used_entry_is_evicted():
+    composer = make_composer(BLOCKS_DIR, 2)
+    ubuntu, amazon, docker = ["base-ubuntu-2004"], ["base-amazon-linux-2"], ["base-ubuntu-2004", "app-docker"]
+    composer.validate_dependencies_cached(ubuntu)
+    composer.validate_dependencies_cached(amazon)
+    composer.validate_dependencies_cached(ubuntu)      # ubuntu 成為最近使用
+    composer.validate_dependencies_cached(docker)      # 淘汰 amazon
+    assert list(composer.validation_cache) == [frozenset(ubuntu), frozenset(docker)]
+
+    composer.validate_dependencies_cached(amazon)
+    assert composer.validation_cache_stats == {'hits': 1, 'misses': 4}
+
+
+def test_registry_change_invalidates_cache(tmp_path):
+    write_block(tmp_path, "base", "base-os", provides=["linux-os"], order=1)
+    write_block(tmp_path, "application", "app-a", requires=["linux-os", "tls"])
+    composer = make_composer(tmp_path, 8)
+    assert not composer.validate_dependencies_cached(["base-os", "app-a"])['valid']
+
+    block_yaml = tmp_path / "application" / "app-a" / "block.yaml"
+    block = json.loads(block_yaml.read_text(encoding='utf-8'))
+    block['block']['requires'] = ["linux-os"]
+    block_yaml.write_text(json.dumps(block), encoding='utf-8')
+    assert composer.reload()
+    assert not composer.validation_cache
+    assert composer.validate_dependencies_cached(["base-os", "app-a"])['valid']
+    assert composer.validation_cache_stats == {'hits': 0, 'misses': 2}